@@ -5,8 +5,8 @@ This script will take two match links as input, and print a markdown results
 post, much like the ones seen on r/ELTP
 """
 
-from tagpro_eu import Team
 from tagpro_eu import download_match
+from tagpro_eu import halves_switched
 
 url1 = input('Half 1: ')
 url2 = input('Half 2: ')
@@ -14,47 +14,15 @@ url2 = input('Half 2: ')
 h1 = download_match(url=url1)
 h2 = download_match(url=url2)
 
-switched_in_second_half = None  # "Uncertain"
-
 t1 = h1.team_red.name
 t2 = h1.team_blue.name
 
-if t1 != 'Red' and t2 != 'Blue':
-    if h2.team_red.name == t1 and h2.team_blue.name == t2:
-        switched_in_second_half = False
-    elif h2.team_red.name == t2 and h2.team_blue.name == t1:
-        switched_in_second_half = True
-
-if switched_in_second_half is None:
-    p1 = h1.team_red.players
-    p2 = h1.team_blue.players
-
-    def find_player(match, player):
-        for p in match.players:
-            if p.name == player:
-                return p
-        return None
-
-    def number_on_team_h2(players, team):
-        c = 0
-        for p in players:
-            if p in h2.team(team).players:
-                c += 1
-        return c
-
-    switched = number_on_team_h2(p1, Team.blue) +\
-        number_on_team_h2(p2, Team.red)
-    stayed = number_on_team_h2(p1, Team.red) +\
-        number_on_team_h2(p2, Team.blue)
-
-    if stayed > switched:
-        switched_in_second_half = False
-    elif switched > stayed:
-        switched_in_second_half = True
-    else:  # Give up and ask the user
-        print("Did teams switch between halves? (y/n)")
-        inp = input().lower()
-        switched_in_second_half = inp.startswith('y')
+switched_in_second_half = halves_switched(h1, h2)
+
+if switched_in_second_half is None:  # Give up and ask the user
+    print("Did teams switch between halves? (y/n)")
+    inp = input().lower()
+    switched_in_second_half = inp.startswith('y')
 
 s1r = h1.team_red.score
 s1b = h1.team_blue.score
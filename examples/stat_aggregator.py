@@ -13,16 +13,11 @@ import sys
 from collections import defaultdict
 
 
-links = sys.stdin.readlines()
+links = [line.strip() for line in sys.stdin.readlines() if line.strip()]
 
 stats = defaultdict(tagpro_eu.player.PlayerStats)
 
-for l in links:
-    link = l.strip()
-    if not link:
-        continue
-
-    match = tagpro_eu.web.download_match(link)
+for match in tagpro_eu.web.download_matches(links, max_workers=4, rate=5):
     for player in match.players:
         stats[player.name] += player.stats
 
@@ -24,6 +24,11 @@ setup(
     keywords='tagpro',
 
     install_requires='requests',
+    extras_require={
+        'numpy': ['numpy'],
+        'async': ['aiohttp'],
+        'scipy': ['numpy', 'scipy'],
+    },
     python_requires='>=3.6',
 
     test_suite='test',
@@ -1,8 +1,21 @@
 from .blob import *
 from .bulk import *
+from .cache import *
 from .constants import *
+from .cooccurrence import *
 from .data import *
+from .dataset import *
+from .form import *
+from .heatmap import *
+from .index import *
+from .interaction import *
+from .leaderboard import *
 from .map import *
 from .match import *
 from .player import *
+from .series import *
+from .sketch import *
+from .state import *
+from .store import *
+from .table import *
 from .web import *
@@ -1,5 +1,7 @@
 import base64
 
+from tagpro_eu.util import require_numpy
+
 
 class Blob:
     """
@@ -96,6 +98,18 @@ class Blob:
 
         return self.read_fixed(size) + minimum
 
+    def unpack_bits(self):
+        """
+        Return the blob data as a numpy array of bits (one uint8 per bit), to
+        be used for vectorized decoding. This ignores the pointer.
+
+        This method requires numpy.
+
+        :returns: the array of bits
+        """
+        np = require_numpy()
+        return np.unpackbits(np.frombuffer(self.data, dtype=np.uint8))
+
     def reset(self):
         """
         Reset the pointer to the start of the blob.
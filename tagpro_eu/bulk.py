@@ -1,9 +1,119 @@
+import bz2
+import glob
+import gzip
+import heapq
 import json
+import lzma
+import os
+import tempfile
 
 from tagpro_eu.map import Map
 from tagpro_eu.match import Match
 
 
+# Functions to open compressed bulk files with, by file extension
+OPENERS = {
+    '.gz': gzip.open,
+    '.bz2': bz2.open,
+    '.xz': lzma.open,
+}
+
+
+def open_bulk_file(path):
+    """
+    Open a bulk file for reading as text. Files ending in .gz, .bz2 or .xz
+    are decompressed while reading.
+
+    :param path: the path of the file
+    :returns: the opened file
+    """
+    opener = OPENERS.get(os.path.splitext(path)[1].lower(), open)
+    return opener(path, 'rt', encoding='utf-8')
+
+
+def bulk_files(source):
+    """
+    Yield the bulk files described by source, which can be:
+
+    - an open file
+    - the path of a file
+    - the path of a directory, in which case all files in it are used
+    - a glob pattern, like 'dumps/matches-2018-*.json.gz'
+    - a list of any of the above
+
+    Files found in a directory or through a glob pattern are yielded in
+    sorted order.
+
+    :param source: the files to use
+    :returns: open files and paths of files
+    """
+    if hasattr(source, 'read'):
+        yield source
+    elif isinstance(source, (str, os.PathLike)):
+        path = os.fspath(source)
+        if os.path.isdir(path):
+            for name in sorted(os.listdir(path)):
+                file = os.path.join(path, name)
+                if not name.startswith('.') and os.path.isfile(file):
+                    yield file
+        elif not os.path.exists(path) and glob.escape(path) != path:
+            yield from sorted(glob.glob(path))
+        else:
+            yield path
+    else:
+        for s in source:
+            yield from bulk_files(s)
+
+
+def load_json(f):
+    """
+    Load the JSON data from a bulk file.
+
+    :param f: an open file or the path of a file
+    :returns: the loaded data
+    """
+    if hasattr(f, 'read'):
+        return json.load(f)
+
+    with open_bulk_file(f) as fp:
+        return json.load(fp)
+
+
+def iter_raw_matches(source):
+    """
+    Yield the match IDs and raw JSON data of all matches in the given bulk
+    files, without creating Match objects. Matches that occur in multiple
+    files are only yielded once.
+
+    :param source: the bulk files, as described in bulk_files
+    :returns: (match ID, data) tuples
+    """
+    seen = set()
+
+    for f in bulk_files(source):
+        for k, v in load_json(f).items():
+            if k not in seen:
+                seen.add(k)
+                yield k, v
+
+
+def create_match(match_id, data, maps=None):
+    """
+    Create a Match object from the raw data of a match in a bulk file.
+
+    :param match_id: the match ID
+    :param data: the JSON data of the match
+    :param maps: the maps object (omit if undesired)
+    :returns: the Match object
+    """
+    match = Match(data)
+    match.match_id = match_id
+    match.map_id = data['mapId']
+    if maps is not None:
+        match.map = maps[match.map_id]
+    return match
+
+
 def load_matches(f, maps=None):
     """
     Read a file containing bulk match data, and yield the matches.
@@ -13,22 +123,21 @@ def load_matches(f, maps=None):
     MatchId values. The MatchId is added as the property match_id in the
     yielded Match objects.
 
+    Instead of a single open file, f can also be a path, a directory, a glob
+    pattern or a list of those (see bulk_files). Compressed files are
+    decompressed on the fly. Matches from multiple files are yielded file by
+    file, and matches that occur in more than one file are only yielded once.
+
     If you want, you can supply a maps object (also as downloaded from
     tagpro.eu) to fill map data from. This object can be loaded using the
     load_maps method.
 
-    :param f: a file descriptor to read matches from
+    :param f: a file descriptor or path(s) to read matches from
     :param maps: the maps object (omit if undesired)
     :returns: the matches contained in the file
     """
-    data = json.load(f)
-    for k, v in data.items():
-        match = Match(v)
-        match.match_id = k
-        match.map_id = v['mapId']
-        if maps is not None:
-            match.map = maps[match.map_id]
-        yield match
+    for k, v in iter_raw_matches(f):
+        yield create_match(k, v, maps)
 
 
 def load_maps(f):
@@ -36,8 +145,67 @@ def load_maps(f):
     Read a file and return a maps object to be used in bulk_matches.
     The bulk maps file can be downloaded from https://tagpro.eu/?science
 
-    :param f: a file descriptor to read maps from
+    Like in load_matches, f can also be one or more paths, directories or
+    glob patterns. The maps from all files are combined.
+
+    :param f: a file descriptor or path(s) to read maps from
     :returns: the maps object
     """
-    data = json.load(f)
-    return {int(k): Map(v) for k, v in data.items()}
+    maps = {}
+    for file in bulk_files(f):
+        maps.update((int(k), Map(v)) for k, v in load_json(file).items())
+    return maps
+
+
+def _date_key(item):
+    # Sort key for (date, match ID, ...) tuples. Numeric IDs are compared as
+    # numbers ('9' before '10'), and come before any other IDs, which are
+    # compared as strings.
+    date, k = item[0], item[1]
+    return (date, 0, int(k), k) if k.isdecimal() else (date, 1, 0, k)
+
+
+def iter_matches_by_date(source, maps=None, tmpdir=None):
+    """
+    Yield the matches in the given bulk files in chronological order, like
+    load_matches. Matches with the same date are ordered by match ID, as
+    numbers if they are numeric.
+
+    Every file is first sorted on its own and written to a temporary file.
+    These sorted runs are then merged, so only one file has to be loaded at
+    a time, and the merge only holds one match per file in memory.
+
+    :param source: the bulk files, as described in bulk_files
+    :param maps: the maps object (omit if undesired)
+    :param tmpdir: the directory to store temporary files in (omit to use
+    the system default)
+    :returns: the matches in chronological order
+    """
+    with tempfile.TemporaryDirectory(dir=tmpdir) as tmp:
+        runs = []
+
+        for i, f in enumerate(bulk_files(source)):
+            data = load_json(f)
+            keys = sorted(((v['date'], k) for k, v in data.items()),
+                          key=_date_key)
+
+            path = os.path.join(tmp, f'{i}.jsonl')
+            with open(path, 'w', encoding='utf-8') as out:
+                for date, k in keys:
+                    out.write(json.dumps([date, k, data[k]]))
+                    out.write('\n')
+
+            runs.append(path)
+            del data
+
+        def read_run(path):
+            with open(path, encoding='utf-8') as f:
+                for line in f:
+                    yield json.loads(line)
+
+        last = None
+        for date, k, v in heapq.merge(*map(read_run, runs), key=_date_key):
+            # Duplicates have the same date, so they are merged together
+            if (date, k) != last:
+                last = date, k
+                yield create_match(k, v, maps)
@@ -0,0 +1,235 @@
+from collections import OrderedDict, namedtuple
+import gzip
+import hashlib
+import json
+import os
+import tempfile
+import threading
+
+
+CacheEntry = namedtuple('CacheEntry', ['content', 'finished', 'etag',
+                                       'last_modified'])
+
+
+class MatchCache:
+    """
+    On-disk cache for downloaded match data, to be used with
+    tagpro_eu.web.download_match. Entries are stored gzip-compressed in a
+    directory, together with a small JSON file of metadata.
+
+    Match data doesn't change anymore once a match is finished, so those
+    entries are always used as-is. Entries of unfinished matches are
+    revalidated using their ETag or Last-Modified header.
+
+    When max_size is given, the least recently used entries are removed
+    whenever the cache grows larger than that. The sizes and last use of
+    the entries are kept in memory, so the directory is only scanned when
+    the cache is opened (or entries is called). The cache can be used from
+    multiple threads.
+    """
+    def __init__(self, directory, max_size=None):
+        """
+        :param directory: the directory to store the cache in, which is
+        created if it doesn't exist
+        :param max_size: the maximum total size of the cache in bytes (omit
+        for no limit)
+        """
+        self.directory = directory
+        self.max_size = max_size
+
+        # Key -> size, from least to most recently used
+        self._index = OrderedDict()
+        self._total = 0
+        self._lock = threading.RLock()
+
+        os.makedirs(directory, exist_ok=True)
+        self.entries()
+
+    @staticmethod
+    def key(id=None, raw_url=None):
+        """
+        Return the cache key for a match ID, or for a raw data URL if the ID
+        is not known.
+
+        :param id: the match ID
+        :param raw_url: the raw data URL
+        :returns: the cache key
+        """
+        if id is not None:
+            return f'match-{id}'
+        return 'url-' + hashlib.sha1(raw_url.encode('utf-8')).hexdigest()
+
+    def _path(self, key, suffix):
+        return os.path.join(self.directory, key + suffix)
+
+    def load(self, key):
+        """
+        Return the cached entry for the given key, or None if there is none.
+
+        :param key: the cache key
+        :returns: the CacheEntry, with the decompressed content
+        """
+        try:
+            # Both files are read under the lock, so a concurrent store can't
+            # pair the data of one version with the metadata of another
+            with self._lock:
+                with open(self._path(key, '.meta.json')) as f:
+                    meta = json.load(f)
+                with open(self._path(key, '.json.gz'), 'rb') as f:
+                    data = f.read()
+            content = gzip.decompress(data)
+        except (OSError, ValueError, EOFError):
+            return None
+
+        self.touch(key)
+
+        return CacheEntry(content, meta.get('finished'), meta.get('etag'),
+                          meta.get('last_modified'))
+
+    def touch(self, key):
+        """
+        Mark an entry as recently used.
+
+        :param key: the cache key
+        """
+        with self._lock:
+            try:
+                os.utime(self._path(key, '.json.gz'))
+            except OSError:
+                pass
+
+            if key in self._index:
+                self._index.move_to_end(key)
+
+    def store(self, key, content, finished, etag=None, last_modified=None):
+        """
+        Store match data in the cache.
+
+        :param key: the cache key
+        :param content: the raw (uncompressed) match data
+        :param finished: whether or not the match is finished
+        :param etag: the ETag header of the response
+        :param last_modified: the Last-Modified header of the response
+        """
+        self.store_compressed(key, gzip.compress(content), finished, etag,
+                              last_modified)
+
+    def store_compressed(self, key, data, finished, etag=None,
+                         last_modified=None):
+        """
+        Store gzip-compressed match data in the cache.
+
+        :param key: the cache key
+        :param data: the gzip-compressed match data
+        :param finished: whether or not the match is finished
+        :param etag: the ETag header of the response
+        :param last_modified: the Last-Modified header of the response
+        """
+        meta = {
+            'finished': finished,
+            'etag': etag,
+            'last_modified': last_modified,
+        }
+
+        meta = json.dumps(meta).encode('utf-8')
+
+        with self._lock:
+            self._write(self._path(key, '.json.gz'), data)
+            self._write(self._path(key, '.meta.json'), meta)
+
+            self._total += len(data) + len(meta) - self._index.pop(key, 0)
+            self._index[key] = len(data) + len(meta)
+
+            if self.max_size is not None:
+                self.evict(self.max_size)
+
+    def _write(self, path, data):
+        # Write to a temporary file first, so readers never see partial data
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp, path)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+
+    def entries(self):
+        """
+        Return the entries in the cache, as (last used, size, key) tuples
+        sorted from least to most recently used. This scans the directory,
+        and updates the sizes kept in memory. Metadata files without data
+        (left behind by an interrupted removal) are deleted.
+
+        :returns: list of entries
+        """
+        with self._lock:
+            entries = []
+            names = set(os.listdir(self.directory))
+
+            for name in names:
+                if name.endswith('.meta.json'):
+                    key = name[:-len('.meta.json')]
+                    if key + '.json.gz' not in names:
+                        self._unlink(self._path(key, '.meta.json'))
+                    continue
+
+                if not name.endswith('.json.gz'):
+                    continue
+
+                key = name[:-len('.json.gz')]
+                try:
+                    stat = os.stat(self._path(key, '.json.gz'))
+                    size = stat.st_size +\
+                        os.path.getsize(self._path(key, '.meta.json'))
+                except OSError:
+                    continue
+
+                entries.append((stat.st_mtime, size, key))
+
+            entries.sort()
+
+            self._index = OrderedDict((key, size) for _, size, key in entries)
+            self._total = sum(self._index.values())
+
+            return entries
+
+    def size(self):
+        """
+        Return the total size of the cache in bytes.
+        """
+        return self._total
+
+    def evict(self, max_size):
+        """
+        Remove the least recently used entries, until the cache is at most
+        max_size bytes large.
+
+        :param max_size: the size to shrink the cache to
+        """
+        with self._lock:
+            while self._total > max_size and self._index:
+                key = next(iter(self._index))
+                self.remove(key)
+
+    def remove(self, key):
+        """
+        Remove an entry from the cache.
+
+        :param key: the cache key
+        """
+        with self._lock:
+            for suffix in ('.json.gz', '.meta.json'):
+                self._unlink(self._path(key, suffix))
+
+            self._total -= self._index.pop(key, 0)
+
+    @staticmethod
+    def _unlink(path):
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+
+    def __repr__(self):
+        return f'MatchCache(directory={self.directory!r})'
@@ -0,0 +1,315 @@
+from bisect import bisect_right
+
+from tagpro_eu.constants import Team
+from tagpro_eu.util import require_numpy
+
+
+# The values stored for every pair of players
+COOCCURRENCE_FIELDS = ('together', 'opposed', 'diff_together',
+                       'diff_opposed')
+
+
+def match_caps(match):
+    """
+    Return the times of the captures of both teams in a match. These come
+    from the same pass over the events as the rosters (see
+    MatchTeam.cap_times).
+
+    :param match: the Match object
+    :returns: list of sorted lists of times, indexed by Team
+    """
+    caps = [[], [], []]
+    for team in match.teams:
+        caps[team.team] = team.cap_times
+    return caps
+
+
+def _count(times, start, end):
+    # Captures at the moment a player leaves still count for them, like in
+    # Player.caps_for
+    return bisect_right(times, end) - bisect_right(times, start)
+
+
+class CooccurrenceMatrix:
+    """
+    Sparse symmetric matrices of how often pairs of players played with and
+    against each other, in CSR format: the entries of row i are at
+    indptr[i]:indptr[i + 1] in indices (the column) and in the arrays of
+    every field:
+
+    - together: the number of games in which both players were on the same
+      team at the same time
+    - opposed: the number of games in which they were on opposing teams at
+      the same time
+    - diff_together: the cap difference of their team while they were on it
+      together
+    - diff_opposed: the cap difference of the row player's team minus the
+      column player's, while they were opposed (so this matrix is
+      antisymmetric)
+
+    This class requires numpy. SciPy matrices can be made using to_scipy.
+    """
+    def __init__(self, names, indptr, indices, data):
+        """
+        :param names: the player names, in the order of the rows
+        :param indptr: the row offsets
+        :param indices: the column of every entry
+        :param data: dict mapping every field to an array of values
+        """
+        self.names = list(names)
+        self.ids = {name: i for i, name in enumerate(self.names)}
+        self.indptr = indptr
+        self.indices = indices
+        self.data = data
+
+    def __getitem__(self, field):
+        """
+        Return the values of a field, in the order of indices.
+        """
+        return self.data[field]
+
+    def __len__(self):
+        return len(self.names)
+
+    def row(self, name):
+        """
+        Return the values of all players that played with or against the
+        given player.
+
+        :param name: the name of the player
+        :returns: dict mapping names to dicts of field values
+        """
+        i = self.ids.get(name)
+        if i is None:
+            return {}
+
+        start, end = self.indptr[i], self.indptr[i + 1]
+        return {
+            self.names[j]: {f: int(self.data[f][k])
+                            for f in COOCCURRENCE_FIELDS}
+            for k, j in zip(range(start, end), self.indices[start:end])
+        }
+
+    def get(self, a, b):
+        """
+        Return the values for a pair of players.
+
+        :param a: the name of the row player
+        :param b: the name of the column player
+        :returns: dict of field values (all zero if they never met)
+        """
+        np = require_numpy()
+
+        i, j = self.ids.get(a), self.ids.get(b)
+        if i is not None and j is not None:
+            start, end = self.indptr[i], self.indptr[i + 1]
+            k = start + np.searchsorted(self.indices[start:end], j)
+            if k < end and self.indices[k] == j:
+                return {f: int(self.data[f][k]) for f in COOCCURRENCE_FIELDS}
+
+        return {f: 0 for f in COOCCURRENCE_FIELDS}
+
+    def to_scipy(self, field):
+        """
+        Return a field as a scipy.sparse.csr_matrix.
+
+        :param field: the field, e.g. 'together'
+        :returns: the matrix
+        :raises ImportError: when scipy is not installed
+        """
+        try:
+            import scipy.sparse
+        except ImportError:
+            raise ImportError('This feature requires scipy, which can be '
+                              'installed using: pip install tagpro-eu[scipy]')
+
+        n = len(self.names)
+        return scipy.sparse.csr_matrix(
+            (self.data[field], self.indices, self.indptr), shape=(n, n))
+
+    def __repr__(self):
+        return f'CooccurrenceMatrix(players={len(self.names)}, ' \
+            f'entries={len(self.indices)})'
+
+
+class CooccurrenceBuilder:
+    """
+    Builds a CooccurrenceMatrix from many matches. Players are identified by
+    name. Whether two players were together or opposed is based on the
+    periods they spent on each team (see MatchTeam.roster), so a player who
+    switched teams can count as both, and players who were never in the
+    game at the same time don't count at all.
+
+    Pairs are collected in plain lists, which are regularly summed into
+    sorted numpy arrays, so no nested dicts are needed. Builders can be
+    combined using merge.
+
+    This class requires numpy.
+    """
+    # Number of buffered pairs after which they are summed
+    BUFFER_SIZE = 1 << 20
+
+    def __init__(self):
+        self.names = []
+        self.ids = {}
+
+        self._buffer = ([], [], [], [], [], [])
+        self._keys = None
+        self._values = None
+
+    def _id(self, name):
+        i = self.ids.get(name)
+        if i is None:
+            i = self.ids[name] = len(self.names)
+            self.names.append(name)
+        return i
+
+    def _append(self, i, j, together, opposed, diff):
+        buf = self._buffer
+        buf[0].append(i)
+        buf[1].append(j)
+        buf[2].append(together)
+        buf[3].append(opposed)
+        buf[4].append(diff if together else 0)
+        buf[5].append(diff if opposed else 0)
+
+    def add(self, match):
+        """
+        Add the pairs of players in a match.
+
+        :param match: the Match object
+        """
+        caps = match_caps(match)
+        periods = []
+
+        for team in match.teams:
+            t = team.team
+            for entry in team.roster:
+                periods.append((self._id(entry.player.name), t,
+                                entry.start, entry.end))
+
+        # Per pair: whether they were together or opposed, and the cap
+        # difference for the first player while they were
+        pairs = {}
+
+        for a in range(len(periods)):
+            i, ta, sa, ea = periods[a]
+            for b in range(a + 1, len(periods)):
+                j, tb, sb, eb = periods[b]
+                start, end = max(sa, sb), min(ea, eb)
+                if i == j or start >= end:
+                    continue
+
+                other = Team.blue if ta == Team.red else Team.red
+                diff = _count(caps[ta], start, end) - \
+                    _count(caps[other], start, end)
+
+                together = ta == tb
+                if i < j:
+                    key = (i, j, together)
+                else:
+                    key = (j, i, together)
+                    if not together:
+                        diff = -diff
+
+                pairs[key] = pairs.get(key, 0) + diff
+
+        # Every pair counts once per match, even with multiple periods
+        for (i, j, together), diff in pairs.items():
+            self._append(i, j, together, not together, diff)
+            self._append(j, i, together, not together,
+                         diff if together else -diff)
+
+        if len(self._buffer[0]) >= self.BUFFER_SIZE:
+            self._compact()
+
+    def update(self, matches):
+        """
+        Add multiple matches.
+
+        :param matches: iterable of Match objects
+        """
+        for match in matches:
+            self.add(match)
+
+    def _compact(self):
+        """
+        Sum the buffered pairs into the sorted arrays of keys and values.
+        """
+        np = require_numpy()
+
+        buf = self._buffer
+        if not buf[0]:
+            return
+
+        keys = np.array(buf[0], dtype=np.int64) << 32 | \
+            np.array(buf[1], dtype=np.int64)
+        values = np.array(buf[2:], dtype=np.int64)
+
+        if self._keys is not None:
+            keys = np.concatenate([self._keys, keys])
+            values = np.concatenate([self._values, values], axis=1)
+
+        self._keys, inverse = np.unique(keys, return_inverse=True)
+        self._values = np.zeros((len(COOCCURRENCE_FIELDS), len(self._keys)),
+                                dtype=np.int64)
+        for f in range(len(COOCCURRENCE_FIELDS)):
+            np.add.at(self._values[f], inverse.reshape(-1), values[f])
+
+        for b in buf:
+            b.clear()
+
+    def merge(self, other):
+        """
+        Add the pairs of another builder to this one.
+
+        :param other: the other CooccurrenceBuilder
+        :returns: self
+        """
+        np = require_numpy()
+
+        other._compact()
+        if other._keys is None:
+            return self
+
+        mapping = np.array([self._id(name) for name in other.names],
+                           dtype=np.int64)
+        rows = mapping[other._keys >> 32]
+        cols = mapping[other._keys & 0xffffffff]
+
+        buf = self._buffer
+        buf[0].extend(rows.tolist())
+        buf[1].extend(cols.tolist())
+        for f in range(len(COOCCURRENCE_FIELDS)):
+            buf[2 + f].extend(other._values[f].tolist())
+
+        self._compact()
+        return self
+
+    def build(self):
+        """
+        Return the CooccurrenceMatrix of all matches added so far.
+
+        :returns: the CooccurrenceMatrix
+        """
+        np = require_numpy()
+
+        self._compact()
+        n = len(self.names)
+
+        if self._keys is None:
+            keys = np.zeros(0, dtype=np.int64)
+            values = np.zeros((len(COOCCURRENCE_FIELDS), 0), dtype=np.int64)
+        else:
+            keys, values = self._keys, self._values
+
+        rows = keys >> 32
+        indptr = np.zeros(n + 1, dtype=np.int64)
+        np.cumsum(np.bincount(rows, minlength=n), out=indptr[1:])
+
+        return CooccurrenceMatrix(
+            self.names, indptr, keys & 0xffffffff,
+            {f: values[i].copy() for i, f in enumerate(COOCCURRENCE_FIELDS)})
+
+    def __repr__(self):
+        return f'CooccurrenceBuilder(players={len(self.names)})'
@@ -0,0 +1,503 @@
+import base64
+import concurrent.futures
+import datetime
+import gzip
+import hashlib
+import json
+import math
+import os
+
+from tagpro_eu.bulk import bulk_files, create_match, iter_raw_matches
+from tagpro_eu.bulk import load_json
+from tagpro_eu.map import Map
+
+
+class BloomFilter:
+    """
+    A Bloom filter of strings: a set that can tell for sure that a string is
+    not in it, and can give false positives. Bloom filters with the same size
+    can be combined using |=.
+    """
+    def __init__(self, bits=8192, hashes=4, data=None):
+        """
+        :param bits: the size of the filter in bits (a multiple of 8)
+        :param hashes: the number of bits set per string
+        :param data: the contents of the filter (omit for an empty filter)
+        """
+        self.bits = bits
+        self.hashes = hashes
+        self.data = bytearray(data) if data is not None\
+            else bytearray(bits // 8)
+
+    @classmethod
+    def for_capacity(cls, n, error_rate=0.01):
+        """
+        Create a filter of the optimal size for n strings.
+
+        :param n: the expected number of distinct strings
+        :param error_rate: the false positive rate with n strings added
+        :returns: the empty BloomFilter
+        """
+        n = max(n, 1)
+        bits = math.ceil(-n * math.log(error_rate) / math.log(2) ** 2)
+        bits = max(64, -(-bits // 64) * 64)
+        hashes = max(1, round(bits / n * math.log(2)))
+        return cls(bits, hashes)
+
+    def capacity(self, error_rate=0.01):
+        """
+        Return the number of distinct strings this filter can hold before
+        its false positive rate exceeds error_rate.
+        """
+        return -self.bits / self.hashes * \
+            math.log(1 - error_rate ** (1 / self.hashes))
+
+    def estimate(self):
+        """
+        Return the estimated number of distinct strings in the filter, based
+        on the number of bits set (infinite when all bits are set).
+        """
+        ones = bin(int.from_bytes(self.data, 'little')).count('1')
+        if ones == self.bits:
+            return math.inf
+        return -self.bits / self.hashes * math.log(1 - ones / self.bits)
+
+    def _positions(self, s):
+        digest = hashlib.blake2b(s.encode('utf-8'), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return ((h1 + i * h2) % self.bits for i in range(self.hashes))
+
+    def add(self, s):
+        """
+        Add a string to the filter.
+
+        :param s: the string to add
+        """
+        for pos in self._positions(s):
+            self.data[pos >> 3] |= 1 << (pos & 7)
+
+    def __contains__(self, s):
+        return all(self.data[pos >> 3] & 1 << (pos & 7)
+                   for pos in self._positions(s))
+
+    def __ior__(self, other):
+        if (self.bits, self.hashes) != (other.bits, other.hashes):
+            raise ValueError('Cannot combine Bloom filters of different size')
+
+        for i, b in enumerate(other.data):
+            self.data[i] |= b
+        return self
+
+    def to_dict(self):
+        return {
+            'bits': self.bits,
+            'hashes': self.hashes,
+            'data': base64.b64encode(bytes(self.data)).decode('ascii'),
+        }
+
+    @classmethod
+    def from_dict(cls, d):
+        return cls(d['bits'], d['hashes'], base64.b64decode(d['data']))
+
+
+def _timestamp(date):
+    if isinstance(date, datetime.datetime):
+        return date.timestamp()
+    return date
+
+
+class ShardInfo:
+    """
+    Manifest entry of a shard in a Dataset, which is used to skip shards that
+    can't contain matches for a query.
+
+    Player names are kept in a Bloom filter sized for the number of distinct
+    names in the shard. Names of added matches are collected until flush is
+    called, which adds them to the filter, or rebuilds it with a larger size
+    when it would get too full.
+    """
+    # The filter is rebuilt for this many times the current number of names,
+    # so shards that grow aren't rebuilt on every flush
+    GROWTH = 2
+
+    def __init__(self, min_date=None, max_date=None, map_ids=(), count=0,
+                 players=None):
+        self.min_date = min_date
+        self.max_date = max_date
+        self.map_ids = set(map_ids)
+        self.count = count
+        self.players = players
+        self.pending = set()
+
+    def add(self, data):
+        """
+        Update the manifest entry for a match added to the shard.
+
+        :param data: the raw JSON data of the match
+        """
+        date = data['date']
+        if self.min_date is None or date < self.min_date:
+            self.min_date = date
+        if self.max_date is None or date > self.max_date:
+            self.max_date = date
+
+        self.map_ids.add(data['mapId'])
+        self.count += 1
+
+        for player in data.get('players', ()):
+            self.pending.add(player['name'])
+
+    def flush(self, all_names, error_rate=0.01):
+        """
+        Add the names of the matches added since the last flush to the Bloom
+        filter.
+
+        :param all_names: function returning all names in the shard, which
+        is called when the filter has to be rebuilt
+        :param error_rate: the maximum false positive rate of the filter
+        """
+        if not self.pending:
+            return
+
+        players = self.players
+        if players is None:
+            # A new shard: the pending names are all of them
+            names = self.pending
+        else:
+            for name in self.pending:
+                players.add(name)
+            if players.estimate() <= players.capacity(error_rate):
+                self.pending = set()
+                return
+            names = set(all_names())
+
+        self.players = BloomFilter.for_capacity(self.GROWTH * len(names),
+                                                error_rate)
+        for name in names:
+            self.players.add(name)
+        self.pending = set()
+
+    def has_player(self, name):
+        """
+        Return whether or not the shard might contain matches of a player.
+        """
+        return name in self.pending or \
+            self.players is not None and name in self.players
+
+    def matches(self, date_from=None, date_to=None, map_ids=None,
+                players=None):
+        """
+        Return whether or not the shard might contain matches for the given
+        query. The parameters are the same as in Dataset.scan.
+        """
+        if date_from is not None and self.max_date < _timestamp(date_from):
+            return False
+        if date_to is not None and self.min_date > _timestamp(date_to):
+            return False
+        if map_ids is not None and not self.map_ids & set(map_ids):
+            return False
+        if players is not None and \
+                not all(self.has_player(name) for name in players):
+            return False
+        return True
+
+    def to_dict(self):
+        return {
+            'min_date': self.min_date,
+            'max_date': self.max_date,
+            'map_ids': sorted(self.map_ids),
+            'count': self.count,
+            'players': self.players.to_dict() if self.players else None,
+        }
+
+    @classmethod
+    def from_dict(cls, d):
+        players = d.get('players')
+        return cls(d['min_date'], d['max_date'], d['map_ids'], d['count'],
+                   BloomFilter.from_dict(players) if players else None)
+
+
+def _match_filter(date_from=None, date_to=None, map_ids=None, players=None):
+    """
+    Return a function that tells whether or not the raw data of a match
+    satisfies a query.
+    """
+    date_from = _timestamp(date_from)
+    date_to = _timestamp(date_to)
+    map_ids = set(map_ids) if map_ids is not None else None
+    players = set(players) if players is not None else None
+
+    def f(data):
+        if date_from is not None and data['date'] < date_from:
+            return False
+        if date_to is not None and data['date'] > date_to:
+            return False
+        if map_ids is not None and data['mapId'] not in map_ids:
+            return False
+        if players is not None and not players <= \
+                {p['name'] for p in data.get('players', ())}:
+            return False
+        return True
+
+    return f
+
+
+# Maps loaded per dataset directory, so every shard processed by a worker
+# doesn't have to load them again
+_maps_cache = {}
+
+
+def _load_maps(directory):
+    path = os.path.join(directory, Dataset.MAPS)
+
+    try:
+        mtime = os.path.getmtime(path)
+    except OSError:
+        return None
+
+    cached = _maps_cache.get(directory)
+    if cached is None or cached[0] != mtime:
+        maps = {int(k): Map(v) for k, v in load_json(path).items()}
+        cached = _maps_cache[directory] = (mtime, maps)
+
+    return cached[1]
+
+
+def _read_shard(directory, shard, query):
+    """
+    Yield the matches in a shard that satisfy the given query.
+    """
+    maps = _load_maps(directory)
+    f = _match_filter(**query)
+
+    path = os.path.join(directory, Dataset.SHARDS, shard + '.jsonl.gz')
+    with gzip.open(path, 'rt', encoding='utf-8') as fp:
+        for line in fp:
+            k, v = json.loads(line)
+            if f(v):
+                yield create_match(k, v, maps)
+
+
+def _scan_shard(directory, shard, func, query):
+    return func(_read_shard(directory, shard, query))
+
+
+class Dataset:
+    """
+    Collection of bulk match data on disk, partitioned into shards by month
+    and map. Every shard has an entry in the manifest, with its date range,
+    map IDs and a Bloom filter of player names, sized for the number of
+    distinct names in the shard. Queries use the manifest to
+    skip shards that can't contain matching matches, and process the other
+    shards in parallel.
+
+    The directory layout is:
+
+        manifest.json
+        maps.json.gz
+        shards/<year>-<month>/<map id>.jsonl.gz
+    """
+    MANIFEST = 'manifest.json'
+    MAPS = 'maps.json.gz'
+    SHARDS = 'shards'
+
+    # Number of matches to buffer per shard before writing them
+    BUFFER_SIZE = 1000
+
+    def __init__(self, directory, error_rate=0.01):
+        """
+        Open the dataset in the given directory, which is created if it
+        doesn't exist.
+
+        :param directory: the directory of the dataset
+        :param error_rate: the maximum false positive rate of the Bloom
+        filters of player names
+        """
+        self.directory = directory
+        self.error_rate = error_rate
+        self.shards = {}
+
+        os.makedirs(os.path.join(directory, self.SHARDS), exist_ok=True)
+
+        try:
+            with open(os.path.join(directory, self.MANIFEST)) as f:
+                manifest = json.load(f)
+        except FileNotFoundError:
+            pass
+        else:
+            self.shards = {k: ShardInfo.from_dict(v)
+                           for k, v in manifest['shards'].items()}
+
+    @staticmethod
+    def shard_key(data):
+        """
+        Return the name of the shard a match belongs to.
+
+        :param data: the raw JSON data of the match
+        :returns: the shard name
+        """
+        date = datetime.datetime.fromtimestamp(data['date'],
+                                               datetime.timezone.utc)
+        return f'{date:%Y-%m}/{data["mapId"]}'
+
+    def add_matches(self, source):
+        """
+        Add the matches from bulk files to the dataset. Note that matches are
+        not checked against the ones already in the dataset, so the same file
+        shouldn't be added twice.
+
+        :param source: the bulk files, as described in
+        tagpro_eu.bulk.bulk_files
+        :returns: the number of matches added
+        """
+        buffers = {}
+        count = 0
+
+        try:
+            for k, v in iter_raw_matches(source):
+                shard = self.shard_key(v)
+                buf = buffers.setdefault(shard, [])
+                buf.append(json.dumps([k, v]))
+                self.shards.setdefault(shard, ShardInfo()).add(v)
+                count += 1
+
+                if len(buf) >= self.BUFFER_SIZE:
+                    self._write_shard(shard, buf)
+                    buf.clear()
+        finally:
+            for shard, buf in buffers.items():
+                if buf:
+                    self._write_shard(shard, buf)
+            for shard in buffers:
+                self.shards[shard].flush(
+                    lambda: self._shard_names(shard), self.error_rate)
+            self._write_manifest()
+
+        return count
+
+    def _write_shard(self, shard, lines):
+        path = os.path.join(self.directory, self.SHARDS, shard + '.jsonl.gz')
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        # Appending creates a new gzip member, which is read transparently
+        with gzip.open(path, 'at', encoding='utf-8') as f:
+            for line in lines:
+                f.write(line)
+                f.write('\n')
+
+    def _shard_names(self, shard):
+        path = os.path.join(self.directory, self.SHARDS, shard + '.jsonl.gz')
+        with gzip.open(path, 'rt', encoding='utf-8') as f:
+            for line in f:
+                _, v = json.loads(line)
+                for player in v.get('players', ()):
+                    yield player['name']
+
+    def _write_manifest(self):
+        manifest = {
+            'shards': {k: v.to_dict() for k, v in self.shards.items()},
+        }
+
+        path = os.path.join(self.directory, self.MANIFEST)
+        with open(path + '.tmp', 'w') as f:
+            json.dump(manifest, f)
+        os.replace(path + '.tmp', path)
+
+    def add_maps(self, source):
+        """
+        Add the maps from bulk maps files to the dataset. Matches read from
+        the dataset get their map from these.
+
+        :param source: the bulk maps files, as described in
+        tagpro_eu.bulk.bulk_files
+        """
+        path = os.path.join(self.directory, self.MAPS)
+        maps = load_json(path) if os.path.exists(path) else {}
+
+        for f in bulk_files(source):
+            maps.update(load_json(f))
+
+        with gzip.open(path + '.tmp', 'wt', encoding='utf-8') as f:
+            json.dump(maps, f)
+        os.replace(path + '.tmp', path)
+
+    def select(self, date_from=None, date_to=None, map_ids=None,
+               players=None):
+        """
+        Return the names of the shards that might contain matches for the
+        given query, based on the manifest. The parameters are the same as
+        in scan.
+
+        :returns: list of shard names
+        """
+        return sorted(k for k, v in self.shards.items()
+                      if v.matches(date_from, date_to, map_ids, players))
+
+    def matches(self, date_from=None, date_to=None, map_ids=None,
+                players=None):
+        """
+        Yield all matches satisfying the given query, shard by shard. The
+        parameters are the same as in scan.
+
+        :returns: the matches
+        """
+        query = dict(date_from=date_from, date_to=date_to, map_ids=map_ids,
+                     players=players)
+
+        for shard in self.select(**query):
+            yield from _read_shard(self.directory, shard, query)
+
+    def scan(self, func, date_from=None, date_to=None, map_ids=None,
+             players=None, executor=None, max_workers=None):
+        """
+        Process the matches satisfying the given query in parallel. For every
+        shard that might contain such matches, func is called with an
+        iterator over the matching matches in that shard, and its result is
+        yielded. Results are yielded in the order in which they complete.
+
+        By default a process pool is used, so func (and its results) have to
+        be picklable, e.g. a module-level function.
+
+        :param func: the function to apply to the matches of each shard
+        :param date_from: only include matches from this date on (datetime
+        or timestamp)
+        :param date_to: only include matches up to this date (datetime or
+        timestamp)
+        :param map_ids: only include matches on one of these maps
+        :param players: only include matches in which all of these players
+        (by name) played
+        :param executor: the concurrent.futures.Executor to use (omit to use
+        a new process pool)
+        :param max_workers: the number of processes, when no executor is
+        given
+        :returns: the results of func
+        """
+        query = dict(date_from=date_from, date_to=date_to, map_ids=map_ids,
+                     players=players)
+        shards = self.select(**query)
+
+        own_executor = executor is None
+        if own_executor:
+            executor = concurrent.futures.ProcessPoolExecutor(max_workers)
+
+        futures = []
+
+        try:
+            futures = [executor.submit(_scan_shard, self.directory, shard,
+                                       func, query)
+                       for shard in shards]
+
+            for future in concurrent.futures.as_completed(futures):
+                yield future.result()
+        finally:
+            for future in futures:
+                future.cancel()
+            if own_executor:
+                executor.shutdown()
+
+    def __len__(self):
+        return sum(v.count for v in self.shards.values())
+
+    def __repr__(self):
+        return f'Dataset(directory={self.directory!r})'
@@ -0,0 +1,145 @@
+from collections import deque, namedtuple
+
+
+class Form(namedtuple('Form', ['games', 'cap_diff', 'tags', 'pops',
+                               'captures', 'hold', 'time'])):
+    """
+    The totals of a player's stats over their recent games.
+    """
+    __slots__ = ()
+
+    def per_minute(self, value):
+        return value / self.time * 3600 if self.time else 0.0
+
+    @property
+    def cap_diff_per_game(self):
+        return self.cap_diff / self.games if self.games else 0.0
+
+    @property
+    def tags_per_minute(self):
+        return self.per_minute(self.tags)
+
+    @property
+    def pops_per_minute(self):
+        return self.per_minute(self.pops)
+
+    @property
+    def hold_per_minute(self):
+        """
+        Return the hold time per minute played, in frames.
+        """
+        return self.per_minute(self.hold)
+
+
+class FormTracker:
+    """
+    Keeps track of the form of every player: the totals of their stats over
+    their last N games and/or the last D days. Matches have to be added in
+    chronological order (see tagpro_eu.bulk.iter_matches_by_date).
+
+    Every player has a queue of their recent games and the running totals
+    over it, so adding a match only updates the players in that match, and
+    looking up a player's form doesn't go through their games.
+
+    Players are identified by their name.
+    """
+    def __init__(self, games=None, days=None):
+        """
+        :param games: the maximum number of recent games to include (omit
+        for no limit)
+        :param days: the maximum age of included games in days, relative to
+        the last match added (omit for no limit)
+        """
+        self.games = games
+        self.days = days
+        self.last_date = None
+
+        # Name -> deque of (date, Form of the game)
+        self.history = {}
+        # Name -> list with the totals, in the order of Form
+        self.totals = {}
+
+    def _evict(self, name):
+        history = self.history[name]
+        totals = self.totals[name]
+
+        while history and (
+                self.games is not None and len(history) > self.games or
+                self.days is not None and
+                history[0][0] < self.last_date - self.days * 86400):
+            _, game = history.popleft()
+            for i, v in enumerate(game):
+                totals[i] -= v
+
+        if not history:
+            del self.history[name]
+            del self.totals[name]
+
+    def add(self, match):
+        """
+        Add a match. It should not be older than the matches added before.
+
+        :param match: the Match object
+        """
+        date = match.date.timestamp()
+        if self.last_date is not None and date < self.last_date:
+            raise ValueError('Matches have to be added in chronological '
+                             'order')
+        self.last_date = date
+
+        for player in match.players:
+            stats = player.stats
+            game = Form(1, player.cap_diff, stats.tags, stats.pops,
+                        stats.captures, int(stats.hold), int(stats.time))
+
+            if player.name not in self.history:
+                self.history[player.name] = deque()
+                self.totals[player.name] = [0] * len(Form._fields)
+
+            self.history[player.name].append((date, game))
+            totals = self.totals[player.name]
+            for i, v in enumerate(game):
+                totals[i] += v
+
+            self._evict(player.name)
+
+    def update(self, matches):
+        """
+        Add multiple matches, in chronological order.
+
+        :param matches: iterable of Match objects
+        """
+        for match in matches:
+            self.add(match)
+
+    def form(self, name):
+        """
+        Return the current form of a player.
+
+        :param name: the name of the player
+        :returns: the Form, or None if the player has no recent games
+        """
+        if name not in self.history:
+            return None
+
+        # Games may have become too old since the player's last game
+        self._evict(name)
+
+        totals = self.totals.get(name)
+        return Form(*totals) if totals else None
+
+    def __contains__(self, name):
+        return self.form(name) is not None
+
+    def players(self):
+        """
+        Return the current form of every player with recent games.
+
+        :returns: dict mapping names to Form tuples
+        """
+        for name in list(self.history):
+            self._evict(name)
+        return {name: Form(*t) for name, t in self.totals.items()}
+
+    def __repr__(self):
+        return f'FormTracker(games={self.games!r}, days={self.days!r})'
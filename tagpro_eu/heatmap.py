@@ -0,0 +1,132 @@
+from collections import Counter
+
+from tagpro_eu.util import require_numpy
+
+
+class SplatHeatmap:
+    """
+    Accumulates the splats of many matches into 2D count grids, one per map
+    and team. Matches are grouped by the fingerprint of their map, or by
+    their map_id (as set by tagpro_eu.bulk.load_matches).
+
+    Heatmaps can be built in parallel and combined afterwards using merge.
+    They only hold numpy arrays and plain values, so they can be pickled to
+    send them between processes.
+
+    This class requires numpy.
+    """
+    def __init__(self, key='fingerprint', resolution=40):
+        """
+        :param key: how to group matches, either 'fingerprint' or 'map_id'
+        :param resolution: the size of a grid cell in pixels (a tile is 40
+        pixels wide)
+        :raises ValueError: when key is not a valid value
+        """
+        if key not in ('fingerprint', 'map_id'):
+            raise ValueError(f'Invalid key: {key!r}')
+
+        self.key = key
+        self.resolution = resolution
+        self.grids = {}
+        self.names = {}
+        self.matches = Counter()
+
+    def map_key(self, match):
+        """
+        Return the key used to group the given match.
+
+        :param match: the Match object
+        :returns: the map fingerprint or map ID of the match
+        """
+        if self.key == 'map_id':
+            return match.map_id
+        return match.map.fingerprint
+
+    def _grid(self, key, shape):
+        np = require_numpy()
+
+        grid = self.grids.get(key)
+        if grid is None:
+            grid = self.grids[key] = np.zeros(shape, dtype=np.int64)
+        elif grid.shape != shape:
+            raise ValueError(f'Grid for map {key!r} has shape {grid.shape}, '
+                             f'expected {shape}')
+        return grid
+
+    def add(self, match):
+        """
+        Add the splats of a match to the heatmap of its map.
+
+        :param match: the Match object
+        """
+        np = require_numpy()
+
+        key = self.map_key(match)
+        m = match.map
+
+        w = -(-m.width * 40 // self.resolution)
+        h = -(-m.height * 40 // self.resolution)
+        grid = self._grid(key, (2, h, w))
+
+        # The splats of both teams share one pass over the events of the
+        # match (see Match.__compute_splat_owners__), and are counted with a
+        # single bincount
+        cells = []
+        for i, team in enumerate(match.teams):
+            a = team.splat_arrays
+
+            # Splats can be slightly outside of the map, count them in the
+            # nearest cell
+            x = np.clip(a.x // self.resolution, 0, w - 1)
+            y = np.clip(a.y // self.resolution, 0, h - 1)
+            cells.append((i * h + y) * w + x)
+
+        grid += np.bincount(np.concatenate(cells),
+                            minlength=2 * h * w).reshape(2, h, w)
+
+        self.names.setdefault(key, m.name)
+        self.matches[key] += 1
+
+    def merge(self, other):
+        """
+        Add the grids of another heatmap to this one.
+
+        :param other: a SplatHeatmap with the same key and resolution
+        :returns: this heatmap
+        :raises ValueError: when the heatmaps are not compatible
+        """
+        if (self.key, self.resolution) != (other.key, other.resolution):
+            raise ValueError('Cannot merge heatmaps with a different key or '
+                             'resolution')
+
+        for key, grid in other.grids.items():
+            self._grid(key, grid.shape)[...] += grid
+            self.names.setdefault(key, other.names.get(key))
+
+        self.matches.update(other.matches)
+        return self
+
+    def __getitem__(self, key):
+        """
+        Return the grid for the given map key, as an array with shape
+        (2, height, width). Index 0 holds the red splats, index 1 the blue
+        ones.
+        """
+        return self.grids[key]
+
+    def __contains__(self, key):
+        return key in self.grids
+
+    def __len__(self):
+        return len(self.grids)
+
+    def to_arrays(self):
+        """
+        Return a dict mapping each map key to a copy of its grid.
+
+        :returns: dict of arrays with shape (2, height, width)
+        """
+        return {key: grid.copy() for key, grid in self.grids.items()}
+
+    def __repr__(self):
+        return f'SplatHeatmap(key={self.key!r}, maps={len(self.grids)})'
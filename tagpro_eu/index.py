@@ -0,0 +1,163 @@
+from collections import defaultdict, namedtuple
+import gzip
+import heapq
+import json
+import os
+
+
+Appearance = namedtuple('Appearance', ['match_id', 'index', 'date'])
+
+
+class PlayerIndex:
+    """
+    Inverted index from players to the matches they played in, to look up a
+    player's games without going through all match data. Players are
+    identified by their name and auth flag, as there is no safer way to tell
+    players apart (see Player.__eq__).
+
+    The index is built incrementally: matches that are already in the index
+    are skipped, so new bulk files can simply be added to it. It can be
+    saved to and loaded from a (gzip-compressed) JSON file.
+
+    The games of every player are kept sorted by date. Matches are usually
+    added in chronological order, so a list is only sorted again (once, on
+    the next lookup) when a match was added out of order.
+    """
+    def __init__(self):
+        self.players = defaultdict(list)
+        self.match_ids = set()
+        # Keys of the lists in players that have to be sorted again
+        self.unsorted = set()
+
+    @staticmethod
+    def _order(a):
+        return a.date, a.match_id
+
+    def add(self, match):
+        """
+        Add a match to the index, if it isn't in there yet. The match needs a
+        match_id, like the ones from tagpro_eu.bulk.load_matches.
+
+        :param match: the Match object to add
+        :returns: whether or not the match was added
+        :raises ValueError: when the match has no match_id
+        """
+        match_id = getattr(match, 'match_id', None)
+        if match_id is None:
+            raise ValueError('Matches need a match_id to be indexed')
+
+        if match_id in self.match_ids:
+            return False
+
+        self.match_ids.add(match_id)
+        date = int(match.date.timestamp())
+
+        for player in match.players:
+            key = (player.name, bool(player.auth))
+            games = self.players[key]
+            a = Appearance(match_id, player.index, date)
+            if games and self._order(a) < self._order(games[-1]):
+                self.unsorted.add(key)
+            games.append(a)
+
+        return True
+
+    def update(self, matches):
+        """
+        Add multiple matches to the index.
+
+        :param matches: iterable of Match objects
+        :returns: the number of matches that were added
+        """
+        return sum(self.add(match) for match in matches)
+
+    def games(self, name, auth=None):
+        """
+        Return the games of a player, sorted by date.
+
+        :param name: the name of the player
+        :param auth: whether the player was authorized (omit to include both)
+        :returns: list of Appearance tuples of match ID, player index (in
+        Match.players) and date (as a timestamp). With auth given, this is
+        the list kept in the index, which should not be modified.
+        """
+        if auth is None:
+            return list(heapq.merge(self._games(name, True),
+                                    self._games(name, False),
+                                    key=self._order))
+
+        return self._games(name, bool(auth))
+
+    def _games(self, name, auth):
+        key = (name, auth)
+        games = self.players.get(key, [])
+        if key in self.unsorted:
+            games.sort(key=self._order)
+            self.unsorted.discard(key)
+        return games
+
+    def games_together(self, *names, auth=None):
+        """
+        Return the games in which all of the given players played (on any
+        team), sorted by date.
+
+        :param names: the names of the players
+        :param auth: whether the players were authorized (omit to include
+        both)
+        :returns: list of match IDs
+        """
+        if not names:
+            return []
+
+        games = [{a.match_id: a.date for a in self.games(name, auth)}
+                 for name in names]
+        common = set(games[0]).intersection(*games[1:])
+
+        return sorted(common, key=lambda k: (games[0][k], k))
+
+    def __contains__(self, match_id):
+        return match_id in self.match_ids
+
+    def __len__(self):
+        return len(self.match_ids)
+
+    def save(self, path):
+        """
+        Save the index to a file. If the file name ends in .gz, it is
+        compressed.
+
+        :param path: the path of the file
+        """
+        data = {
+            'matches': sorted(self.match_ids),
+            'players': [[name, auth, [list(a) for a in games]]
+                        for (name, auth), games in self.players.items()],
+        }
+
+        opener = gzip.open if path.endswith('.gz') else open
+        with opener(path + '.tmp', 'wt', encoding='utf-8') as f:
+            json.dump(data, f)
+        os.replace(path + '.tmp', path)
+
+    @classmethod
+    def load(cls, path):
+        """
+        Load an index saved using save.
+
+        :param path: the path of the file
+        :returns: the PlayerIndex
+        """
+        opener = gzip.open if path.endswith('.gz') else open
+        with opener(path, 'rt', encoding='utf-8') as f:
+            data = json.load(f)
+
+        index = cls()
+        index.match_ids = set(data['matches'])
+        for name, auth, games in data['players']:
+            index.players[name, auth] = sorted(
+                (Appearance(*a) for a in games), key=cls._order)
+
+        return index
+
+    def __repr__(self):
+        return f'PlayerIndex(matches={len(self.match_ids)})'
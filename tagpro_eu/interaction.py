@@ -0,0 +1,94 @@
+from collections import namedtuple
+import heapq
+import itertools
+
+from tagpro_eu.player import PlayerEventHandler
+
+
+# A player tagging (kind 'tag') or returning (kind 'return') a player of the
+# other team
+Interaction = namedtuple('Interaction', ['time', 'kind', 'actor', 'victim'])
+
+# A frame in which the pops of a team can't be matched to the tags of the
+# other team unambiguously
+AmbiguousFrame = namedtuple('AmbiguousFrame',
+                            ['time', 'kind', 'actors', 'victims'])
+
+# The kind of interaction for each kind of pop
+POP_KINDS = {'drop': 'return', 'pop': 'tag'}
+
+
+class InteractionEventHandler(PlayerEventHandler):
+    """
+    Implementation of PlayerEventHandler that collects the tags, returns,
+    pops and drops of a player, as (time, event, team, player) tuples in
+    chronological order.
+    """
+    __slots__ = ('player', 'events')
+
+    def __init__(self, player):
+        self.player = player
+        self.events = []
+
+    def return_(self, time, flag, powers, team):
+        self.events.append((time, 'return', team, self.player))
+
+    def tag(self, time, flag, powers, team):
+        self.events.append((time, 'tag', team, self.player))
+
+    def drop(self, time, old_flag, powers, team):
+        self.events.append((time, 'drop', team, self.player))
+
+    def pop(self, time, powers, team):
+        self.events.append((time, 'pop', team, self.player))
+
+
+def extract_interactions(match):
+    """
+    Find out which player tagged or returned whom in a match.
+
+    The events of all players are merged into one chronological stream, and
+    the drops (pops) of a team are paired with the returns (tags) done by
+    the other team in the same frame. When a frame contains a single pop
+    and a single tag of the other team, they are paired. When it contains
+    more than one, or a different number of pops and tags, the frame is
+    reported as ambiguous instead. Pops without tags of the other team in
+    the same frame (e.g. on spikes) are not interactions, and are skipped.
+
+    :param match: the Match object
+    :returns: (interactions, ambiguous) tuple of lists of Interaction and
+    AmbiguousFrame tuples, both in chronological order
+    """
+    streams = []
+
+    for player in match.players:
+        handler = InteractionEventHandler(player)
+        player.parse_events(handler)
+        streams.append(handler.events)
+
+    interactions = []
+    ambiguous = []
+
+    merged = heapq.merge(*streams, key=lambda e: e[0])
+    for time, events in itertools.groupby(merged, key=lambda e: e[0]):
+        events = list(events)
+
+        for victim_kind, kind in POP_KINDS.items():
+            for team in sorted({int(e[2]) for e in events
+                                if e[1] == victim_kind}):
+                victims = [e[3] for e in events
+                           if e[1] == victim_kind and e[2] == team]
+                actors = [e[3] for e in events
+                          if e[1] == kind and e[2] and e[2] != team]
+
+                if not actors:
+                    continue
+
+                if len(victims) == len(actors) == 1:
+                    interactions.append(
+                        Interaction(time, kind, actors[0], victims[0]))
+                else:
+                    ambiguous.append(
+                        AmbiguousFrame(time, kind, actors, victims))
+
+    return interactions, ambiguous
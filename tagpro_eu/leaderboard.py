@@ -0,0 +1,246 @@
+from collections import namedtuple
+import heapq
+
+
+# An entry in a leaderboard. For per-game leaderboards, match_id is the
+# match the value was achieved in; otherwise it is None.
+LeaderboardEntry = namedtuple('LeaderboardEntry',
+                              ['value', 'name', 'games', 'match_id'])
+
+
+def _heap_item(entry):
+    # Entries are ranked by value and name, and then by match ID so equal
+    # values have a stable order. The match ID may be None, which can't be
+    # compared to a str, so the entry itself is only compared when the
+    # match IDs are equal.
+    tiebreak = '' if entry.match_id is None else str(entry.match_id)
+    return entry.value, entry.name, tiebreak, entry
+
+
+class Leaderboard:
+    """
+    Builds top-k leaderboards from a stream of matches, for a number of
+    statistics, optionally per map and per time window (e.g. per week).
+
+    Two kinds of leaderboards are kept for every partition (map and
+    window):
+
+    - totals: the players with the highest total (or per-minute value) of a
+      statistic, among the players satisfying min_games and min_time
+    - games: the highest values of a statistic in a single game, kept in a
+      bounded heap of size k while the data streams through
+
+    The totals are exact, so they need the stats of every player in an open
+    partition: only the number of games, the time played and the
+    configured statistics are kept per player. Players that don't satisfy
+    min_games and min_time yet are kept in tail, apart from the candidates
+    in players, and are moved over once they do; only the candidates are
+    ranked. Tail players can still become eligible until their partition
+    closes, so they are only dropped then, and memory grows with the number
+    of distinct players in the open partitions, including one-game
+    players. If the matches are added in chronological order (see
+    tagpro_eu.bulk.iter_matches_by_date), pass ordered=True: partitions are
+    then finalized as soon as their time window has passed, and the rows of
+    both their candidates and their tail are discarded.
+
+    Leaderboards built in parallel (without ordered) can be combined using
+    merge.
+    """
+    def __init__(self, stats=('tags', 'pops', 'grabs', 'captures', 'hold',
+                              'returns', 'prevent'),
+                 k=10, window=None, by_map=False, min_games=1, min_time=0,
+                 per_minute=False, ordered=False):
+        """
+        :param stats: the statistics to rank players by, as names of
+        PlayerStats attributes (e.g. 'tags' or 'cap_diff')
+        :param k: the number of entries per leaderboard
+        :param window: the size of a time window in seconds (omit to use a
+        single window)
+        :param by_map: whether to make separate leaderboards per map
+        :param min_games: the minimum number of games for a player to be
+        included in the totals
+        :param min_time: the minimum time played (a Time) for a player to be
+        included in the totals
+        :param per_minute: whether to rank totals per minute played
+        :param ordered: whether matches are added in chronological order
+        """
+        self.stats = tuple(stats)
+        self.k = k
+        self.window = window
+        self.by_map = by_map
+        self.min_games = min_games
+        self.min_time = min_time
+        self.per_minute = per_minute
+        self.ordered = ordered
+
+        # Partition -> name -> [games, time, value of every stat], for the
+        # players satisfying min_games and min_time
+        self.players = {}
+        # Partition -> name -> row like in players, for the other players
+        self.tail = {}
+        # Partition -> stat -> heap of (value, name, tiebreak,
+        # LeaderboardEntry), see _heap_item
+        self.games = {}
+        # Partition -> stat -> list of LeaderboardEntry, once finalized
+        self.totals = {}
+
+    def partition(self, date, map_id=None):
+        """
+        Return the partition for a game with the given date and map.
+
+        :param date: the date of the game, as a timestamp
+        :param map_id: the map ID of the game
+        :returns: (window start, map ID) tuple, where either can be None
+        """
+        start = date - date % self.window if self.window else None
+        return start, map_id if self.by_map else None
+
+    def add(self, match):
+        """
+        Add the stats of all players in a match.
+
+        :param match: the Match object (with a map_id, if by_map is set)
+        """
+        date = int(match.date.timestamp())
+        map_id = getattr(match, 'map_id', None)
+        match_id = getattr(match, 'match_id', None)
+
+        for player in match.players:
+            self.add_stats(player.name, player.stats, date, map_id, match_id)
+
+    def add_stats(self, name, stats, date, map_id=None, match_id=None):
+        """
+        Add the stats of a single player in a single game.
+
+        :param name: the name of the player
+        :param stats: the PlayerStats of the player in the game
+        :param date: the date of the game, as a timestamp
+        :param map_id: the map ID of the game
+        :param match_id: the ID of the match
+        """
+        key = self.partition(date, map_id)
+
+        if key in self.totals:
+            raise ValueError(f'Partition {key!r} has already been finalized')
+
+        if self.ordered and self.window:
+            self._finalize_before(key[0])
+
+        values = [getattr(stats, s) for s in self.stats]
+
+        players = self.players.setdefault(key, {})
+        tail = self.tail.setdefault(key, {})
+
+        row = players.get(name)
+        if row is None:
+            row = tail.get(name)
+            if row is None:
+                row = tail[name] = [0, 0] + [0] * len(self.stats)
+        row[0] += 1
+        row[1] += int(stats.time)
+        for i, v in enumerate(values, 2):
+            row[i] += v
+        self._promote(key, name, row)
+
+        heaps = self.games.setdefault(key, {s: [] for s in self.stats})
+        for s, v in zip(self.stats, values):
+            item = _heap_item(LeaderboardEntry(v, name, 1, match_id))
+            if len(heaps[s]) < self.k:
+                heapq.heappush(heaps[s], item)
+            elif item > heaps[s][0]:
+                heapq.heapreplace(heaps[s], item)
+
+    def _promote(self, key, name, row):
+        """
+        Move a row from the tail to the candidates once it satisfies
+        min_games and min_time.
+        """
+        tail = self.tail[key]
+        if name in tail and row[0] >= self.min_games and \
+                row[1] >= self.min_time:
+            del tail[name]
+            self.players[key][name] = row
+
+    def _value(self, row, i):
+        value = row[2 + i]
+        if self.per_minute:
+            return value / row[1] * 3600 if row[1] else 0
+        return value
+
+    def _finalize(self, key):
+        players = self.players.pop(key, {})
+        self.tail.pop(key, None)
+
+        self.totals[key] = {
+            s: heapq.nlargest(self.k, (
+                LeaderboardEntry(self._value(row, i), name, row[0], None)
+                for name, row in players.items()), key=lambda e: e[:2])
+            for i, s in enumerate(self.stats)
+        }
+
+    def _finalize_before(self, start):
+        for key in [k for k in self.players if k[0] < start]:
+            self._finalize(key)
+
+    def merge(self, other):
+        """
+        Add the data of another Leaderboard with the same settings to this
+        one. Finalized partitions can't be merged.
+
+        :param other: the other Leaderboard
+        :returns: self
+        :raises ValueError: when a partition is finalized in either
+        leaderboard and present in the other
+        """
+        for key in other.totals:
+            if key in self.totals or key in self.players:
+                raise ValueError(f'Partition {key!r} has been finalized')
+        for key in other.players:
+            if key in self.totals:
+                raise ValueError(f'Partition {key!r} has been finalized')
+
+        for key in other.players:
+            players = self.players.setdefault(key, {})
+            tail = self.tail.setdefault(key, {})
+            for source in (other.players[key], other.tail.get(key, {})):
+                for name, theirs in source.items():
+                    row = players.get(name)
+                    if row is None:
+                        row = tail.setdefault(name, [0] * len(theirs))
+                    for i, v in enumerate(theirs):
+                        row[i] += v
+                    self._promote(key, name, row)
+
+        for key, heaps in other.games.items():
+            mine = self.games.setdefault(key, {s: [] for s in self.stats})
+            for s in self.stats:
+                items = heapq.nlargest(self.k, mine[s] + heaps[s])
+                heapq.heapify(items)
+                mine[s] = items
+
+        self.totals.update(other.totals)
+        return self
+
+    def results(self):
+        """
+        Finalize all partitions and return the leaderboards.
+
+        :returns: dict mapping partitions to dicts with the keys 'totals'
+        and 'games', which map each statistic to a list of LeaderboardEntry
+        tuples sorted from high to low
+        """
+        for key in list(self.players):
+            self._finalize(key)
+
+        return {
+            key: {
+                'totals': self.totals[key],
+                'games': {s: [item[-1] for item in sorted(heap, reverse=True)]
+                          for s, heap in self.games.get(key, {}).items()},
+            }
+            for key in sorted(self.totals,
+                              key=lambda k: (k[0] or 0, k[1] or 0))
+        }
+
+    def __repr__(self):
+        return f'Leaderboard(stats={self.stats!r}, k={self.k!r})'
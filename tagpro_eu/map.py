@@ -1,8 +1,38 @@
+from collections import Counter, defaultdict
+import hashlib
+import math
+
 from tagpro_eu.blob import Blob
 from tagpro_eu.constants import Tile
 from tagpro_eu.data import JsonObject
 
 
+def decode_tile(code):
+    """
+    Convert a 6-bit tile code as stored in a map blob to its Tile value.
+
+    :param code: the tile code read from the blob
+    :returns: the corresponding Tile
+    """
+    tile = code
+    if tile != Tile.empty:
+        # idk
+        if tile < 6:
+            tile += 9
+        elif tile < 13:
+            tile = (tile - 4) * 10
+        elif tile < 17:
+            tile += 77
+        elif tile < 20:
+            tile = (tile - 7) * 10
+        elif tile < 22:
+            tile += 110
+        else:
+            tile = (tile - 8) * 10
+
+    return Tile(tile)
+
+
 class Map(JsonObject):
     """
     Represents a map object in tagpro.eu match files.
@@ -21,6 +51,11 @@ class Map(JsonObject):
         super().__init__(data, strict=strict)
 
         self.__tilemap__ = None
+        self.__runs__ = None
+        self.__fingerprint__ = None
+        self.__height__ = None
+        self.__tile_counts__ = None
+        self.__tile_index__ = None
 
     @property
     def tiles(self):
@@ -39,64 +74,185 @@ class Map(JsonObject):
     def height(self):
         """
         Return the height of the map. Unlike width, this is not stored in the
-        JSON format, and is therefore lazy-loaded together with tiles.
+        JSON format, and is therefore lazy-loaded from the runs of tiles in
+        the __tiles__ blob. This does not build the tile grid.
 
         :returns: the height of the map in tiles
         """
-        if self.__tilemap__ is None:
-            self._parse_tiles()
+        if self.__height__ is None:
+            self._scan_tiles()
 
-        return len(self.__tilemap__)
+        return self.__height__
 
-    def _parse_tiles(self):
+    @property
+    def tile_counts(self):
+        """
+        Return the number of occurrences of every tile type on this map. This
+        is lazy-loaded together with height.
+
+        :returns: a Counter mapping Tile values to their number of tiles
+        """
+        if self.__tile_counts__ is None:
+            self._scan_tiles()
+
+        return self.__tile_counts__
+
+    @property
+    def tile_index(self):
+        """
+        Return a dict mapping every tile type on this map to the list of (x, y)
+        positions of that tile, in reading order. This is built once from the
+        tile grid and then stored in __tile_index__.
+
+        :returns: the tile index
+        """
+        if self.__tile_index__ is None:
+            index = defaultdict(list)
+            for y, row in enumerate(self.tiles):
+                for x, tile in enumerate(row):
+                    index[tile].append((x, y))
+            self.__tile_index__ = dict(index)
+
+        return self.__tile_index__
+
+    def positions(self, *tiles):
+        """
+        Return the positions of all tiles of the given types, e.g.
+        map.positions(Tile.flag_red) or map.positions(Tile.bomb, Tile.spike).
+
+        :param tiles: the tile types to look up
+        :returns: list of (x, y) positions
+        """
+        if len(tiles) == 1:
+            return list(self.tile_index.get(tiles[0], ()))
+
+        return [pos for t in tiles for pos in self.tile_index.get(t, ())]
+
+    def nearest(self, x, y, *tiles):
+        """
+        Return the position of the tile of the given types that is nearest to
+        (x, y), together with its (Euclidean) distance. Coordinates are in
+        tiles and may be fractional; note that splat coordinates are in pixels
+        and have to be divided by 40 first.
+
+        :param x: the x coordinate to search from
+        :param y: the y coordinate to search from
+        :param tiles: the tile types to look for
+        :returns: a ((x, y), distance) tuple, or None if there are no such
+        tiles
         """
-        Load __tilemap__ from the __tiles__ blob, to be used by the tiles and
-        height properties.
+        best = None
+        best_dist = math.inf
+
+        for tx, ty in self.positions(*tiles):
+            dist = math.hypot(tx - x, ty - y)
+            if dist < best_dist:
+                best = (tx, ty)
+                best_dist = dist
+
+        if best is None:
+            return None
+
+        return best, best_dist
+
+    @property
+    def fingerprint(self):
+        """
+        Return a stable hash of the map's contents. This is computed from the
+        raw __tiles__ blob and the width, so the tiles don't have to be parsed.
+        Two maps with the same tiles have the same fingerprint, regardless of
+        their name or author.
+
+        :returns: the fingerprint as a hexadecimal string
         """
-        self.__tilemap__ = []
+        if self.__fingerprint__ is None:
+            h = hashlib.sha1()
+            h.update(str(self.width).encode('ascii'))
+            h.update(b':')
+            if self.__tiles__ is not None:
+                h.update(self.__tiles__.data)
+            self.__fingerprint__ = h.hexdigest()
+
+        return self.__fingerprint__
 
+    @property
+    def runs(self):
+        """
+        Return the runs of tiles in the __tiles__ blob, as (tile, length)
+        pairs in reading order. The last row is padded with empty tiles,
+        like the grid in tiles. The blob is decoded once, and height,
+        tile_counts and tiles are all derived from the runs.
+
+        :returns: list of (Tile, int) tuples
+        """
+        if self.__runs__ is None:
+            self._parse_runs()
+
+        return self.__runs__
+
+    def _parse_runs(self):
         blob = self.__tiles__
         blob.reset()
 
-        x, y = 0, 0
-
-        while not blob.end() or x > 0:
-            tile = blob.read_fixed(6)
-            if tile != Tile.empty:
-                # idk
-                if tile < 6:
-                    tile += 9
-                elif tile < 13:
-                    tile = (tile - 4) * 10
-                elif tile < 17:
-                    tile += 77
-                elif tile < 20:
-                    tile = (tile - 7) * 10
-                elif tile < 22:
-                    tile += 110
-                else:
-                    tile = (tile - 8) * 10
-
-            for i in range(blob.read_footer() + 1):
-                if x == 0:
-                    self.__tilemap__.append([])
-                self.__tilemap__[y].append(Tile(tile))
-
-                x += 1
-                if x == self.width:
-                    x = 0
-                    y += 1
+        runs = []
+        decoded = {}
+        cells = 0
+
+        while not blob.end() or cells % self.width > 0:
+            code = blob.read_fixed(6)
+            tile = decoded.get(code)
+            if tile is None:
+                tile = decoded[code] = decode_tile(code)
+
+            n = blob.read_footer() + 1
+            cells += n
+            runs.append((tile, n))
+
+        self.__runs__ = runs
+
+    def _scan_tiles(self):
+        """
+        Compute __height__ and __tile_counts__ from the runs of tiles, without
+        building the tile grid.
+        """
+        counts = Counter()
+        cells = 0
+
+        for tile, n in self.runs:
+            counts[tile] += n
+            cells += n
+
+        self.__height__ = cells // self.width
+        self.__tile_counts__ = counts
+
+    def _parse_tiles(self):
+        """
+        Load __tilemap__ from the runs of tiles, to be used by the tiles
+        property.
+        """
+        cells = []
+        for tile, n in self.runs:
+            cells.extend((tile,) * n)
+
+        w = self.width
+        self.__tilemap__ = [cells[i:i + w] for i in range(0, len(cells), w)]
+
+        if self.__height__ is None:
+            self._scan_tiles()
 
     def __eq__(self, other):
         """
-        Equality of maps is determined by comparing tiles.
+        Equality of maps is determined by comparing tiles, using fingerprint.
 
         Map might have multiple iterations, so just name(+author) won't work.
         Maps might be renamed, but still have the same tiles.
         Maps will probably have to be compared across matches, so comparing
         parents is not a good idea.
         """
-        return other is not None and self.tiles == other.tiles
+        return isinstance(other, Map) and self.fingerprint == other.fingerprint
+
+    def __hash__(self):
+        return hash(self.fingerprint)
 
     def __repr__(self):
         return f'Map(name={self.name!r})'
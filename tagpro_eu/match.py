@@ -3,15 +3,17 @@ import datetime
 import heapq
 
 from tagpro_eu.blob import Blob
-from tagpro_eu.constants import Team
+from tagpro_eu.constants import Powerup, Team
 from tagpro_eu.data import JsonObject
 from tagpro_eu.data import ListOf
+from tagpro_eu.interaction import extract_interactions
 from tagpro_eu.map import Map
 from tagpro_eu.player import Player
 from tagpro_eu.player import PlayerEventHandler
 from tagpro_eu.player import PlayerEventLogger
 from tagpro_eu.player import PlayerStats
-from tagpro_eu.util import Time
+from tagpro_eu.state import StateIndex
+from tagpro_eu.util import Time, numpy, require_numpy
 
 
 class Splat(namedtuple('Splat', ['time', 'x', 'y', 'player', 'team'])):
@@ -21,6 +23,165 @@ class Splat(namedtuple('Splat', ['time', 'x', 'y', 'player', 'team'])):
         return self.time < other.time
 
 
+SplatArrays = namedtuple('SplatArrays', ['time', 'x', 'y', 'player'])
+
+# A period in which a player was on a team. The period includes start, but
+# not end.
+RosterEntry = namedtuple('RosterEntry', ['player', 'start', 'end'])
+
+
+def splat_bits(size):
+    """
+    Return the number of bits used for a splat coordinate on a map with the
+    given size (width or height) in tiles, and the offset that has to be
+    subtracted from the value read. Splat coordinates are in pixels, with
+    40 pixels per tile.
+
+    :param size: the width or height of the map
+    :returns: a (bits, offset) tuple
+    """
+    size *= 40
+    grid = size - 1
+    result = 32
+    if not (grid & 0xFFFF0000):
+        result -= 16
+        grid <<= 16
+    if not (grid & 0xFF000000):
+        result -= 8
+        grid <<= 8
+    if not (grid & 0xF0000000):
+        result -= 4
+        grid <<= 4
+    if not (grid & 0xC0000000):
+        result -= 2
+        grid <<= 2
+    if not (grid & 0x80000000):
+        result -= 1
+
+    return (result, ((1 << result) - size >> 1) + 20)
+
+
+class TeamStatsHandler(PlayerEventHandler):
+    """
+    Implementation of PlayerEventHandler that accumulates a player's stats
+    separately for every team they played on, so that each event counts
+    for the team the player was on at that moment. It also records the
+    periods the player spent on each team.
+    """
+    def __init__(self, player):
+        """
+        :param player: the Player object whose events are read
+        """
+        self.player = player
+        # Indexed by Team. Events while not on a team are counted for
+        # Team.none, and ignored.
+        self.stats = [PlayerStats(), PlayerStats(), PlayerStats()]
+        self.roster = [[], [], []]
+        self.caps = [[], [], []]
+
+        self.team = Team.none
+        self.since = -1
+        self.prevent = False
+        self.button = False
+        self.block = False
+
+    @property
+    def current(self):
+        return self.stats[self.team]
+
+    def _enter(self, time, team, powers):
+        self.team = team
+        self.since = time
+
+        # Ongoing powerups and toggles carry over to the new team
+        stats = self.current
+        stats.join(time, team)
+        for p in Powerup.enumerate():
+            if powers & p:
+                stats.pup_since[p] = time
+        if self.prevent:
+            stats.prevent_since = time
+        if self.button:
+            stats.button_since = time
+        if self.block:
+            stats.block_since = time
+
+    def _leave(self, time, flag, powers):
+        self.current.end(time, flag, powers, self.team)
+        self.roster[self.team].append(
+            RosterEntry(self.player, self.since, time))
+        self.team = Team.none
+
+    def join(self, time, new_team):
+        self._enter(time, new_team, Powerup.none)
+
+    def quit(self, time, old_flag, old_powers, old_team):
+        self._leave(time, old_flag, old_powers)
+
+    def switch(self, time, old_flag, powers, new_team):
+        self._leave(time, old_flag, powers)
+        self._enter(time, new_team, powers)
+
+    def grab(self, time, new_flag, powers, team):
+        self.current.grab(time, new_flag, powers, team)
+
+    def capture(self, time, old_flag, powers, team):
+        self.current.capture(time, old_flag, powers, team)
+        self.caps[team].append(time)
+
+    def flagless_capture(self, time, flag, powers, team):
+        self.current.flagless_capture(time, flag, powers, team)
+
+    def powerup(self, time, flag, power_up, new_powers, team):
+        self.current.powerup(time, flag, power_up, new_powers, team)
+
+    def duplicate_powerup(self, time, flag, powers, team):
+        self.current.duplicate_powerup(time, flag, powers, team)
+
+    def powerdown(self, time, flag, power_down, new_powers, team):
+        self.current.powerdown(time, flag, power_down, new_powers, team)
+
+    def return_(self, time, flag, powers, team):
+        self.current.return_(time, flag, powers, team)
+
+    def tag(self, time, flag, powers, team):
+        self.current.tag(time, flag, powers, team)
+
+    def drop(self, time, old_flag, powers, team):
+        self.current.drop(time, old_flag, powers, team)
+
+    def pop(self, time, powers, team):
+        self.current.pop(time, powers, team)
+
+    def start_prevent(self, time, flag, powers, team):
+        self.prevent = True
+        self.current.start_prevent(time, flag, powers, team)
+
+    def stop_prevent(self, time, flag, powers, team):
+        self.prevent = False
+        self.current.stop_prevent(time, flag, powers, team)
+
+    def start_button(self, time, flag, powers, team):
+        self.button = True
+        self.current.start_button(time, flag, powers, team)
+
+    def stop_button(self, time, flag, powers, team):
+        self.button = False
+        self.current.stop_button(time, flag, powers, team)
+
+    def start_block(self, time, flag, powers, team):
+        self.block = True
+        self.current.start_block(time, flag, powers, team)
+
+    def stop_block(self, time, flag, powers, team):
+        self.block = False
+        self.current.stop_block(time, flag, powers, team)
+
+    def end(self, time, flag, powers, team):
+        if self.team:
+            self._leave(time, flag, powers)
+
+
 class MatchTeam(JsonObject):
     """
     Represent a team object in tagpro.eu match files.
@@ -36,14 +197,48 @@ class MatchTeam(JsonObject):
         super().__init__(data, strict=strict)
 
         self.__splatlist__ = None
+        self.__splatarrays__ = None
         self.__stats__ = None
+        self.__players__ = None
+        self.__roster__ = None
+        self.__captimes__ = None
 
     @property
     def players(self):
         """
-        Return a list of players on this team.
+        Return a list of players on this team at the start of the match.
+        Players who joined later are not included, see roster.
         """
-        return list(filter(lambda p: p.team == self, self.__parent__.players))
+        if self.__players__ is None:
+            team = self.team
+            self.__players__ = [p for p in self.__parent__.players
+                                if p.__team__ == team]
+        return self.__players__
+
+    @property
+    def roster(self):
+        """
+        Return the periods in which players were on this team, taking into
+        account players joining, switching teams and quitting. A player can
+        have multiple entries.
+
+        :returns: list of RosterEntry tuples, sorted by start time
+        """
+        if self.__roster__ is None:
+            self.__parent__.__compute_team_stats__()
+        return self.__roster__
+
+    @property
+    def cap_times(self):
+        """
+        Return the times of this team's captures. This is computed in the
+        same pass as stats and roster.
+
+        :returns: sorted list of times
+        """
+        if self.__captimes__ is None:
+            self.__parent__.__compute_team_stats__()
+        return self.__captimes__
 
     @property
     def team(self):
@@ -69,90 +264,142 @@ class MatchTeam(JsonObject):
     def stats(self):
         """
         Return a PlayerStats object containing the aggregate of all this team's
-        player's stats.
-
-        TODO: handle team switches properly
+        player's stats. Every event is counted for the team the player was on
+        at that moment, so players who switched teams count for both teams.
         """
         if self.__stats__ is None:
-            self.__stats__ = PlayerStats()
-            for player in self.players:
-                s = PlayerStats()
-                player.parse_events(s)
-                self.__stats__ += s
+            self.__parent__.__compute_team_stats__()
         return self.__stats__
 
-    def _parse_splats(self):
-        def bits(size):
-            size *= 40
-            grid = size - 1
-            result = 32
-            if not (grid & 0xFFFF0000):
-                result -= 16
-                grid <<= 16
-            if not (grid & 0xFF000000):
-                result -= 8
-                grid <<= 8
-            if not (grid & 0xF0000000):
-                result -= 4
-                grid <<= 4
-            if not (grid & 0xC0000000):
-                result -= 2
-                grid <<= 2
-            if not (grid & 0x80000000):
-                result -= 1
-
-            return (result, ((1 << result) - size >> 1) + 20)
-
-        # Determine the players who the splats belong to
-        player_splats = []
-
-        class PlayerSplat(namedtuple('PlayerSplat', ['time', 'player'])):
-            __slots__ = ()
-
-            def __lt__(self, other):
-                return self.time < other.time
-
-        class PlayerSplatsHandler(PlayerEventHandler):
-            def __init__(self, player, team):
-                self.player = player
-                self.team = team
+    @property
+    def splat_arrays(self):
+        """
+        Return the splats on the map for this team as a SplatArrays tuple of
+        numpy arrays: time, x, y and player (the index of the player in the
+        match's players list). This is lazy-loaded from the __splats__ blob
+        using vectorized decoding, and is much faster than splats for large
+        numbers of matches.
 
-            def drop(self, time, old_flag, powers, team):
-                self.pop(time, powers, team)
+        This property requires numpy.
 
-            def pop(self, time, powers, team):
-                if team == self.team:
-                    heapq.heappush(player_splats,
-                                   PlayerSplat(time, self.player))
+        :returns: the splat arrays
+        """
+        if self.__splatarrays__ is None:
+            self._parse_splat_arrays()
 
-        for p in self.__parent__.players:
-            h = PlayerSplatsHandler(p, self.team)
-            p.parse_events(h)
+        return self.__splatarrays__
+
+    def _splat_owners(self):
+        """
+        Return the times of the pops that caused this team's splats, and the
+        indices of the popped players, in the order the splats are stored in
+        the __splats__ blob (see Match.__compute_splat_owners__).
+
+        :returns: (times, players) tuple of lists, or of numpy arrays when
+        numpy is installed
+        """
+        match = self.__parent__
+        if match.__splatowners__ is None:
+            match.__compute_splat_owners__()
+        return match.__splatowners__[self.team]
+
+    def _parse_splats(self):
+        if numpy is not None:
+            self._parse_splats_from_arrays()
+            return
+
+        times, owners = self._splat_owners()
+        players = self.__parent__.players
 
         blob = self.__splats__
         blob.reset()
 
         self.__splatlist__ = []
 
-        x = bits(self.__parent__.map.width)
-        y = bits(self.__parent__.map.height)
-
-        index = 0
+        x = splat_bits(self.__parent__.map.width)
+        y = splat_bits(self.__parent__.map.height)
 
         while not blob.end():
             n = blob.read_tally()
 
-            if n > 0:
-                for i in range(n):
-                    ps = heapq.heappop(player_splats)
-                    self.__splatlist__.append(
-                        Splat(ps.time,
-                              blob.read_fixed(x[0]) - x[1],
-                              blob.read_fixed(y[0]) - y[1],
-                              ps.player,
-                              self))
+            for i in range(n):
+                j = len(self.__splatlist__)
+                self.__splatlist__.append(
+                    Splat(times[j],
+                          blob.read_fixed(x[0]) - x[1],
+                          blob.read_fixed(y[0]) - y[1],
+                          players[owners[j]],
+                          self))
+
+    def _parse_splats_from_arrays(self):
+        players = self.__parent__.players
+        a = self.splat_arrays
+
+        self.__splatlist__ = [
+            Splat(Time(t), x, y, players[p], self)
+            for t, x, y, p in zip(a.time.tolist(), a.x.tolist(),
+                                  a.y.tolist(), a.player.tolist())
+        ]
+
+    def _parse_splat_arrays(self):
+        np = require_numpy()
+
+        times, owners = self._splat_owners()
+
+        xbits, xoffset = splat_bits(self.__parent__.map.width)
+        ybits, yoffset = splat_bits(self.__parent__.map.height)
+        size = xbits + ybits
+
+        # Walk the tallies to find where each group of splats starts. Only
+        # the tallies are read one by one; the coordinates are extracted
+        # all at once below.
+        data = self.__splats__.unpack_bits()
+        raw = data.tobytes()
+        end = len(raw)
+
+        group_pos = []
+        group_len = []
+
+        pos = 0
+        while pos < end:
+            zero = raw.find(b'\0', pos)
+            if zero < 0:
+                zero = end
+            n = zero - pos
+            pos = zero + 1
 
-            index += 1
+            if n > 0:
+                group_pos.append(pos)
+                group_len.append(n)
+                pos += n * size
+
+        total = sum(group_len)
+        if total > len(owners):
+            raise IndexError('More splats than pops in the match')
+
+        group_len = np.array(group_len, dtype=np.int64)
+        group_first = np.cumsum(group_len) - group_len
+
+        splat = np.arange(total, dtype=np.int64)
+        starts = np.repeat(np.array(group_pos, dtype=np.int64), group_len) +\
+            (splat - np.repeat(group_first, group_len)) * size
+
+        # Reading past the end of a blob gives zeros
+        pad = int(starts.max()) + size - len(data) if total else 0
+        if pad > 0:
+            data = np.concatenate((data, np.zeros(pad, dtype=np.uint8)))
+
+        def extract(offsets, bits):
+            weights = 1 << np.arange(bits - 1, -1, -1, dtype=np.int64)
+            fields = data[offsets[:, None] + np.arange(bits)]
+            return fields.astype(np.int64) @ weights
+
+        self.__splatarrays__ = SplatArrays(
+            times[:total],
+            extract(starts, xbits) - xoffset,
+            extract(starts + xbits, ybits) - yoffset,
+            owners[:total],
+        )
 
     def __eq__(self, other):
         """
@@ -193,6 +440,8 @@ class Match(JsonObject):
         super().__init__(data, strict=strict)
 
         self.__splats__ = None
+        self.__splatowners__ = None
+        self.__state__ = None
 
     def team(self, team):
         """
@@ -244,6 +493,53 @@ class Match(JsonObject):
 
         return self.__splats__
 
+    @property
+    def state_index(self):
+        """
+        Return the StateIndex of this match, which is built from the events
+        of all players the first time it is used.
+        """
+        if self.__state__ is None:
+            self.__state__ = StateIndex(self)
+        return self.__state__
+
+    def state_at(self, time):
+        """
+        Return the state of every player at the given time: their team, the
+        flag they hold, their powerups and whether they are preventing,
+        buttoning or blocking.
+
+        :param time: the time in the match
+        :returns: list of PlayerState tuples, in the order of self.players
+        """
+        return self.state_index.state_at(time)
+
+    def intervals(self, field, start=0, end=None):
+        """
+        Return the intervals in which players had a value for a field of
+        their state, overlapping with the given time range. For example,
+        match.intervals('flag', t0, t1) returns all flag holds between t0
+        and t1. See StateIndex.intervals.
+
+        :param field: the PlayerState field, e.g. 'flag' or 'prevent'
+        :param start: the start of the time range
+        :param end: the end of the time range, inclusive (omit for the end
+        of the match)
+        :returns: list of Interval tuples, sorted by start
+        """
+        return self.state_index.intervals(field, start, end)
+
+    def interactions(self):
+        """
+        Return who tagged and returned whom in this match. Frames in which
+        this can't be determined are returned separately. See
+        tagpro_eu.interaction.extract_interactions.
+
+        :returns: (interactions, ambiguous) tuple of lists of Interaction and
+        AmbiguousFrame tuples
+        """
+        return extract_interactions(self)
+
     def __eq__(self, other):
         return self.server == other.server and\
                self.port == other.port and\
@@ -306,6 +602,64 @@ class Match(JsonObject):
             player.__caps_against__ = 0
             player.parse_events(CapDiffHandler(caps, player))
 
+    def __compute_splat_owners__(self):
+        """
+        Find the pops that caused the splats of both teams, in a single pass
+        over the events of all players. A team's splats are stored in the
+        order of these pops; pops at the same time are in the order of the
+        players.
+        """
+        # Indexed by Team
+        times = [[], [], []]
+        owners = [[], [], []]
+
+        class SplatOwnerHandler(PlayerEventHandler):
+            def __init__(self, player):
+                self.player = player
+
+            def drop(self, time, old_flag, powers, team):
+                self.pop(time, powers, team)
+
+            def pop(self, time, powers, team):
+                times[team].append(time)
+                owners[team].append(self.player)
+
+        for i, player in enumerate(self.players):
+            player.parse_events(SplatOwnerHandler(i))
+
+        self.__splatowners__ = []
+        for t, o in zip(times, owners):
+            if numpy is not None:
+                t = numpy.array(t, dtype=numpy.int64)
+                o = numpy.array(o, dtype=numpy.int64)
+                order = numpy.argsort(t, kind='stable')
+                self.__splatowners__.append((t[order], o[order]))
+            else:
+                order = sorted(range(len(t)), key=t.__getitem__)
+                self.__splatowners__.append(([t[j] for j in order],
+                                             [o[j] for j in order]))
+
+    def __compute_team_stats__(self):
+        """
+        Compute the stats, rosters and capture times of both teams, in a
+        single pass over the events of all players.
+        """
+        handlers = []
+
+        for player in self.players:
+            handler = TeamStatsHandler(player)
+            player.parse_events(handler)
+            handlers.append(handler)
+
+        for team in self.teams:
+            team.__stats__ = PlayerStats.sum(h.stats[team.team]
+                                             for h in handlers)
+            team.__roster__ = sorted(
+                (e for h in handlers for e in h.roster[team.team]),
+                key=lambda e: (e.start, e.player.index))
+            team.__captimes__ = sorted(t for h in handlers
+                                       for t in h.caps[team.team])
+
     def create_timeline(self, sort=False):
         """
         Return a timeline of events for all players in the match. Each event
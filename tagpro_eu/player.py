@@ -1,4 +1,3 @@
-from collections import defaultdict
 import heapq
 
 from tagpro_eu.blob import Blob
@@ -253,6 +252,8 @@ class PlayerEventHandler:
     """
     Event handler for reading a player's events blob.
     """
+    __slots__ = ()
+
     def join(self, time, new_team):
         pass
 
@@ -314,10 +315,104 @@ class PlayerEventHandler:
         pass
 
 
+class PowerupMap:
+    """
+    Mapping from powerups to values, with a fixed slot for each of the four
+    powerups and one for Powerup.none (used for duplicate powerups). Like a
+    defaultdict, every slot starts at the default value, and only the slots
+    with another value are included when iterating.
+    """
+    __slots__ = ('slots', 'default')
+
+    # The slot of each powerup
+    index = {p: i for i, p in enumerate((Powerup.none,) +
+                                        tuple(Powerup.enumerate()))}
+
+    def __init__(self, default=0):
+        """
+        :param default: the initial value of every slot
+        """
+        self.slots = [default] * 5
+        self.default = default
+
+    def __getitem__(self, power_up):
+        return self.slots[self.index[power_up]]
+
+    def __setitem__(self, power_up, value):
+        self.slots[self.index[power_up]] = value
+
+    def __iter__(self):
+        return (p for p, i in self.index.items()
+                if self.slots[i] != self.default)
+
+    def __len__(self):
+        return sum(v != self.default for v in self.slots)
+
+    def __contains__(self, power_up):
+        i = self.index.get(power_up)
+        return i is not None and self.slots[i] != self.default
+
+    def keys(self):
+        return list(self)
+
+    def values(self):
+        return [self.slots[self.index[p]] for p in self]
+
+    def items(self):
+        return [(p, self.slots[self.index[p]]) for p in self]
+
+    def get(self, power_up, default=None):
+        return self[power_up] if power_up in self else default
+
+    def __iadd__(self, other):
+        """
+        Add the values of another PowerupMap (or mapping) to this one.
+        """
+        if isinstance(other, PowerupMap):
+            s = self.slots
+            o = other.slots
+            s[0] += o[0]
+            s[1] += o[1]
+            s[2] += o[2]
+            s[3] += o[3]
+            s[4] += o[4]
+        else:
+            for p, v in other.items():
+                self[p] += v
+        return self
+
+    def __eq__(self, other):
+        if not hasattr(other, 'items'):
+            return NotImplemented
+        return dict(self.items()) == dict(other.items())
+
+    def __repr__(self):
+        return f'PowerupMap({dict(self.items())!r})'
+
+
 class PlayerStats(PlayerEventHandler):
     """
     Implementation of PlayerEventHandler that accumulates the player's stats.
+
+    Stats can be added up using + and +=, where += adds to the object in
+    place. To add up many stats, use PlayerStats.sum, which allocates a
+    single object. The builtin sum also works, but like + it creates a new
+    object (with new PowerupMaps) for every item.
     """
+    __slots__ = ('tags', 'pops', 'grabs', 'drops', 'hold', 'captures',
+                 'returns', 'prevent', 'button', 'block', 'pups', 'pup_time',
+                 'time', 'ingame_since', 'hold_since', 'prevent_since',
+                 'button_since', 'block_since', 'pup_since', 'caps_for',
+                 'caps_against')
+
+    # The stats that are added up by __add__, besides pups and pup_time
+    stat_fields = ('tags', 'pops', 'grabs', 'drops', 'hold', 'captures',
+                   'returns', 'prevent', 'button', 'block', 'time',
+                   'caps_for', 'caps_against')
+
+    # The stats that are an amount of time
+    time_fields = ('hold', 'prevent', 'button', 'block', 'time')
+
     def __init__(self):
         self.tags = 0
         self.pops = 0
@@ -329,8 +424,8 @@ class PlayerStats(PlayerEventHandler):
         self.prevent = Time()
         self.button = Time()
         self.block = Time()
-        self.pups = defaultdict(int)
-        self.pup_time = defaultdict(Time)
+        self.pups = PowerupMap()
+        self.pup_time = PowerupMap(Time())
         self.time = Time()
 
         self.ingame_since = -1
@@ -338,11 +433,24 @@ class PlayerStats(PlayerEventHandler):
         self.prevent_since = -1
         self.button_since = -1
         self.block_since = -1
-        self.pup_since = defaultdict(lambda: -1)
+        self.pup_since = PowerupMap(-1)
 
         # these are supplied by the player object
         self.caps_for = self.caps_against = 0
 
+    @classmethod
+    def sum(cls, stats):
+        """
+        Add up stats, using a single new PlayerStats object.
+
+        :param stats: iterable of PlayerStats objects
+        :returns: the sum of the stats
+        """
+        total = cls()
+        for s in stats:
+            total += s
+        return total
+
     @property
     def cap_diff(self):
         return self.caps_for - self.caps_against
@@ -354,25 +462,46 @@ class PlayerStats(PlayerEventHandler):
 
         :returns: number of powerups
         """
-        return sum(self.pups.values())
+        return sum(self.pups.slots)
 
     def __add__(self, other):
         new = PlayerStats()
-        keys = ['tags', 'pops', 'grabs', 'drops', 'hold', 'captures',
-                'returns', 'prevent', 'button', 'block', 'time',
-                'caps_for', 'caps_against']
-        pup_dicts = ['pups', 'pup_time']
-
-        for k in keys:
-            setattr(new, k, getattr(self, k) + getattr(other, k))
-
-        for k in pup_dicts:
-            for s in self, other:
-                for p, n in getattr(s, k).items():
-                    getattr(new, k)[p] += n
-
+        new += self
+        new += other
         return new
 
+    def __radd__(self, other):
+        # Allows using the builtin sum, which starts at 0. Every later step
+        # of sum is an __add__, which has to return a new object, so use
+        # PlayerStats.sum to avoid allocating one per item.
+        if other == 0:
+            new = PlayerStats()
+            new += self
+            return new
+        return NotImplemented
+
+    def __iadd__(self, other):
+        if not isinstance(other, PlayerStats):
+            return NotImplemented
+
+        self.tags += other.tags
+        self.pops += other.pops
+        self.grabs += other.grabs
+        self.drops += other.drops
+        self.hold += other.hold
+        self.captures += other.captures
+        self.returns += other.returns
+        self.prevent += other.prevent
+        self.button += other.button
+        self.block += other.block
+        self.time += other.time
+        self.caps_for += other.caps_for
+        self.caps_against += other.caps_against
+        self.pups += other.pups
+        self.pup_time += other.pup_time
+
+        return self
+
     def join(self, time, new_team):
         self.ingame_since = time
 
@@ -478,6 +607,174 @@ class PlayerStats(PlayerEventHandler):
             self.block_since = -1
 
 
+class BucketedStats(PlayerEventHandler):
+    """
+    Implementation of PlayerEventHandler that accumulates the same stats as
+    PlayerStats, but separately for every time bucket (e.g. every minute) of
+    the match, in a single pass over the events. Amounts of time (hold,
+    prevent, button, block, time in game and powerup time) are split over
+    the buckets they span.
+
+    Adding up all buckets gives the same result as PlayerStats, except for
+    caps_for and caps_against, which are not counted.
+    """
+    __slots__ = ('bucket_size', 'buckets', 'ingame_since', 'hold_since',
+                 'prevent_since', 'button_since', 'block_since', 'pup_since')
+
+    def __init__(self, bucket_size=Time.from_minutes(1)):
+        """
+        :param bucket_size: the length of a bucket (a Time)
+        """
+        self.bucket_size = bucket_size
+        self.buckets = []
+
+        self.ingame_since = -1
+        self.hold_since = -1
+        self.prevent_since = -1
+        self.button_since = -1
+        self.block_since = -1
+        self.pup_since = PowerupMap(-1)
+
+    def bucket(self, time):
+        """
+        Return the PlayerStats of the bucket containing the given time,
+        adding buckets if needed.
+
+        :param time: the time in the match
+        :returns: the PlayerStats object of the bucket
+        """
+        i = time // self.bucket_size
+        while len(self.buckets) <= i:
+            self.buckets.append(PlayerStats())
+        return self.buckets[i]
+
+    def _split(self, start, end):
+        """
+        Yield the bucket and the amount of time in it, for every bucket the
+        time span from start to end overlaps with.
+        """
+        while start < end:
+            bucket_end = (start // self.bucket_size + 1) * self.bucket_size
+            stop = min(end, bucket_end)
+            yield self.bucket(start), Time(stop - start)
+            start = stop
+
+    def total(self):
+        """
+        Return the sum of all buckets.
+
+        :returns: the PlayerStats object
+        """
+        return PlayerStats.sum(self.buckets)
+
+    def __iter__(self):
+        """
+        Yield the start time and PlayerStats of every bucket.
+        """
+        for i, stats in enumerate(self.buckets):
+            yield Time(i * self.bucket_size), stats
+
+    def __len__(self):
+        return len(self.buckets)
+
+    def _stop_ingame(self, time):
+        if self.ingame_since >= 0:
+            for b, t in self._split(self.ingame_since, time):
+                b.time += t
+            self.ingame_since = -1
+
+    def _stop_hold(self, time):
+        if self.hold_since >= 0:
+            for b, t in self._split(self.hold_since, time):
+                b.hold += t
+            self.hold_since = -1
+
+    def join(self, time, new_team):
+        self.ingame_since = time
+
+    def quit(self, time, old_flag, old_powers, old_team):
+        self._stop_ingame(time)
+
+    def grab(self, time, new_flag, powers, team):
+        self.bucket(time).grabs += 1
+        self.hold_since = time
+
+    def capture(self, time, old_flag, powers, team):
+        self.bucket(time).captures += 1
+        self._stop_hold(time)
+
+    def flagless_capture(self, time, flag, powers, team):
+        self.bucket(time).captures += 1
+
+    def powerup(self, time, flag, power_up, new_powers, team):
+        self.bucket(time).pups[power_up] += 1
+        self.pup_since[power_up] = time
+
+    def duplicate_powerup(self, time, flag, powers, team):
+        self.bucket(time).pups[Powerup.none] += 1
+
+    def powerdown(self, time, flag, power_down, new_powers, team):
+        if self.pup_since[power_down] >= 0:
+            for b, t in self._split(self.pup_since[power_down], time):
+                b.pup_time[power_down] += t
+            self.pup_since[power_down] = -1
+
+    def return_(self, time, flag, powers, team):
+        b = self.bucket(time)
+        b.returns += 1
+        b.tags += 1
+
+    def tag(self, time, flag, powers, team):
+        self.bucket(time).tags += 1
+
+    def drop(self, time, old_flag, powers, team):
+        b = self.bucket(time)
+        b.pops += 1
+        b.drops += 1
+        self._stop_hold(time)
+
+    def pop(self, time, powers, team):
+        self.bucket(time).pops += 1
+
+    def start_prevent(self, time, flag, powers, team):
+        self.prevent_since = time
+
+    def stop_prevent(self, time, flag, powers, team):
+        if self.prevent_since >= 0:
+            for b, t in self._split(self.prevent_since, time):
+                b.prevent += t
+            self.prevent_since = -1
+
+    def start_button(self, time, flag, powers, team):
+        self.button_since = time
+
+    def stop_button(self, time, flag, powers, team):
+        if self.button_since >= 0:
+            for b, t in self._split(self.button_since, time):
+                b.button += t
+            self.button_since = -1
+
+    def start_block(self, time, flag, powers, team):
+        self.block_since = time
+
+    def stop_block(self, time, flag, powers, team):
+        if self.block_since >= 0:
+            for b, t in self._split(self.block_since, time):
+                b.block += t
+            self.block_since = -1
+
+    def end(self, time, flag, powers, team):
+        self._stop_ingame(time)
+
+        for p in Powerup.enumerate():
+            self.powerdown(time, flag, p, powers, team)
+
+        self._stop_hold(time)
+        self.stop_prevent(time, flag, powers, team)
+        self.stop_button(time, flag, powers, team)
+        self.stop_block(time, flag, powers, team)
+
+
 class PlayerEventLogger(PlayerEventHandler):
     """
     Implementation of PlayerEventHandler that logs all events to a priority
@@ -0,0 +1,249 @@
+from tagpro_eu.constants import Team
+
+
+def team_names(team, roster=False):
+    """
+    Return the names of the players on a team. By default these are the
+    players on the team at the start of the match (see MatchTeam.players),
+    which doesn't need the events of the players to be decoded.
+
+    :param team: the MatchTeam object
+    :param roster: whether to include every player that was on the team at
+    some point in the match instead (see MatchTeam.roster), which decodes
+    the events of all players
+    :returns: frozenset of names
+    """
+    if roster:
+        return frozenset(entry.player.name for entry in team.roster)
+    return frozenset(p.name for p in team.players)
+
+
+def _compare_teams(h1, h2, roster):
+    red1, blue1 = team_names(h1.team_red, roster), \
+        team_names(h1.team_blue, roster)
+    red2, blue2 = team_names(h2.team_red, roster), \
+        team_names(h2.team_blue, roster)
+
+    stayed = len(red1 & red2) + len(blue1 & blue2)
+    switched = len(red1 & blue2) + len(blue1 & red2)
+
+    if stayed == switched:
+        return None
+    return switched > stayed
+
+
+def halves_switched(h1, h2, roster=True):
+    """
+    Return whether the teams switched colors between two halves: whether the
+    red team of h1 is the blue team of h2. Custom team names are compared
+    first, and otherwise the players on each team at the start of both
+    halves.
+
+    :param h1: the Match object of the first half
+    :param h2: the Match object of the second half
+    :param roster: whether to break ties using everyone who played on each
+    team (see MatchTeam.roster), which decodes the events of all players
+    :returns: True or False, or None if it can't be determined
+    """
+    r1, b1 = h1.team_red.name, h1.team_blue.name
+    r2, b2 = h2.team_red.name, h2.team_blue.name
+
+    if r1 != 'Red' and b1 != 'Blue':
+        if (r2, b2) == (r1, b1):
+            return False
+        elif (r2, b2) == (b1, r1):
+            return True
+
+    result = _compare_teams(h1, h2, False)
+    if result is None and roster:
+        result = _compare_teams(h1, h2, True)
+    return result
+
+
+def _overlap(a, b):
+    return len(a & b) / len(a | b) if a or b else 0.0
+
+
+class Series:
+    """
+    A series of matches played by the same players right after each other,
+    like the halves (and overtime) of a competitive game.
+    """
+    def __init__(self, key, match):
+        """
+        :param key: the key of the bucket the series was found in
+        :param match: the first match of the series
+        """
+        self.key = key
+        self.matches = [match]
+        self.names = frozenset(p.name for p in match.players)
+
+    @property
+    def start(self):
+        """
+        Return the start of the first match, as a timestamp.
+        """
+        return self.matches[0].date.timestamp()
+
+    @property
+    def end(self):
+        """
+        Return the end of the last match, as a timestamp.
+        """
+        last = self.matches[-1]
+        return last.date.timestamp() + last.duration / 60
+
+    def add(self, match):
+        self.matches.append(match)
+        self.names = frozenset(p.name for p in match.players)
+
+    def switched(self, i):
+        """
+        Return whether the teams in the i-th match have switched colors
+        relative to the first match (see halves_switched).
+        """
+        if i == 0:
+            return False
+        return halves_switched(self.matches[0], self.matches[i])
+
+    @property
+    def team_names(self):
+        """
+        Return the names of the teams, as named in the first match.
+
+        :returns: (red, blue) tuple of names
+        """
+        first = self.matches[0]
+        return first.team_red.name, first.team_blue.name
+
+    def scores(self):
+        """
+        Return the total scores of both teams over the series. The teams
+        are the red and blue team of the first match; when it can't be
+        determined whether they switched colors, it is assumed they didn't.
+
+        :returns: (red, blue) tuple of scores
+        """
+        red = blue = 0
+
+        for i, match in enumerate(self.matches):
+            r = match.team(Team.red).score
+            b = match.team(Team.blue).score
+            if self.switched(i):
+                r, b = b, r
+            red += r
+            blue += b
+
+        return red, blue
+
+    def __len__(self):
+        return len(self.matches)
+
+    def __repr__(self):
+        return f'Series(key={self.key!r}, matches={len(self.matches)})'
+
+
+class SeriesIndex:
+    """
+    Finds the matches that belong together, like the two halves of a
+    competitive game, among a large number of matches.
+
+    Matches are put into buckets by their group, or by their server and port
+    when they weren't played in a group. Within a bucket, matches are
+    processed by date, and a match continues a series when it starts at
+    most max_gap seconds after the end of the series, and its players
+    overlap enough with those of the last match in the series. Only the
+    series that are still open are compared, so this takes near-linear time.
+    """
+    def __init__(self, max_gap=1800, min_overlap=0.5):
+        """
+        :param max_gap: the maximum number of seconds between two matches in
+        a series
+        :param min_overlap: the minimum overlap between the players of two
+        matches in a series (the size of the intersection divided by the
+        size of the union of their names)
+        """
+        self.max_gap = max_gap
+        self.min_overlap = min_overlap
+        self.buckets = {}
+
+    @staticmethod
+    def key(match):
+        """
+        Return the bucket key of a match.
+
+        :param match: the Match object
+        :returns: ('group', group ID) or ('server', server, port) tuple
+        """
+        if match.group:
+            return 'group', match.group
+        return 'server', match.server, match.port
+
+    def add(self, match):
+        """
+        Add a match to the index.
+
+        :param match: the Match object
+        """
+        self.buckets.setdefault(self.key(match), []).append(match)
+
+    def update(self, matches):
+        """
+        Add multiple matches to the index.
+
+        :param matches: iterable of Match objects
+        """
+        for match in matches:
+            self.add(match)
+
+    def series(self, min_length=1):
+        """
+        Return all series of matches.
+
+        :param min_length: the minimum number of matches in a series, e.g. 2
+        to leave out single matches
+        :returns: list of Series objects, sorted by start date
+        """
+        result = []
+
+        for key, matches in self.buckets.items():
+            matches.sort(key=lambda m: m.date)
+            open_series = []
+
+            for match in matches:
+                start = match.date.timestamp()
+                names = frozenset(p.name for p in match.players)
+
+                open_series = [s for s in open_series
+                               if start - s.end <= self.max_gap]
+
+                best, best_overlap = None, self.min_overlap
+                for s in open_series:
+                    overlap = _overlap(s.names, names)
+                    if overlap >= best_overlap:
+                        best, best_overlap = s, overlap
+
+                if best is None:
+                    best = Series(key, match)
+                    open_series.append(best)
+                    result.append(best)
+                else:
+                    best.add(match)
+
+        result.sort(key=lambda s: s.start)
+        return [s for s in result if len(s) >= min_length]
+
+    def pairs(self):
+        """
+        Return the first two matches of every series with more than one
+        match, i.e. the two halves of every game.
+
+        :returns: list of (first half, second half) tuples
+        """
+        return [(s.matches[0], s.matches[1]) for s in self.series(2)]
+
+    def __len__(self):
+        return sum(len(m) for m in self.buckets.values())
+
+    def __repr__(self):
+        return f'SeriesIndex(matches={len(self)})'
@@ -0,0 +1,368 @@
+from bisect import bisect_left
+from collections import defaultdict
+import hashlib
+import itertools
+import math
+import random
+
+
+def stable_hash(s, salt=b''):
+    """
+    Return a 64-bit hash of a string, which (unlike hash) is the same in
+    every process, so sketches can be merged across processes.
+
+    :param s: the string to hash
+    :param salt: salt to get independent hash functions (at most 16 bytes)
+    :returns: the hash, as an integer
+    """
+    return int.from_bytes(hashlib.blake2b(str(s).encode('utf-8'),
+                                          digest_size=8,
+                                          salt=salt).digest(), 'little')
+
+
+class HyperLogLog:
+    """
+    Estimates the number of distinct strings added to it, using 2 ** p
+    bytes of memory. The standard error is about 1.04 / sqrt(2 ** p).
+    Sketches with the same p can be merged using |=.
+    """
+    def __init__(self, p=12):
+        """
+        :param p: the number of bits used to select a register (4 to 16)
+        """
+        self.p = p
+        self.registers = bytearray(1 << p)
+
+    def add(self, s):
+        """
+        Add a string to the sketch.
+
+        :param s: the string to add
+        """
+        h = stable_hash(s)
+        i = h >> (64 - self.p)
+        rest = h & ((1 << (64 - self.p)) - 1)
+        rank = 64 - self.p - rest.bit_length() + 1
+
+        if rank > self.registers[i]:
+            self.registers[i] = rank
+
+    def __ior__(self, other):
+        if self.p != other.p:
+            raise ValueError('Cannot merge HyperLogLogs of different size')
+
+        self.registers = bytearray(map(max, self.registers, other.registers))
+        return self
+
+    def __len__(self):
+        """
+        Return the estimated number of distinct strings.
+        """
+        m = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / sum(2.0 ** -r for r in self.registers)
+
+        # Use linear counting for small cardinalities
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * m and zeros:
+            estimate = m * math.log(m / zeros)
+
+        return round(estimate)
+
+    def __repr__(self):
+        return f'HyperLogLog(p={self.p}, estimate={len(self)})'
+
+
+class QuantileSketch:
+    """
+    Estimates quantiles of a stream of numbers using a KLL sketch: a stack
+    of compactors, where a full compactor sorts its values and passes every
+    other one on to the next, which gives each of them twice the weight.
+    Memory is O(k log(n / k)), and the rank error is roughly 1.7 / k.
+
+    Sketches with the same k can be merged using |=. Compaction uses a
+    seeded random generator, so results are reproducible.
+    """
+    def __init__(self, k=200, seed=0):
+        """
+        :param k: the capacity of the top compactor
+        :param seed: the seed for the random generator
+        """
+        self.k = k
+        self.n = 0
+        self.compactors = [[]]
+        self.random = random.Random(seed)
+
+    def _capacity(self, level):
+        depth = len(self.compactors) - level - 1
+        return max(2, math.ceil(self.k * (2 / 3) ** depth))
+
+    def _compress(self):
+        level = 0
+        while level < len(self.compactors):
+            values = self.compactors[level]
+
+            if len(values) >= self._capacity(level):
+                if level + 1 == len(self.compactors):
+                    self.compactors.append([])
+
+                values.sort()
+                offset = self.random.randrange(2)
+                self.compactors[level + 1].extend(values[offset::2])
+                self.compactors[level] = []
+
+            level += 1
+
+    def add(self, x):
+        """
+        Add a number to the sketch.
+
+        :param x: the number
+        """
+        self.n += 1
+        self.compactors[0].append(x)
+
+        if len(self.compactors[0]) >= self._capacity(0):
+            self._compress()
+
+    def __ior__(self, other):
+        if self.k != other.k:
+            raise ValueError('Cannot merge quantile sketches of different k')
+
+        while len(self.compactors) < len(other.compactors):
+            self.compactors.append([])
+        for mine, theirs in zip(self.compactors, other.compactors):
+            mine.extend(theirs)
+
+        self.n += other.n
+        self._compress()
+        return self
+
+    def __len__(self):
+        return self.n
+
+    def _weighted(self):
+        items = sorted((x, 1 << level)
+                       for level, values in enumerate(self.compactors)
+                       for x in values)
+        total = sum(w for _, w in items)
+        return items, total
+
+    def quantile(self, q):
+        """
+        Return the estimated q-quantile, e.g. q=0.5 for the median.
+
+        :param q: the quantile, between 0 and 1
+        :returns: the estimated value, or None if the sketch is empty
+        """
+        return self.quantiles([q])[0]
+
+    def quantiles(self, qs):
+        """
+        Return the estimated values of multiple quantiles.
+
+        :param qs: the quantiles, between 0 and 1
+        :returns: list of estimated values (None if the sketch is empty)
+        """
+        items, total = self._weighted()
+        if not items:
+            return [None] * len(qs)
+
+        cumulative = list(itertools.accumulate(w for _, w in items))
+        result = []
+
+        for q in qs:
+            i = bisect_left(cumulative, q * total)
+            result.append(items[min(i, len(items) - 1)][0])
+
+        return result
+
+    def rank(self, x):
+        """
+        Return the estimated fraction of values that are at most x.
+
+        :param x: the value
+        :returns: the fraction, between 0 and 1
+        """
+        items, total = self._weighted()
+        if not total:
+            return 0.0
+        return sum(w for v, w in items if v <= x) / total
+
+    def __repr__(self):
+        return f'QuantileSketch(k={self.k}, n={self.n})'
+
+
+class CountMinSketch:
+    """
+    Estimates how often strings were added, using a fixed amount of memory.
+    Estimates are never too low, and too high by at most 2n / width with
+    probability 1 - 2 ** -depth, where n is the total count. Sketches with
+    the same size can be merged using |=.
+    """
+    def __init__(self, width=2048, depth=4):
+        """
+        :param width: the number of counters per row
+        :param depth: the number of rows (independent hash functions)
+        """
+        self.width = width
+        self.depth = depth
+        self.rows = [[0] * width for _ in range(depth)]
+
+    def _positions(self, s):
+        return (stable_hash(s, salt=bytes([i])) % self.width
+                for i in range(self.depth))
+
+    def add(self, s, count=1):
+        """
+        Add a string to the sketch.
+
+        :param s: the string to add
+        :param count: the number of times to add it
+        """
+        for row, pos in zip(self.rows, self._positions(s)):
+            row[pos] += count
+
+    def __getitem__(self, s):
+        """
+        Return the estimated count of a string.
+        """
+        return min(row[pos] for row, pos in zip(self.rows, self._positions(s)))
+
+    def __ior__(self, other):
+        if (self.width, self.depth) != (other.width, other.depth):
+            raise ValueError('Cannot merge count-min sketches of different '
+                             'size')
+
+        for mine, theirs in zip(self.rows, other.rows):
+            for i, n in enumerate(theirs):
+                mine[i] += n
+        return self
+
+    def __repr__(self):
+        return f'CountMinSketch(width={self.width}, depth={self.depth})'
+
+
+def pair_key(a, b):
+    """
+    Return the key of a pair of player names in a CountMinSketch, which is
+    the same for (a, b) and (b, a).
+    """
+    return '\0'.join(sorted((a, b)))
+
+
+class MatchSketches:
+    """
+    Approximate aggregates over many matches, in a fixed amount of memory
+    per group:
+
+    - players: HyperLogLog of distinct player names, per map and per server
+    - stats: QuantileSketch of each of the given PlayerStats fields per
+      player per game (e.g. hold time), per map
+    - durations: QuantileSketch of match durations, per map
+    - caps: QuantileSketch of the total caps per match, per map
+    - together: CountMinSketch of how often two players played in the same
+      match (see games_together)
+
+    Sketches built in parallel (e.g. using Dataset.scan) can be combined
+    using merge, as long as they were created with the same settings.
+    Maps are identified by their map_id (see tagpro_eu.bulk.load_matches),
+    or None if the matches don't have one.
+    """
+    def __init__(self, stats=('hold', 'tags', 'pops', 'captures', 'time'),
+                 p=12, k=200, width=2048, depth=4):
+        """
+        :param stats: the PlayerStats fields to keep quantile sketches of
+        :param p: the precision of the HyperLogLog sketches
+        :param k: the size of the quantile sketches
+        :param width: the width of the CountMinSketch
+        :param depth: the depth of the CountMinSketch
+        """
+        self.stats = tuple(stats)
+        self.p = p
+        self.k = k
+
+        self.map_players = defaultdict(lambda: HyperLogLog(self.p))
+        self.server_players = defaultdict(lambda: HyperLogLog(self.p))
+        self.stat_quantiles = defaultdict(
+            lambda: {s: QuantileSketch(self.k) for s in self.stats})
+        self.durations = defaultdict(lambda: QuantileSketch(self.k))
+        self.caps = defaultdict(lambda: QuantileSketch(self.k))
+        self.together = CountMinSketch(width, depth)
+
+    def add(self, match):
+        """
+        Add a match to the sketches.
+
+        :param match: the Match object
+        """
+        map_id = getattr(match, 'map_id', None)
+        names = sorted({p.name for p in match.players})
+
+        for name in names:
+            self.map_players[map_id].add(name)
+            self.server_players[match.server].add(name)
+
+        quantiles = self.stat_quantiles[map_id]
+        for player in match.players:
+            stats = player.stats
+            for s in self.stats:
+                quantiles[s].add(int(getattr(stats, s)))
+
+        self.durations[map_id].add(int(match.duration))
+        self.caps[map_id].add(sum(t.score for t in match.teams))
+
+        for a, b in itertools.combinations(names, 2):
+            self.together.add(pair_key(a, b))
+
+    def games_together(self, a, b):
+        """
+        Return the estimated number of matches two players played in
+        together (on any team).
+
+        :param a: the name of a player
+        :param b: the name of another player
+        :returns: the estimated number of matches
+        """
+        return self.together[pair_key(a, b)]
+
+    def merge(self, other):
+        """
+        Add the sketches of another MatchSketches object to this one.
+
+        :param other: the other MatchSketches
+        :returns: self
+        """
+        for mine, theirs in ((self.map_players, other.map_players),
+                             (self.server_players, other.server_players),
+                             (self.durations, other.durations),
+                             (self.caps, other.caps)):
+            for key, sketch in theirs.items():
+                mine[key] |= sketch
+
+        for key, sketches in other.stat_quantiles.items():
+            mine = self.stat_quantiles[key]
+            for s, sketch in sketches.items():
+                mine[s] |= sketch
+
+        self.together |= other.together
+        return self
+
+    def __getstate__(self):
+        # The defaultdicts have lambdas, which can't be pickled
+        state = dict(self.__dict__)
+        for k, v in state.items():
+            if isinstance(v, defaultdict):
+                state[k] = dict(v)
+        return state
+
+    def __setstate__(self, state):
+        self.__init__(state['stats'], state['p'], state['k'])
+        for k, v in state.items():
+            if isinstance(getattr(self, k, None), defaultdict):
+                getattr(self, k).update(v)
+            else:
+                setattr(self, k, v)
+
+    def __repr__(self):
+        return f'MatchSketches(maps={len(self.durations)})'
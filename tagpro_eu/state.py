@@ -0,0 +1,202 @@
+from bisect import bisect_right
+from collections import namedtuple
+
+from tagpro_eu.constants import Flag, Powerup, Team
+from tagpro_eu.player import PlayerEventHandler
+
+
+class PlayerState(namedtuple('PlayerState', ['team', 'flag', 'powers',
+                                             'prevent', 'button', 'block'])):
+    """
+    The state of a player at some moment in a match: their team, the flag
+    they hold, their active powerups and whether they are preventing,
+    buttoning or blocking.
+    """
+    pass
+
+
+# State of a player that hasn't joined yet
+NO_STATE = PlayerState(Team.none, Flag.none, Powerup.none, False, False,
+                       False)
+
+# Part of a match during which a field of a player's state had a value.
+# The interval includes start, but not end.
+Interval = namedtuple('Interval', ['start', 'end', 'player', 'value'])
+
+
+class StateRecorder(PlayerEventHandler):
+    """
+    Implementation of PlayerEventHandler that records every change in the
+    player's state, as a list of times and a list of the PlayerState from
+    that time on. Multiple changes in the same frame are combined.
+    """
+    __slots__ = ('times', 'states')
+
+    def __init__(self):
+        self.times = []
+        self.states = []
+
+    @property
+    def state(self):
+        return self.states[-1] if self.states else NO_STATE
+
+    def change(self, time, **changes):
+        state = self.state._replace(**changes)
+
+        if self.times and self.times[-1] == time:
+            self.states[-1] = state
+        elif state != self.state:
+            self.times.append(time)
+            self.states.append(state)
+
+    def join(self, time, new_team):
+        self.change(time, team=new_team)
+
+    def quit(self, time, old_flag, old_powers, old_team):
+        self.change(time, team=Team.none, flag=Flag.none,
+                    powers=Powerup.none)
+
+    def switch(self, time, old_flag, powers, new_team):
+        self.change(time, team=new_team, flag=Flag.none)
+
+    def grab(self, time, new_flag, powers, team):
+        self.change(time, flag=new_flag)
+
+    def capture(self, time, old_flag, powers, team):
+        self.change(time, flag=Flag.none)
+
+    def powerup(self, time, flag, power_up, new_powers, team):
+        self.change(time, powers=new_powers)
+
+    def powerdown(self, time, flag, power_down, new_powers, team):
+        self.change(time, powers=new_powers)
+
+    def drop(self, time, old_flag, powers, team):
+        self.change(time, flag=Flag.none)
+
+    def start_prevent(self, time, flag, powers, team):
+        self.change(time, prevent=True)
+
+    def stop_prevent(self, time, flag, powers, team):
+        self.change(time, prevent=False)
+
+    def start_button(self, time, flag, powers, team):
+        self.change(time, button=True)
+
+    def stop_button(self, time, flag, powers, team):
+        self.change(time, button=False)
+
+    def start_block(self, time, flag, powers, team):
+        self.change(time, block=True)
+
+    def stop_block(self, time, flag, powers, team):
+        self.change(time, block=False)
+
+
+class StateIndex:
+    """
+    Index of the state of every player throughout a match, built from one
+    pass over every player's events. The state of all players at any time
+    is found using binary search, as are the intervals during which players
+    held a flag, had powerups, etc.
+    """
+    def __init__(self, match):
+        """
+        :param match: the Match object to index
+        """
+        self.match = match
+        self.recorders = []
+
+        for player in match.players:
+            recorder = StateRecorder()
+            player.parse_events(recorder)
+            self.recorders.append(recorder)
+
+        self.__intervals__ = {}
+
+    def player_state(self, player, time):
+        """
+        Return the state of a player at the given time, after all events of
+        that frame.
+
+        :param player: the index of the player in Match.players
+        :param time: the time in the match
+        :returns: the PlayerState
+        """
+        recorder = self.recorders[player]
+        i = bisect_right(recorder.times, time)
+        return recorder.states[i - 1] if i else NO_STATE
+
+    def state_at(self, time):
+        """
+        Return the state of every player at the given time, after all events
+        of that frame.
+
+        :param time: the time in the match
+        :returns: list of PlayerState tuples, in the order of Match.players
+        """
+        return [self.player_state(i, time)
+                for i in range(len(self.recorders))]
+
+    def _intervals(self, field):
+        """
+        Return, for every player, the intervals during which the given field
+        of their state had a value other than none/False, as lists of
+        starts, ends and values.
+        """
+        if field not in self.__intervals__:
+            result = []
+            end = self.match.duration
+
+            for recorder in self.recorders:
+                starts, ends, values = [], [], []
+                current, since = None, None
+
+                for time, state in zip(recorder.times + [end],
+                                       recorder.states + [None]):
+                    value = getattr(state, field) if state else None
+                    if value == current:
+                        continue
+                    if current:
+                        starts.append(since)
+                        ends.append(time)
+                        values.append(current)
+                    current, since = value, time
+
+                result.append((starts, ends, values))
+
+            self.__intervals__[field] = result
+
+        return self.__intervals__[field]
+
+    def intervals(self, field, start=0, end=None):
+        """
+        Return the intervals in which players had a value for a field of
+        their state (e.g. 'flag' for flag holds), which overlap with the
+        given time range. For 'powers', every combination of powerups gets
+        its own interval.
+
+        :param field: the PlayerState field, e.g. 'flag' or 'prevent'
+        :param start: the start of the time range
+        :param end: the end of the time range, inclusive (omit for the end
+        of the match)
+        :returns: list of Interval tuples, sorted by start, with the index
+        of the player in Match.players
+        """
+        if field not in PlayerState._fields:
+            raise ValueError(f'Invalid field: {field!r}')
+
+        result = []
+
+        for player, (starts, ends, values) in \
+                enumerate(self._intervals(field)):
+            i = bisect_right(ends, start)
+            j = len(starts) if end is None else bisect_right(starts, end)
+            result.extend(Interval(starts[k], ends[k], player, values[k])
+                          for k in range(i, j))
+
+        result.sort()
+        return result
+
+    def __repr__(self):
+        return f'StateIndex(players={len(self.recorders)})'
@@ -0,0 +1,309 @@
+import os
+import sqlite3
+
+from tagpro_eu.bulk import bulk_files, create_match, load_json
+from tagpro_eu.constants import Powerup
+from tagpro_eu.player import PlayerStats
+from tagpro_eu.util import Time
+
+
+# The powerups counted in PlayerStats.pups, including duplicates (none)
+PUPS = (Powerup.none,) + tuple(Powerup.enumerate())
+
+STAT_COLUMNS = PlayerStats.stat_fields +\
+    tuple(f'pups_{p.name}' for p in PUPS) +\
+    tuple(f'pup_time_{p.name}' for p in Powerup.enumerate())
+
+SCHEMA = f'''
+CREATE TABLE IF NOT EXISTS matches (
+    match_id TEXT PRIMARY KEY,
+    date INTEGER,
+    map_id INTEGER,
+    server TEXT,
+    port INTEGER,
+    group_id TEXT,
+    official INTEGER,
+    finished INTEGER,
+    duration INTEGER,
+    score_red INTEGER,
+    score_blue INTEGER
+);
+CREATE TABLE IF NOT EXISTS players (
+    match_id TEXT,
+    idx INTEGER,
+    name TEXT,
+    auth INTEGER,
+    team INTEGER,
+    score INTEGER,
+    points INTEGER,
+    {', '.join(f'{c} INTEGER' for c in STAT_COLUMNS)},
+    PRIMARY KEY (match_id, idx)
+);
+CREATE INDEX IF NOT EXISTS players_name ON players (name);
+CREATE INDEX IF NOT EXISTS matches_date ON matches (date);
+CREATE TABLE IF NOT EXISTS sources (
+    path TEXT PRIMARY KEY,
+    size INTEGER,
+    mtime REAL
+);
+'''
+
+
+def stats_row(stats):
+    """
+    Return the values of the STAT_COLUMNS of a PlayerStats object.
+
+    :param stats: the PlayerStats object
+    :returns: tuple of integers
+    """
+    return tuple(int(getattr(stats, f)) for f in PlayerStats.stat_fields) +\
+        tuple(stats.pups[p] for p in PUPS) +\
+        tuple(int(stats.pup_time[p]) for p in Powerup.enumerate())
+
+
+def stats_from_row(row):
+    """
+    Create a PlayerStats object from the values of the STAT_COLUMNS.
+
+    :param row: sequence of values, in the order of STAT_COLUMNS
+    :returns: the PlayerStats object
+    """
+    stats = PlayerStats()
+    values = iter(v or 0 for v in row)
+
+    for f in PlayerStats.stat_fields:
+        v = next(values)
+        setattr(stats, f, Time(v) if f in PlayerStats.time_fields else v)
+    for p in PUPS:
+        v = next(values)
+        if v:
+            stats.pups[p] = v
+    for p in Powerup.enumerate():
+        v = next(values)
+        if v:
+            stats.pup_time[p] = Time(v)
+
+    return stats
+
+
+class StatsStore:
+    """
+    SQLite database of matches, players and their stats. Bulk files can be
+    ingested incrementally: matches that are already in the database are
+    skipped, as are files that haven't changed since they were ingested.
+    Aggregates are computed by SQLite, with the same semantics as adding up
+    PlayerStats objects.
+    """
+    def __init__(self, path):
+        """
+        Open the database at the given path, creating it if it doesn't exist.
+
+        :param path: the path of the database file (or ':memory:')
+        """
+        self.db = sqlite3.connect(path)
+        self.db.executescript(SCHEMA)
+
+    def close(self):
+        self.db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __contains__(self, match_id):
+        return self.db.execute('SELECT 1 FROM matches WHERE match_id = ?',
+                               (match_id,)).fetchone() is not None
+
+    def __len__(self):
+        return self.db.execute('SELECT COUNT(*) FROM matches').fetchone()[0]
+
+    def _existing(self, match_ids):
+        found = set()
+        match_ids = list(match_ids)
+
+        # Stay below SQLite's limit on the number of parameters
+        for i in range(0, len(match_ids), 500):
+            chunk = match_ids[i:i + 500]
+            query = 'SELECT match_id FROM matches WHERE match_id IN (' +\
+                ', '.join('?' * len(chunk)) + ')'
+            found.update(r[0] for r in self.db.execute(query, chunk))
+
+        return found
+
+    def _insert(self, matches):
+        match_rows = []
+        player_rows = []
+
+        for match in matches:
+            match_rows.append((
+                match.match_id,
+                int(match.date.timestamp()) if match.date else None,
+                getattr(match, 'map_id', None),
+                match.server,
+                match.port,
+                match.group,
+                match.official,
+                match.finished,
+                match.duration,
+                match.team_red.score,
+                match.team_blue.score,
+            ))
+
+            for player in match.players:
+                player_rows.append((
+                    match.match_id,
+                    player.index,
+                    player.name,
+                    player.auth,
+                    player.__team__,
+                    player.score,
+                    player.points,
+                ) + stats_row(player.stats))
+
+        with self.db:
+            self.db.executemany(
+                'INSERT OR IGNORE INTO matches VALUES (' +
+                ', '.join('?' * len(match_rows[0])) + ')', match_rows)
+            self.db.executemany(
+                'INSERT OR IGNORE INTO players VALUES (' +
+                ', '.join('?' * (7 + len(STAT_COLUMNS))) + ')', player_rows)
+
+    def add_matches(self, matches, batch_size=500):
+        """
+        Add Match objects to the database, skipping the ones that are in
+        there already. Every match needs a match_id, like the ones from
+        tagpro_eu.bulk.load_matches.
+
+        :param matches: iterable of Match objects
+        :param batch_size: the number of matches to insert per transaction
+        :returns: the number of matches added
+        """
+        added = 0
+        batch = []
+
+        def flush():
+            existing = self._existing(m.match_id for m in batch)
+            new = [m for m in batch if m.match_id not in existing]
+            if new:
+                self._insert(new)
+            batch.clear()
+            return len(new)
+
+        for match in matches:
+            batch.append(match)
+            if len(batch) >= batch_size:
+                added += flush()
+
+        return added + flush()
+
+    def ingest(self, source, maps=None, batch_size=500):
+        """
+        Ingest bulk files into the database. Matches that are already in the
+        database are skipped without decoding them, and files that were
+        ingested before and haven't changed since (by size and modification
+        time) are skipped entirely.
+
+        :param source: the bulk files, as described in
+        tagpro_eu.bulk.bulk_files
+        :param maps: the maps object (omit if undesired)
+        :param batch_size: the number of matches to insert per transaction
+        :returns: the number of matches added
+        """
+        added = 0
+
+        for f in bulk_files(source):
+            stat = None
+            if not hasattr(f, 'read'):
+                stat = os.stat(f)
+                row = self.db.execute(
+                    'SELECT size, mtime FROM sources WHERE path = ?',
+                    (os.path.abspath(f),)).fetchone()
+                if row == (stat.st_size, stat.st_mtime):
+                    continue
+
+            data = load_json(f)
+            keys = list(data)
+
+            for i in range(0, len(keys), batch_size):
+                chunk = keys[i:i + batch_size]
+                existing = self._existing(chunk)
+                new = [create_match(k, data[k], maps)
+                       for k in chunk if k not in existing]
+                if new:
+                    self._insert(new)
+                    added += len(new)
+
+            if stat is not None:
+                with self.db:
+                    self.db.execute(
+                        'INSERT OR REPLACE INTO sources VALUES (?, ?, ?)',
+                        (os.path.abspath(f), stat.st_size, stat.st_mtime))
+
+        return added
+
+    def _where(self, name=None, auth=None, map_id=None, date_from=None,
+               date_to=None):
+        conditions = []
+        params = []
+
+        for column, op, value in (('p.name', '=', name),
+                                  ('p.auth', '=', auth),
+                                  ('m.map_id', '=', map_id),
+                                  ('m.date', '>=', date_from),
+                                  ('m.date', '<=', date_to)):
+            if value is not None:
+                if hasattr(value, 'timestamp'):
+                    value = int(value.timestamp())
+                conditions.append(f'{column} {op} ?')
+                params.append(value)
+
+        where = ' WHERE ' + ' AND '.join(conditions) if conditions else ''
+        return where, params
+
+    def player_stats(self, name, auth=None, map_id=None, date_from=None,
+                     date_to=None):
+        """
+        Return the sum of a player's stats over all matches in the database
+        satisfying the given conditions, as a PlayerStats object.
+
+        :param name: the name of the player
+        :param auth: only include games with this auth flag (omit for both)
+        :param map_id: only include games on this map
+        :param date_from: only include games from this date on (datetime or
+        timestamp)
+        :param date_to: only include games up to this date (datetime or
+        timestamp)
+        :returns: the PlayerStats object
+        """
+        where, params = self._where(name, auth, map_id, date_from, date_to)
+        row = self.db.execute(
+            'SELECT ' + ', '.join(f'SUM(p.{c})' for c in STAT_COLUMNS) +
+            ' FROM players p JOIN matches m USING (match_id)' + where,
+            params).fetchone()
+        return stats_from_row(row)
+
+    def all_player_stats(self, map_id=None, date_from=None, date_to=None):
+        """
+        Return the sum of every player's stats over all matches in the
+        database satisfying the given conditions. Players are grouped by
+        name only.
+
+        :param map_id: only include games on this map
+        :param date_from: only include games from this date on (datetime or
+        timestamp)
+        :param date_to: only include games up to this date (datetime or
+        timestamp)
+        :returns: dict mapping player names to PlayerStats objects
+        """
+        where, params = self._where(None, None, map_id, date_from, date_to)
+        rows = self.db.execute(
+            'SELECT p.name, ' +
+            ', '.join(f'SUM(p.{c})' for c in STAT_COLUMNS) +
+            ' FROM players p JOIN matches m USING (match_id)' + where +
+            ' GROUP BY p.name', params)
+        return {row[0]: stats_from_row(row[1:]) for row in rows}
+
+    def __repr__(self):
+        return 'StatsStore()'
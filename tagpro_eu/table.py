@@ -0,0 +1,363 @@
+from functools import reduce
+import operator
+
+from tagpro_eu.store import STAT_COLUMNS, stats_from_row, stats_row
+from tagpro_eu.util import require_numpy
+
+
+class StatsTable:
+    """
+    Columnar table of player stats, with one row per player per match and
+    one numpy array per column. Besides the stat columns (see
+    tagpro_eu.store.STAT_COLUMNS), every row has the columns:
+
+    - match_id: the match ID (str)
+    - date: the date of the match, as a timestamp
+    - map_id: the map ID of the match (-1 if unknown)
+    - name: the name of the player (str)
+    - auth: whether the player was authorized
+    - team: the team of the player at the start of the match
+
+    Rows can be aggregated by any of these columns (or a combination of
+    them) at once, which is much faster than adding up PlayerStats objects.
+
+    The string columns (match_id and name) are dictionary-encoded: data
+    holds an int32 code per row, which indexes the sorted array of distinct
+    values in lookup. Indexing the table with the column name decodes them.
+
+    This class requires numpy.
+    """
+    key_columns = ('match_id', 'date', 'map_id', 'name', 'auth', 'team')
+    columns = key_columns + STAT_COLUMNS
+    encoded_columns = ('match_id', 'name')
+
+    def __init__(self, data=None, lookup=None):
+        """
+        :param data: dict mapping every column name to an array of equal
+        length (omit for an empty table)
+        :param lookup: dict mapping encoded columns to their arrays of
+        distinct values, in which case data holds the codes of those columns
+        instead of the values
+        """
+        np = require_numpy()
+
+        if data is None:
+            data = {}
+        if lookup is None:
+            lookup = {}
+
+        self.data = {}
+        self.lookup = {}
+        for c in self.columns:
+            if c in self.encoded_columns:
+                values = data.get(c, ())
+                if c in lookup:
+                    values, codes = lookup[c], values
+                else:
+                    codes = np.arange(len(values))
+                self.lookup[c], self.data[c] = self._encode(values, codes)
+            else:
+                self.data[c] = np.asarray(data.get(c, ()),
+                                          dtype=self._dtype(c))
+
+        lengths = {len(a) for a in self.data.values()}
+        if len(lengths) > 1:
+            raise ValueError('All columns must have the same length')
+
+    @staticmethod
+    def _dtype(column):
+        np = require_numpy()
+
+        if column == 'auth':
+            return bool
+        return np.int64
+
+    @staticmethod
+    def _encode(values, codes):
+        """
+        Return the sorted distinct values and the codes indexing them, given
+        any array of values and codes indexing that.
+        """
+        np = require_numpy()
+
+        # Deduplicate using a dict first, so only the distinct values are
+        # sorted
+        ids = {}
+        remap = np.fromiter((ids.setdefault(v, len(ids)) for v in values),
+                            dtype=np.int64, count=len(values))
+
+        distinct = np.empty(len(ids), dtype=object)
+        distinct[:] = list(ids)
+        lookup, inverse = np.unique(distinct, return_inverse=True)
+        if len(lookup) > np.iinfo(np.int32).max:
+            raise ValueError('Too many distinct values to encode')
+
+        inverse = inverse.reshape(-1).astype(np.int32)
+        return lookup, inverse[remap][np.asarray(codes, dtype=np.int64)]
+
+    @classmethod
+    def from_matches(cls, matches):
+        """
+        Create a table from the players in the given matches. Every match
+        needs a match_id, like the ones from tagpro_eu.bulk.load_matches.
+
+        :param matches: iterable of Match objects
+        :returns: the StatsTable
+        """
+        rows = []
+        # Encoded column -> value -> code, in order of appearance
+        ids = {c: {} for c in cls.encoded_columns}
+        match_ids, names = ids['match_id'], ids['name']
+
+        for match in matches:
+            date = int(match.date.timestamp()) if match.date else 0
+            map_id = getattr(match, 'map_id', -1)
+            match_code = match_ids.setdefault(match.match_id, len(match_ids))
+
+            for player in match.players:
+                name_code = names.setdefault(player.name, len(names))
+                rows.append((match_code, date, map_id, name_code,
+                             player.auth, player.__team__) +
+                            stats_row(player.stats))
+
+        if not rows:
+            return cls()
+
+        return cls(dict(zip(cls.columns, zip(*rows))),
+                   {c: list(v) for c, v in ids.items()})
+
+    @classmethod
+    def concatenate(cls, tables):
+        """
+        Combine multiple tables into one, e.g. tables built in parallel.
+
+        :param tables: iterable of StatsTable objects
+        :returns: the combined StatsTable
+        """
+        np = require_numpy()
+
+        tables = list(tables)
+        if not tables:
+            return cls()
+
+        data = {}
+        lookup = {}
+        for c in cls.columns:
+            if c in cls.encoded_columns:
+                # Shift the codes of every table past the values of the
+                # tables before it, and let _encode merge the values
+                offsets = np.cumsum([0] + [len(t.lookup[c]) for t in tables])
+                data[c] = np.concatenate([
+                    t.data[c].astype(np.int64) + offset
+                    for t, offset in zip(tables, offsets)])
+                lookup[c] = np.concatenate([t.lookup[c] for t in tables])
+            else:
+                data[c] = np.concatenate([t.data[c] for t in tables])
+
+        return cls(data, lookup)
+
+    def __len__(self):
+        return len(self.data['match_id'])
+
+    def __getitem__(self, column):
+        """
+        Return the array of a column. Encoded columns are decoded; their
+        codes are in data.
+        """
+        if column in self.lookup:
+            return self.lookup[column][self.data[column]]
+        return self.data[column]
+
+    def code(self, column, value):
+        """
+        Return the code of a value in an encoded column, e.g. to select rows
+        without decoding the column.
+
+        :param column: the encoded column, e.g. 'name'
+        :param value: the value
+        :returns: the code, or -1 if the value doesn't occur
+        """
+        np = require_numpy()
+
+        lookup = self.lookup[column]
+        i = np.searchsorted(lookup, value)
+        return int(i) if i < len(lookup) and lookup[i] == value else -1
+
+    def filter(self, mask):
+        """
+        Return a table with only the selected rows.
+
+        :param mask: boolean array (or index array) selecting the rows
+        :returns: the new StatsTable
+        """
+        return StatsTable({c: a[mask] for c, a in self.data.items()},
+                          self.lookup)
+
+    def date_bucket(self, seconds, origin=0):
+        """
+        Return the date bucket of every row, to aggregate by e.g. week.
+
+        :param seconds: the size of a bucket in seconds
+        :param origin: the timestamp at which the first bucket starts
+        :returns: array with the start of the bucket of each row, as a
+        timestamp
+        """
+        d = self.data['date'] - origin
+        return d - d % seconds + origin
+
+    @staticmethod
+    def _compact(codes, size):
+        """
+        Return the codes (from 0 to size) that occur, and the index of every
+        code among those, using a bincount instead of sorting.
+        """
+        np = require_numpy()
+
+        present = np.flatnonzero(np.bincount(codes, minlength=size))
+        rank = np.zeros(size, dtype=np.int64)
+        rank[present] = np.arange(len(present))
+        return present, rank[codes]
+
+    def _unique(self, values):
+        """
+        Return the distinct values and the index of every value among them,
+        like numpy.unique. Integers in a small range use _compact.
+        """
+        np = require_numpy()
+
+        if values.dtype.kind in 'iu' and len(values):
+            low = int(values.min())
+            size = int(values.max()) - low + 1
+            if size <= 2 * len(values) + (1 << 16):
+                present, inverse = self._compact(values - low, size)
+                return present + low, inverse
+
+        return np.unique(values, return_inverse=True)
+
+    def _group(self, by):
+        np = require_numpy()
+
+        if isinstance(by, (str, np.ndarray)):
+            by = (by,)
+
+        keys = []
+        codes = []
+
+        for b in by:
+            if isinstance(b, str) and b in self.lookup:
+                present, inv = self._compact(self.data[b],
+                                             len(self.lookup[b]))
+                k = self.lookup[b][present]
+            else:
+                values = self.data[b] if isinstance(b, str) else \
+                    np.asarray(b)
+                k, inv = self._unique(values)
+            keys.append(k)
+            codes.append(inv.reshape(-1))
+
+        if len(keys) == 1:
+            return tuple(keys), codes[0], len(keys[0])
+
+        shape = tuple(len(k) for k in keys)
+        size = reduce(operator.mul, shape, 1)
+
+        if size < 1 << 62:
+            combined = np.ravel_multi_index(codes, shape) if codes else \
+                np.zeros(len(self), dtype=np.int64)
+            groups, inverse = self._unique(combined)
+            indices = np.unravel_index(groups, shape) if shape else ()
+            n = len(groups)
+        else:
+            # The combined codes would overflow int64
+            rows, inverse = np.unique(np.stack(codes, axis=1), axis=0,
+                                      return_inverse=True)
+            indices = tuple(rows.T)
+            n = len(rows)
+
+        keys = tuple(k[i] for k, i in zip(keys, indices))
+        return keys, inverse.reshape(-1), n
+
+    def aggregate(self, by='name', columns=None):
+        """
+        Add up the stats of all rows with the same value in the given
+        column(s).
+
+        :param by: the column name to group by, an array with a value per
+        row (e.g. from date_bucket), or a tuple of those
+        :param columns: the stat columns to add up (omit for all of them)
+        :returns: (keys, sums) tuple, where keys is a tuple with an array of
+        group values per grouping column, and sums is a dict mapping column
+        names to arrays with the sum per group. The number of rows per group
+        is included as the column 'games'.
+        """
+        np = require_numpy()
+
+        if columns is None:
+            columns = STAT_COLUMNS
+
+        keys, inverse, n = self._group(by)
+
+        sums = {'games': np.bincount(inverse, minlength=n)}
+        for c in columns:
+            sums[c] = np.bincount(inverse, weights=self.data[c],
+                                  minlength=n).astype(np.int64)
+
+        return keys, sums
+
+    def player_stats(self, by='name'):
+        """
+        Add up the stats of all rows with the same value in the given
+        column(s), and convert them to PlayerStats objects.
+
+        :param by: the column(s) to group by, as in aggregate
+        :returns: dict mapping group values to PlayerStats objects (tuples of
+        values when grouping by multiple columns)
+        """
+        keys, sums = self.aggregate(by)
+        columns = [sums[c] for c in STAT_COLUMNS]
+
+        result = {}
+        for i, key in enumerate(zip(*keys)):
+            if len(key) == 1:
+                key = key[0]
+            result[key] = stats_from_row([int(a[i]) for a in columns])
+
+        return result
+
+    def save(self, path):
+        """
+        Save the table to a .npz file.
+
+        :param path: the path of the file
+        """
+        np = require_numpy()
+
+        data = dict(self.data)
+        for c, values in self.lookup.items():
+            data[f'{c}_lookup'] = values.astype(str)
+        np.savez_compressed(path, **data)
+
+    @classmethod
+    def load(cls, path):
+        """
+        Load a table saved using save.
+
+        :param path: the path of the file
+        :returns: the StatsTable
+        """
+        np = require_numpy()
+
+        with np.load(path) as f:
+            data = {c: f[c] for c in cls.columns}
+            lookup = {c: f[f'{c}_lookup'].tolist()
+                      for c in cls.encoded_columns if f'{c}_lookup' in f.files}
+
+        # Files saved before the string columns were encoded hold the values
+        for c in cls.encoded_columns:
+            if c not in lookup:
+                data[c] = data[c].tolist()
+
+        return cls(data, lookup)
+
+    def __repr__(self):
+        return f'StatsTable(rows={len(self)})'
@@ -1,3 +1,22 @@
+try:
+    import numpy
+except ImportError:  # numpy is an optional dependency
+    numpy = None
+
+
+def require_numpy():
+    """
+    Return the numpy module, for features that need it.
+
+    :returns: the numpy module
+    :raises ImportError: when numpy is not installed
+    """
+    if numpy is None:
+        raise ImportError('This feature requires numpy, which can be '
+                          'installed using: pip install tagpro-eu[numpy]')
+    return numpy
+
+
 class Time(int):
     """
     Represents an amount of time in-game.
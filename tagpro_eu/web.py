@@ -1,10 +1,33 @@
+import asyncio
+import concurrent.futures
+import io
+import json
 import re
 import requests
+import threading
+import time
+import zlib
+
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 import tagpro_eu.match
 
+try:
+    import aiohttp
+except ImportError:  # aiohttp is only needed for the async API
+    aiohttp = None
+
+
+# Timeout in seconds for HTTP requests
+DEFAULT_TIMEOUT = 30
+
+# Size in bytes of the chunks in which responses are read
+CHUNK_SIZE = 1 << 16
 
-def download_match(url=None, id=None, raw_url=None):
+
+def download_match(url=None, id=None, raw_url=None, session=None,
+                   timeout=DEFAULT_TIMEOUT, cache=None):
     """
     Download the match with the given ID or URL, and return it as a Match
     object.
@@ -22,18 +45,183 @@ def download_match(url=None, id=None, raw_url=None):
     will work for match links, download links, match IDs and raw data links
     for matches hosted elsewhere.
 
+    If the match ID is known, it is added as the property match_id of the
+    returned Match object, like in tagpro_eu.bulk.
+
     This method should probably not be called too many times, as it makes
     requests to tagpro.eu. If you have to download multiple matches, consider
     using a bulk file, which you can (manually) download on
     https://tagpro.eu/?science. The module tagpro_eu.bulk has methods for
-    loading those.
+    loading those. For a moderate number of matches, download_matches reuses
+    connections and downloads concurrently. If the same matches are
+    downloaded repeatedly, pass a tagpro_eu.cache.MatchCache as cache.
 
     :param id: a match ID
     :param url: a tagpro.eu match URL
     :param raw_url: a direct link to raw data that doesn't have to be on
     tagpro.eu
+    :param session: the requests.Session to use (omit to use a new
+    connection)
+    :param timeout: the timeout for the request in seconds
+    :param cache: the MatchCache to use (omit to always download)
     :returns: the corresponding Match object
     :raises ValueError: when no valid id, url or raw_url was given
+    :raises requests.RequestException: when the download failed
+    """
+    id, raw_url = resolve_match_url(url, id, raw_url)
+    return _download_match(id, raw_url, session, timeout, cache)
+
+
+def _download_match(id, raw_url, session, timeout, cache, limiter=None):
+    """
+    Implementation of download_match, that waits for the given RateLimiter
+    before making a request.
+    """
+    entry = None
+
+    if cache is not None:
+        key = cache.key(id, raw_url)
+        entry = cache.load(key)
+
+        if entry is not None and entry.finished:
+            return parse_match(entry.content, id)
+
+    # Revalidate cached data of unfinished matches
+    headers = {}
+    if entry is not None:
+        if entry.etag:
+            headers['If-None-Match'] = entry.etag
+        if entry.last_modified:
+            headers['If-Modified-Since'] = entry.last_modified
+
+    if limiter is not None:
+        limiter.wait()
+
+    headers['Accept-Encoding'] = 'gzip'
+
+    with (session or requests).get(raw_url, headers=headers, timeout=timeout,
+                                   stream=True) as r:
+        if entry is not None and r.status_code == 304:
+            return parse_match(entry.content, id)
+
+        r.raise_for_status()
+
+        # Keep the response as received, to store it in the cache
+        received = [] if cache is not None else None
+
+        reader = ResponseReader(r, received)
+        match = parse_match(io.TextIOWrapper(io.BufferedReader(reader),
+                                             encoding='utf-8'), id)
+
+    if cache is not None:
+        args = (key, b''.join(received), match.finished is True,
+                r.headers.get('ETag'), r.headers.get('Last-Modified'))
+        if reader.gzipped:
+            cache.store_compressed(*args)
+        else:
+            cache.store(*args)
+
+    return match
+
+
+class ResponseReader(io.RawIOBase):
+    """
+    Readable stream over the body of a streamed requests.Response, which
+    decompresses gzip-encoded responses on the fly. This way, a response can
+    be parsed with json.load without first buffering the whole body.
+
+    The chunks can be collected as received, i.e. still compressed if the
+    server used gzip, so they can be stored without compressing them again.
+    """
+    def __init__(self, response, received=None):
+        """
+        :param response: the response, requested with stream=True
+        :param received: list to append the received chunks to (omit if
+        undesired)
+        """
+        encoding = response.headers.get('Content-Encoding', '').lower()
+
+        self.gzipped = encoding == 'gzip'
+        self.received = received
+        self.buffer = b''
+        self.offset = 0
+
+        # Let urllib3 decode any other encoding
+        decode = encoding not in ('', 'identity', 'gzip')
+        self.chunks = response.raw.stream(CHUNK_SIZE, decode_content=decode)
+        self.decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)\
+            if self.gzipped else None
+
+    def readable(self):
+        return True
+
+    def _next_chunk(self):
+        for chunk in self.chunks:
+            if self.received is not None:
+                self.received.append(chunk)
+            if self.decompressor is None:
+                return chunk
+
+            data = self.decompressor.decompress(chunk)
+
+            # Concatenated gzip members are allowed
+            while self.decompressor.unused_data:
+                rest = self.decompressor.unused_data
+                self.decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+                data += self.decompressor.decompress(rest)
+
+            if data:
+                return data
+
+        return b''
+
+    def readinto(self, b):
+        if self.offset == len(self.buffer):
+            self.buffer = self._next_chunk()
+            self.offset = 0
+
+        n = min(len(b), len(self.buffer) - self.offset)
+        b[:n] = self.buffer[self.offset:self.offset + n]
+        self.offset += n
+        return n
+
+
+def parse_match(content, id=None, decode=False):
+    """
+    Create a Match object from downloaded match data.
+
+    :param content: the raw JSON data, or a file object to read it from
+    :param id: the match ID, stored as match_id if given
+    :param decode: whether or not to decode every player's events right away
+    (see Player.stats)
+    :returns: the Match object
+    """
+    if hasattr(content, 'read'):
+        data = json.load(content)
+    else:
+        data = json.loads(content)
+
+    match = tagpro_eu.match.Match(data)
+    if id is not None:
+        match.match_id = str(id)
+
+    if decode:
+        for player in match.players:
+            player.stats
+
+    return match
+
+
+def resolve_match_url(url=None, id=None, raw_url=None):
+    """
+    Determine the match ID and raw data URL to download a match from, in the
+    way described in download_match.
+
+    :param id: a match ID
+    :param url: a tagpro.eu match URL
+    :param raw_url: a direct link to raw data
+    :returns: a tuple of the match ID (None if unknown) and the raw data URL
+    :raises ValueError: when no valid id, url or raw_url was given
     """
     if id is None and url is not None:
         id = match_url_to_id(url)
@@ -49,8 +237,251 @@ def download_match(url=None, id=None, raw_url=None):
     if raw_url is None:
         raise ValueError("No valid match ID or URL was given")
 
-    r = requests.get(raw_url)
-    return tagpro_eu.match.Match(r.json())
+    return id, raw_url
+
+
+def create_session(max_connections=10, retries=3, backoff_factor=0.5):
+    """
+    Create a requests.Session with a connection pool of the given size, that
+    retries failed requests with exponential backoff.
+
+    :param max_connections: the number of connections to keep per host
+    :param retries: the maximum number of retries per request
+    :param backoff_factor: the backoff factor in seconds; retry n waits
+    backoff_factor * 2 ** (n - 1) seconds
+    :returns: the session
+    """
+    retry = Retry(total=retries, backoff_factor=backoff_factor,
+                  status_forcelist=(429, 500, 502, 503, 504))
+    adapter = HTTPAdapter(pool_connections=max_connections,
+                          pool_maxsize=max_connections,
+                          max_retries=retry)
+
+    session = requests.Session()
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+class RateLimiter:
+    """
+    Thread-safe limiter that spaces out calls to at most a given number per
+    second.
+    """
+    def __init__(self, rate):
+        """
+        :param rate: the maximum number of calls per second, or None for no
+        limit
+        """
+        self.interval = 1 / rate if rate else 0
+        self.next = 0
+        self.lock = threading.Lock()
+
+    def wait(self):
+        """
+        Block until the next call is allowed.
+        """
+        if not self.interval:
+            return
+
+        with self.lock:
+            now = time.monotonic()
+            start = max(now, self.next)
+            self.next = start + self.interval
+
+        if start > now:
+            time.sleep(start - now)
+
+
+def download_matches(urls, max_workers=8, rate=None, session=None,
+                     timeout=DEFAULT_TIMEOUT, retries=3, backoff_factor=0.5,
+                     cache=None):
+    """
+    Download multiple matches concurrently, and yield them as Match objects
+    in the order in which they complete. Every element of urls is handled
+    like the url parameter of download_match, so it can be a match ID, a
+    tagpro.eu match URL or a raw data URL.
+
+    Connections are reused through a pooled requests.Session, and failed
+    requests are retried with exponential backoff. Use rate to avoid putting
+    too much load on tagpro.eu.
+
+    :param urls: iterable of match IDs or URLs
+    :param max_workers: the maximum number of concurrent downloads
+    :param rate: the maximum number of requests to start per second (omit
+    for no limit)
+    :param session: the requests.Session to use (omit to create one using
+    create_session)
+    :param timeout: the timeout per request in seconds
+    :param retries: the maximum number of retries per request, when no
+    session is given
+    :param backoff_factor: the backoff factor for retries, when no session is
+    given
+    :param cache: the MatchCache to use (omit to always download)
+    :returns: the downloaded matches
+    :raises ValueError: when an invalid URL was given
+    :raises requests.RequestException: when a download failed
+    """
+    own_session = session is None
+    if own_session:
+        session = create_session(max_workers, retries, backoff_factor)
+
+    limiter = RateLimiter(rate)
+
+    def download(url):
+        id, raw_url = resolve_match_url(url)
+        return _download_match(id, raw_url, session, timeout, cache, limiter)
+
+    urls = iter(urls)
+    pending = set()
+
+    try:
+        with concurrent.futures.ThreadPoolExecutor(max_workers) as executor:
+            try:
+                while True:
+                    # Don't queue more than necessary, so urls can be lazy
+                    for url in urls:
+                        pending.add(executor.submit(download, url))
+                        if len(pending) >= 2 * max_workers:
+                            break
+
+                    if not pending:
+                        break
+
+                    done, pending = concurrent.futures.wait(
+                        pending,
+                        return_when=concurrent.futures.FIRST_COMPLETED)
+
+                    for future in done:
+                        yield future.result()
+            finally:
+                for future in pending:
+                    future.cancel()
+    finally:
+        if own_session:
+            session.close()
+
+
+def _require_aiohttp():
+    if aiohttp is None:
+        raise ImportError('The async API requires aiohttp, which can be '
+                          'installed using: pip install tagpro-eu[async]')
+
+
+def create_client_session(limit_per_host=4, timeout=DEFAULT_TIMEOUT):
+    """
+    Create an aiohttp.ClientSession for use with fetch_match and
+    fetch_matches, that makes at most limit_per_host concurrent requests to
+    the same host.
+
+    This function requires aiohttp, and has to be called from a coroutine.
+
+    :param limit_per_host: the maximum number of connections per host
+    :param timeout: the total timeout per request in seconds
+    :returns: the session
+    """
+    _require_aiohttp()
+    return aiohttp.ClientSession(
+        connector=aiohttp.TCPConnector(limit_per_host=limit_per_host),
+        timeout=aiohttp.ClientTimeout(total=timeout))
+
+
+async def fetch_match(url=None, id=None, raw_url=None, session=None,
+                      executor=None, decode=True):
+    """
+    Asynchronous counterpart of download_match. The match data is downloaded
+    without blocking the event loop, and the Match object is built in an
+    executor, so parsing a large match doesn't stall the loop either.
+
+    This function requires aiohttp.
+
+    :param id: a match ID
+    :param url: a tagpro.eu match URL
+    :param raw_url: a direct link to raw data
+    :param session: the aiohttp.ClientSession to use (omit to create one
+    using create_client_session)
+    :param executor: the concurrent.futures.Executor to parse the match in
+    (omit to use the loop's default executor)
+    :param decode: whether or not to also decode every player's events in
+    the executor (the default). With decode=False, they are decoded when
+    first used, on the thread that uses them, which blocks the event loop
+    when that is a coroutine.
+    :returns: the corresponding Match object
+    :raises ValueError: when no valid id, url or raw_url was given
+    :raises aiohttp.ClientError: when the download failed
+    """
+    _require_aiohttp()
+    id, raw_url = resolve_match_url(url, id, raw_url)
+
+    if session is None:
+        async with create_client_session() as session:
+            return await fetch_match(raw_url=raw_url, id=id, session=session,
+                                     executor=executor, decode=decode)
+
+    async with session.get(raw_url) as r:
+        r.raise_for_status()
+        content = await r.read()
+
+    loop = asyncio.get_event_loop()
+    return await loop.run_in_executor(executor, parse_match, content, id,
+                                      decode)
+
+
+async def fetch_matches(urls, limit_per_host=4, session=None, executor=None,
+                        decode=True):
+    """
+    Asynchronous counterpart of download_matches. Fetch multiple matches
+    concurrently, and yield them in the order in which they complete:
+
+        async for match in fetch_matches(ids):
+            ...
+
+    This function requires aiohttp.
+
+    :param urls: iterable of match IDs or URLs
+    :param limit_per_host: the maximum number of concurrent requests per
+    host, when no session is given
+    :param session: the aiohttp.ClientSession to use (omit to create one
+    using create_client_session)
+    :param executor: the concurrent.futures.Executor to parse matches in
+    (omit to use the loop's default executor)
+    :param decode: whether or not to also decode every player's events in
+    the executor (the default), see fetch_match
+    :returns: the fetched matches
+    :raises ValueError: when an invalid URL was given
+    :raises aiohttp.ClientError: when a download failed
+    """
+    _require_aiohttp()
+
+    own_session = session is None
+    if own_session:
+        session = create_client_session(limit_per_host)
+
+    urls = iter(urls)
+    pending = set()
+
+    try:
+        while True:
+            # Only start a limited number of tasks, so urls can be lazy
+            for url in urls:
+                pending.add(asyncio.ensure_future(fetch_match(
+                    url, session=session, executor=executor, decode=decode)))
+                if len(pending) >= 2 * limit_per_host:
+                    break
+
+            if not pending:
+                break
+
+            done, pending = await asyncio.wait(
+                pending, return_when=asyncio.FIRST_COMPLETED)
+
+            for task in done:
+                yield task.result()
+    finally:
+        for task in pending:
+            task.cancel()
+        if own_session:
+            await session.close()
 
 
 match_url_regex =\
@@ -1 +1,2 @@
-from . import test_blob, test_core, test_util
+from . import test_blob, test_bulk, test_core, test_map, test_match, \
+    test_player, test_sketch, test_util, test_web
@@ -0,0 +1,250 @@
+from tagpro_eu import Blob, Flag, Powerup, Team
+import base64
+
+
+class BlobWriter:
+    """
+    Counterpart of Blob, used to build blobs for test data.
+    """
+    def __init__(self):
+        self.bits = []
+
+    def write_bool(self, value):
+        self.bits.append(1 if value else 0)
+
+    def write_fixed(self, bits, value):
+        for i in reversed(range(bits)):
+            self.write_bool(value >> i & 1)
+
+    def write_tally(self, value):
+        for _ in range(value):
+            self.write_bool(1)
+        self.write_bool(0)
+
+    def write_footer(self, value):
+        free = 8 - (len(self.bits) + 2 & 7) & 7
+        minimum = 0
+
+        for k in range(4):
+            size = k * 8 + free
+            if value < minimum + (1 << size):
+                self.write_fixed(2, k)
+                self.write_fixed(size, value - minimum)
+                return
+            minimum += 1 << size
+
+        raise ValueError('Footer value too large')
+
+    def to_bytes(self):
+        bits = self.bits + [0] * (-len(self.bits) % 8)
+        return bytes(int(''.join(map(str, bits[i:i + 8])), 2)
+                     for i in range(0, len(bits), 8))
+
+    def to_blob(self):
+        return Blob(self.to_bytes())
+
+    def to_b64(self):
+        return base64.b64encode(self.to_bytes()).decode('ascii')
+
+
+def tile_codes():
+    """
+    Return a dict mapping Tile values to the 6-bit codes used in map blobs.
+    """
+    from tagpro_eu.map import decode_tile
+    codes = {}
+    for code in range(64):
+        try:
+            codes.setdefault(decode_tile(code), code)
+        except ValueError:
+            pass
+    return codes
+
+
+def encode_tiles(rows):
+    """
+    Encode a 2D list of Tile values as a base64 map blob.
+    """
+    codes = tile_codes()
+    flat = [t for row in rows for t in row]
+
+    w = BlobWriter()
+    i = 0
+    while i < len(flat):
+        j = i
+        while j < len(flat) and flat[j] == flat[i]:
+            j += 1
+        w.write_fixed(6, codes[flat[i]])
+        w.write_footer(j - i - 1)
+        i = j
+
+    return w.to_b64()
+
+
+def map_data(rows, name='Test'):
+    """
+    Return the JSON data for a map with the given tiles.
+    """
+    return {
+        'name': name,
+        'author': 'Tester',
+        'type': 'ctf',
+        'marsballs': 0,
+        'width': len(rows[0]),
+        'tiles': encode_tiles(rows),
+    }
+
+
+class EventWriter:
+    """
+    Encode a player's events blob. Every call to record writes the events of
+    one frame, and keeps track of the player's state like Player.parse_events.
+    """
+    def __init__(self, team=Team.none):
+        self.writer = BlobWriter()
+        self.team = team
+        self.flag = Flag.none
+        self.powers = Powerup.none
+        self.time = 0
+
+    def record(self, time, team=None, drop_pop=False, returns=0, tags=0,
+               grab=False, grab_flag=Flag.opponent, captures=0, keep=False,
+               powerups=Powerup.none, powerdowns=Powerup.none, duplicates=0,
+               prevent=False, button=False, block=False):
+        w = self.writer
+        new_team = self.team if team is None else team
+
+        if new_team == self.team:
+            w.write_bool(0)
+        else:
+            w.write_bool(1)
+            if self.team == Team.none:
+                w.write_bool(new_team == Team.blue)
+            else:
+                w.write_bool(new_team == Team.none)
+
+        w.write_bool(drop_pop)
+        w.write_tally(returns)
+        w.write_tally(tags)
+        grab = grab and not self.flag
+        if not self.flag:
+            w.write_bool(grab)
+        w.write_tally(captures)
+
+        if not drop_pop and new_team and \
+                (new_team == self.team or not self.team):
+            if captures and (self.flag or grab):
+                w.write_bool(keep)
+            else:
+                keep = True
+        else:
+            keep = False
+
+        if grab and keep:
+            w.write_fixed(2, grab_flag - 1)
+
+        remaining = bin(powerups).count('1') + duplicates
+        w.write_tally(remaining)
+        for p in Powerup.enumerate():
+            if self.powers & p:
+                w.write_bool(powerdowns & p)
+            elif remaining:
+                w.write_bool(powerups & p)
+                if powerups & p:
+                    remaining -= 1
+
+        w.write_bool(prevent)
+        w.write_bool(button)
+        w.write_bool(block)
+
+        w.write_footer(time - self.time - 1)
+        self.time = time
+
+        if not self.team and new_team:
+            self.team = new_team
+        if grab:
+            self.flag = grab_flag if keep else Flag.temp
+        if captures and not keep and self.flag:
+            self.flag = Flag.none
+        self.powers = (self.powers & ~powerdowns) | powerups
+        if drop_pop:
+            self.flag = Flag.none
+        if new_team != self.team:
+            if not new_team:
+                self.powers = Powerup.none
+            self.flag = Flag.none
+            self.team = new_team
+
+        return self
+
+    def to_b64(self):
+        return self.writer.to_b64()
+
+
+def splat_blob(coords, width, height):
+    """
+    Encode the splats blob of a team, given a list of (x, y) pixel positions.
+    """
+    from tagpro_eu.match import splat_bits
+    x = splat_bits(width)
+    y = splat_bits(height)
+
+    w = BlobWriter()
+    for i, (sx, sy) in enumerate(coords):
+        if i % 2:
+            w.write_tally(0)
+        w.write_tally(1)
+        w.write_fixed(x[0], sx + x[1])
+        w.write_fixed(y[0], sy + y[1])
+
+    return w.to_b64()
+
+
+def player_data(name, team, events, **kwargs):
+    """
+    Return the JSON data for a player with the given EventWriter.
+    """
+    data = {
+        'auth': False,
+        'name': name,
+        'flair': 0,
+        'degree': 0,
+        'score': 0,
+        'points': 0,
+        'team': int(team),
+        'events': events.to_b64(),
+    }
+    data.update(kwargs)
+    return data
+
+
+def match_data(players, map_rows, splats=((), ()), duration=3600,
+               team_names=('Red', 'Blue'), scores=(0, 0), **kwargs):
+    """
+    Return the JSON data for a match.
+    """
+    m = map_data(map_rows)
+    height = len(map_rows)
+
+    data = {
+        'server': 'tagpro-test.koalabeast.com',
+        'port': 8000,
+        'official': True,
+        'group': '',
+        'date': 1500000000,
+        'timeLimit': 12,
+        'duration': duration,
+        'finished': True,
+        'map': m,
+        'players': players,
+        'teams': [
+            {
+                'name': team_names[i],
+                'score': scores[i],
+                'splats': splat_blob(splats[i], m['width'], height),
+            }
+            for i in range(2)
+        ],
+    }
+    data.update(kwargs)
+    return data
@@ -0,0 +1,589 @@
+from tagpro_eu import BloomFilter, Dataset, FormTracker, Leaderboard, \
+    Player, PlayerIndex, PlayerStats, Powerup, SeriesIndex, StatsStore, \
+    StatsTable, Time, bulk, halves_switched, util
+from .blobwriter import map_data
+from .test_match import MAP_ROWS, sample_data
+import bz2
+import concurrent.futures
+import gzip
+import io
+import json
+import lzma
+import os
+import tempfile
+from unittest import mock
+import unittest
+
+
+def bulk_match(n, map_id=1, players=(), date=None):
+    return {
+        'server': 'tagpro-test.koalabeast.com',
+        'port': n,
+        'date': 1500000000 + n * 1000 if date is None else date,
+        'mapId': map_id,
+        'players': [{'name': name, 'team': 1} for name in players],
+        'teams': [{'name': 'Red'}, {'name': 'Blue'}],
+    }
+
+
+def bulk_sample(n):
+    data = sample_data()
+    del data['map']
+    data['mapId'] = 1
+    data['date'] += n
+    return data
+
+
+class BulkTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def write(self, name, data, opener=open):
+        path = os.path.join(self.tmp.name, name)
+        with opener(path, 'wt', encoding='utf-8') as f:
+            json.dump(data, f)
+        return path
+
+    def write_matches(self, name, ids, opener=open):
+        return self.write(name, {str(i): bulk_match(i) for i in ids}, opener)
+
+
+class TestLoad(BulkTestCase):
+    def test_file_object(self):
+        f = io.StringIO(json.dumps({'3': bulk_match(3)}))
+        matches = list(bulk.load_matches(f))
+        self.assertEqual([m.match_id for m in matches], ['3'])
+        self.assertEqual(matches[0].map_id, 1)
+
+    def test_compressed(self):
+        self.write_matches('a.json', [1, 2])
+        self.write_matches('b.json.gz', [3], gzip.open)
+        self.write_matches('c.json.bz2', [4], bz2.open)
+        self.write_matches('d.json.xz', [5], lzma.open)
+
+        ids = [m.match_id for m in bulk.load_matches(self.tmp.name)]
+        self.assertEqual(ids, ['1', '2', '3', '4', '5'])
+
+    def test_glob(self):
+        self.write_matches('matches-1.json.gz', [1], gzip.open)
+        self.write_matches('matches-2.json.gz', [2], gzip.open)
+        self.write_matches('other.json', [3])
+
+        pattern = os.path.join(self.tmp.name, 'matches-*.json.gz')
+        ids = [m.match_id for m in bulk.load_matches(pattern)]
+        self.assertEqual(ids, ['1', '2'])
+
+    def test_dedup(self):
+        a = self.write_matches('a.json', [1, 2])
+        b = self.write_matches('b.json', [2, 3])
+
+        ids = [m.match_id for m in bulk.load_matches([a, b])]
+        self.assertEqual(ids, ['1', '2', '3'])
+
+    def test_maps(self):
+        a = self.write('maps-a.json.gz', {'1': map_data(MAP_ROWS, 'A')},
+                       gzip.open)
+        b = self.write('maps-b.json', {'2': map_data(MAP_ROWS, 'B')})
+        m = self.write_matches('matches.json', [1])
+
+        maps = bulk.load_maps([a, b])
+        self.assertEqual(sorted(maps), [1, 2])
+
+        match, = bulk.load_matches(m, maps)
+        self.assertEqual(match.map.name, 'A')
+
+
+class TestByDate(BulkTestCase):
+    def test_merge(self):
+        a = self.write_matches('a.json.gz', [5, 1, 3], gzip.open)
+        b = self.write_matches('b.json', [4, 2, 3, 7])
+        c = self.write_matches('c.json', [6])
+
+        matches = list(bulk.iter_matches_by_date([a, b, c]))
+        self.assertEqual([m.match_id for m in matches],
+                         ['1', '2', '3', '4', '5', '6', '7'])
+        self.assertEqual(matches, sorted(matches, key=lambda m: m.date))
+
+    def test_numeric_ids(self):
+        date = 1500000000
+        a = self.write('a.json', {k: bulk_match(1, date=date)
+                                  for k in ['10', '9', 'x']})
+        b = self.write('b.json', {k: bulk_match(1, date=date)
+                                  for k in ['100', '11', '9']})
+
+        matches = list(bulk.iter_matches_by_date([a, b]))
+        self.assertEqual([m.match_id for m in matches],
+                         ['9', '10', '11', '100', 'x'])
+
+
+def count_matches(matches):
+    return sorted(m.match_id for m in matches)
+
+
+class TestDataset(BulkTestCase):
+    JAN = 1514764800  # 2018-01-01 00:00 UTC
+    FEB = 1517443200  # 2018-02-01 00:00 UTC
+
+    def setUp(self):
+        super().setUp()
+        path = self.write('matches.json', {
+            '1': bulk_match(1, 1, ['foo', 'bar'], self.JAN),
+            '2': bulk_match(2, 1, ['foo'], self.JAN + 100),
+            '3': bulk_match(3, 2, ['baz'], self.JAN + 200),
+            '4': bulk_match(4, 1, ['bar'], self.FEB),
+        })
+        maps = self.write('maps.json', {
+            '1': map_data(MAP_ROWS, 'One'),
+            '2': map_data(MAP_ROWS, 'Two'),
+        })
+
+        self.dataset = Dataset(os.path.join(self.tmp.name, 'dataset'))
+        self.dataset.add_maps(maps)
+        self.assertEqual(self.dataset.add_matches(path), 4)
+
+    def test_shards(self):
+        self.assertEqual(self.dataset.select(),
+                         ['2018-01/1', '2018-01/2', '2018-02/1'])
+        self.assertEqual(len(self.dataset), 4)
+
+    def test_reopen(self):
+        dataset = Dataset(self.dataset.directory)
+        self.assertEqual(len(dataset), 4)
+        self.assertEqual(dataset.select(map_ids=[2]), ['2018-01/2'])
+
+    def test_prune(self):
+        self.assertEqual(self.dataset.select(date_from=self.FEB),
+                         ['2018-02/1'])
+        self.assertEqual(self.dataset.select(date_to=self.JAN + 50),
+                         ['2018-01/1'])
+        self.assertEqual(self.dataset.select(players=['baz']),
+                         ['2018-01/2'])
+        self.assertEqual(self.dataset.select(players=['nobody']), [])
+
+    def test_player_filter(self):
+        players = self.dataset.shards['2018-01/1'].players
+        self.assertEqual(players.bits, BloomFilter.for_capacity(4).bits)
+
+        names = [f'p{i}' for i in range(2000)]
+        path = self.write('more.json', {
+            str(i + 5): bulk_match(i + 5, 1, names[i::100], self.JAN + i)
+            for i in range(100)
+        })
+        self.dataset.add_matches(path)
+
+        dataset = Dataset(self.dataset.directory)
+        players = dataset.shards['2018-01/1'].players
+        self.assertGreaterEqual(players.capacity(), 2000)
+        for name in names + ['foo', 'bar']:
+            self.assertIn(name, players)
+        false_positives = sum(f'q{i}' in players for i in range(1000))
+        self.assertLess(false_positives, 20)
+
+    def test_matches(self):
+        matches = list(self.dataset.matches(players=['foo']))
+        self.assertEqual(count_matches(matches), ['1', '2'])
+        self.assertEqual(matches[0].map.name, 'One')
+
+    def test_scan(self):
+        with concurrent.futures.ThreadPoolExecutor(2) as executor:
+            results = self.dataset.scan(count_matches, map_ids=[1],
+                                        executor=executor)
+            self.assertEqual(sorted(results), [['1', '2'], ['4']])
+
+
+class TestPlayerIndex(BulkTestCase):
+    def setUp(self):
+        super().setUp()
+        self.path = self.write('matches.json', {
+            '1': bulk_match(1, players=['foo', 'bar']),
+            '2': bulk_match(2, players=['foo']),
+            '3': bulk_match(3, players=['bar', 'baz', 'foo']),
+        })
+        self.index = PlayerIndex()
+        self.assertEqual(self.index.update(bulk.load_matches(self.path)), 3)
+
+    def test_games(self):
+        games = self.index.games('foo')
+        self.assertEqual([(a.match_id, a.index) for a in games],
+                         [('1', 0), ('2', 0), ('3', 2)])
+        self.assertEqual(self.index.games('foo', auth=True), [])
+        self.assertEqual(self.index.games('nobody'), [])
+
+    def test_sorted(self):
+        games = self.index.games('foo', auth=False)
+        self.assertIs(self.index.games('foo', auth=False), games)
+
+        # Added out of order
+        path = self.write('older.json', {
+            '0': bulk_match(0, players=['foo'], date=1),
+        })
+        self.index.update(bulk.load_matches(path))
+        self.assertEqual([a.match_id for a in self.index.games('foo')],
+                         ['0', '1', '2', '3'])
+
+    def test_no_match_id(self):
+        match = bulk.create_match('5', bulk_match(5, players=['foo']))
+        del match.match_id
+        with self.assertRaises(ValueError):
+            self.index.add(match)
+        self.assertEqual(len(self.index), 3)
+
+    def test_together(self):
+        self.assertEqual(self.index.games_together('foo', 'bar'), ['1', '3'])
+        self.assertEqual(self.index.games_together('baz', 'foo'), ['3'])
+
+    def test_incremental(self):
+        path = self.write('more.json', {
+            '3': bulk_match(3, players=['bar', 'baz', 'foo']),
+            '4': bulk_match(4, players=['baz']),
+        })
+        self.assertEqual(self.index.update(bulk.load_matches(path)), 1)
+        self.assertEqual(len(self.index.games('baz')), 2)
+
+    def test_save(self):
+        path = os.path.join(self.tmp.name, 'index.json.gz')
+        self.index.save(path)
+        index = PlayerIndex.load(path)
+        self.assertEqual(index.games('foo'), self.index.games('foo'))
+        self.assertIn('2', index)
+
+
+class TestStatsStore(BulkTestCase):
+    def setUp(self):
+        super().setUp()
+        self.path = self.write('matches.json',
+                               {str(i): bulk_sample(i) for i in range(3)})
+        self.store = StatsStore(':memory:')
+
+    def tearDown(self):
+        self.store.close()
+        super().tearDown()
+
+    def test_ingest(self):
+        self.assertEqual(self.store.ingest(self.path), 3)
+        self.assertEqual(len(self.store), 3)
+        self.assertIn('1', self.store)
+
+        # Unchanged files are skipped, and so are known matches
+        self.assertEqual(self.store.ingest(self.path), 0)
+        path = self.write('more.json',
+                          {str(i): bulk_sample(i) for i in range(2, 5)})
+        self.assertEqual(self.store.ingest([self.path, path]), 2)
+        self.assertEqual(len(self.store), 5)
+
+    def test_player_stats(self):
+        self.store.ingest(self.path, batch_size=2)
+
+        expected = sum((m.players[1].stats
+                        for m in bulk.load_matches(self.path)),
+                       PlayerStats())
+        stats = self.store.player_stats('bar')
+
+        for f in expected.stat_fields:
+            self.assertEqual(getattr(stats, f), getattr(expected, f))
+        self.assertEqual(stats.pups[Powerup.tagpro], 3)
+        self.assertEqual(stats.pup_time[Powerup.tagpro],
+                         expected.pup_time[Powerup.tagpro])
+        self.assertEqual(stats.prevent, expected.prevent)
+
+        self.assertEqual(stats.captures, 0)
+        self.assertEqual(self.store.player_stats('foo').captures, 3)
+        self.assertEqual(self.store.player_stats('foo', map_id=2).captures,
+                         0)
+
+    def test_all_player_stats(self):
+        matches = list(bulk.load_matches(self.path))
+        self.store.add_matches(matches)
+        self.assertEqual(self.store.add_matches(matches), 0)
+
+        stats = self.store.all_player_stats(date_to=matches[1].date)
+        self.assertEqual(sorted(stats), ['bar', 'baz', 'foo'])
+        self.assertEqual(stats['foo'].tags, 4)
+        self.assertEqual(stats['foo'].caps_for, 2)
+
+
+@unittest.skipIf(util.numpy is None, 'numpy is not installed')
+class TestStatsTable(BulkTestCase):
+    def setUp(self):
+        super().setUp()
+        self.matches = [bulk.create_match(str(i), bulk_sample(i * 86400))
+                        for i in range(3)]
+        self.matches[2].map_id = 2
+        self.table = StatsTable.from_matches(self.matches)
+
+    def test_columns(self):
+        self.assertEqual(len(self.table), 9)
+        self.assertEqual(list(self.table['name'][:3]), ['foo', 'bar', 'baz'])
+        self.assertEqual(list(self.table['map_id']), [1] * 6 + [2] * 3)
+        self.assertEqual(self.table['tags'][0],
+                         self.matches[0].players[0].stats.tags)
+
+    def test_encoding(self):
+        self.assertEqual(self.table.data['name'].dtype, util.numpy.int32)
+        self.assertEqual(list(self.table.lookup['name']),
+                         ['bar', 'baz', 'foo'])
+        self.assertEqual(list(self.table.data['name'][:3]), [2, 0, 1])
+        self.assertEqual(self.table.code('name', 'baz'), 1)
+        self.assertEqual(self.table.code('name', 'qux'), -1)
+
+    def test_player_stats(self):
+        stats = self.table.player_stats()
+        self.assertEqual(sorted(stats), ['bar', 'baz', 'foo'])
+
+        for i, name in enumerate(['foo', 'bar', 'baz']):
+            expected = PlayerStats.sum(m.players[i].stats
+                                       for m in self.matches)
+            for f in expected.stat_fields:
+                self.assertEqual(getattr(stats[name], f),
+                                 getattr(expected, f))
+            for p in Powerup:
+                self.assertEqual(stats[name].pups[p], expected.pups[p])
+                self.assertEqual(stats[name].pup_time[p],
+                                 expected.pup_time[p])
+
+    def test_aggregate(self):
+        keys, sums = self.table.aggregate(('map_id', 'name'), ['tags'])
+        self.assertEqual(list(zip(*keys)),
+                         [(1, 'bar'), (1, 'baz'), (1, 'foo'),
+                          (2, 'bar'), (2, 'baz'), (2, 'foo')])
+        self.assertEqual(list(sums['games']), [2, 2, 2, 1, 1, 1])
+        self.assertEqual(sums['tags'][2], 2 * sums['tags'][5])
+
+        # Combining the keys would overflow int64
+        np = util.numpy
+        by = tuple(np.arange(9) * (i + 1) for i in range(20))
+        keys, sums = self.table.aggregate(by, ['tags'])
+        self.assertEqual(list(keys[0]), list(range(9)))
+        self.assertEqual(list(keys[19]), list(range(0, 180, 20)))
+        self.assertEqual(list(sums['games']), [1] * 9)
+        self.assertEqual(list(sums['tags']), list(self.table['tags']))
+
+        buckets = self.table.date_bucket(2 * 86400,
+                                         origin=self.table['date'][0])
+        keys, sums = self.table.aggregate(buckets, ['captures'])
+        self.assertEqual(list(sums['games']), [6, 3])
+        self.assertEqual(list(sums['captures']), [2, 1])
+
+    def test_filter_save(self):
+        table = self.table.filter(self.table['name'] == 'foo')
+        self.assertEqual(len(table), 3)
+
+        path = os.path.join(self.tmp.name, 'table.npz')
+        table.save(path)
+        loaded = StatsTable.load(path)
+        self.assertEqual(list(loaded['name']), ['foo'] * 3)
+        self.assertEqual(list(loaded['hold']), list(table['hold']))
+
+        combined = StatsTable.concatenate([table, loaded])
+        self.assertEqual(len(combined), 6)
+
+        other = self.table.filter(self.table['name'] != 'foo')
+        combined = StatsTable.concatenate([table, other])
+        self.assertEqual(list(combined.lookup['name']),
+                         ['bar', 'baz', 'foo'])
+        self.assertEqual(list(combined['name']),
+                         ['foo'] * 3 + ['bar', 'baz'] * 3)
+        self.assertEqual(list(combined['match_id']),
+                         ['0', '1', '2'] + ['0', '0', '1', '1', '2', '2'])
+
+
+class TestLeaderboard(unittest.TestCase):
+    def setUp(self):
+        self.matches = [bulk.create_match(str(i), bulk_sample(i * 86400))
+                        for i in range(4)]
+
+    def test_totals(self):
+        lb = Leaderboard(('tags', 'pops'), k=2)
+        for m in self.matches:
+            lb.add(m)
+
+        (key, result), = lb.results().items()
+        self.assertEqual(key, (None, None))
+        self.assertEqual([(e.value, e.name, e.games)
+                          for e in result['totals']['tags']],
+                         [(8, 'foo', 4), (0, 'baz', 4)])
+        self.assertEqual([(e.value, e.name)
+                          for e in result['totals']['pops']],
+                         [(8, 'bar'), (4, 'foo')])
+        self.assertEqual([(e.value, e.name, e.match_id)
+                          for e in result['games']['tags']],
+                         [(2, 'foo', '3'), (2, 'foo', '2')])
+
+    def test_compact_rows(self):
+        lb = Leaderboard(('tags', 'pops'), min_games=3)
+        for m in self.matches[:2]:
+            lb.add(m)
+
+        # Players below min_games are kept apart from the candidates
+        stats = self.matches[0].players[0].stats
+        self.assertEqual(lb.tail[None, None]['foo'],
+                         [2, 2 * stats.time, 2 * stats.tags, 2 * stats.pops])
+        self.assertEqual(lb.players[None, None], {})
+
+        lb.add(self.matches[2])
+        self.assertEqual(sorted(lb.players[None, None]), ['bar', 'baz', 'foo'])
+        self.assertEqual(lb.tail[None, None], {})
+
+    def test_merge_tail(self):
+        a = Leaderboard(('tags',), min_games=2)
+        b = Leaderboard(('tags',), min_games=2)
+        a.add(self.matches[0])
+        b.add(self.matches[1])
+        self.assertEqual(a.players[None, None], {})
+
+        a.merge(b)
+        self.assertEqual(sorted(a.players[None, None]), ['bar', 'baz', 'foo'])
+        self.assertEqual(a.results()[None, None]['totals']['tags'][0][:3],
+                         (4, 'foo', 2))
+
+    def test_equal_entries(self):
+        stats = self.matches[0].players[0].stats
+        lb = Leaderboard(('tags',), k=1)
+        lb.add_stats('foo', stats, 0)
+        lb.add_stats('foo', stats, 0, match_id='1')
+        lb.add_stats('foo', stats, 0)
+
+        entries = lb.results()[None, None]['games']['tags']
+        self.assertEqual([e.match_id for e in entries], ['1'])
+
+    def test_filters(self):
+        lb = Leaderboard(('tags',), min_time=Time.from_seconds(100),
+                         per_minute=True)
+        for m in self.matches:
+            lb.add(m)
+
+        entries = lb.results()[None, None]['totals']['tags']
+        self.assertEqual([e.name for e in entries], ['foo', 'bar'])
+        self.assertEqual(entries[0].value, 4.0)
+
+        lb = Leaderboard(('tags',), min_games=5)
+        lb.add(self.matches[0])
+        self.assertEqual(lb.results()[None, None]['totals']['tags'], [])
+
+    def test_windows(self):
+        lb = Leaderboard(('tags',), window=86400, by_map=True, ordered=True)
+        for m in self.matches:
+            lb.add(m)
+            # Only the current window is kept in memory
+            self.assertEqual(len(lb.players), 1)
+
+        results = lb.results()
+        self.assertEqual(len(results), 4)
+        self.assertEqual({k[1] for k in results}, {1})
+
+        with self.assertRaises(ValueError):
+            lb.add(self.matches[0])
+
+    def test_merge(self):
+        a = Leaderboard(('tags', 'pops'), k=2)
+        b = Leaderboard(('tags', 'pops'), k=2)
+        c = Leaderboard(('tags', 'pops'), k=2)
+        for i, m in enumerate(self.matches):
+            (a if i % 2 else b).add(m)
+            c.add(m)
+
+        self.assertEqual(a.merge(b).results(), c.results())
+
+
+class TestFormTracker(unittest.TestCase):
+    def setUp(self):
+        self.matches = [bulk.create_match(str(i), bulk_sample(i * 86400))
+                        for i in range(4)]
+
+    def test_games(self):
+        tracker = FormTracker(games=2)
+        tracker.update(self.matches)
+
+        form = tracker.form('foo')
+        self.assertEqual(form.games, 2)
+        self.assertEqual(form.cap_diff, 2)
+        self.assertEqual(form.tags, 4)
+        self.assertEqual(form.tags_per_minute, 4.0)
+        self.assertEqual(form.hold_per_minute, 400.0)
+        self.assertIsNone(tracker.form('qux'))
+
+        with self.assertRaises(ValueError):
+            tracker.add(self.matches[0])
+
+    def test_days(self):
+        tracker = FormTracker(days=1.5)
+        tracker.update(self.matches[:3])
+        self.assertEqual(tracker.form('bar').games, 2)
+        self.assertEqual(tracker.form('bar').pops, 4)
+
+        # A match with only foo makes the others' games age
+        data = bulk_sample(10 * 86400)
+        data['players'] = data['players'][:1]
+        tracker.add(bulk.create_match('10', data))
+
+        self.assertEqual(tracker.form('foo').games, 1)
+        self.assertNotIn('bar', tracker)
+        self.assertEqual(list(tracker.players()), ['foo'])
+
+
+class TestSeriesIndex(unittest.TestCase):
+    def half(self, match_id, date, names=('Red', 'Blue'), **kwargs):
+        data = bulk_sample(date)
+        data.update(kwargs)
+        for team, name in zip(data['teams'], names):
+            team['name'] = name
+        return bulk.create_match(match_id, data)
+
+    def test_switched(self):
+        h1 = self.half('1', 0, ('Alpha', 'Beta'))
+        self.assertTrue(halves_switched(h1, self.half('2', 60,
+                                                      ('Beta', 'Alpha'))))
+        self.assertFalse(halves_switched(h1, self.half('2', 60)))
+
+    def test_switched_without_decoding(self):
+        h1, h2 = self.half('1', 0), self.half('2', 60)
+        with mock.patch.object(Player, 'parse_events') as parse:
+            self.assertFalse(halves_switched(h1, h2))
+        parse.assert_not_called()
+
+        # Without common players, the roster is used to break the tie
+        other = bulk_sample(60)
+        for p in other['players']:
+            p['name'] += '2'
+        h2 = bulk.create_match('2', other)
+
+        with mock.patch.object(Player, 'parse_events') as parse:
+            self.assertIsNone(halves_switched(h1, h2, roster=False))
+        parse.assert_not_called()
+        self.assertIsNone(halves_switched(h1, h2))
+        self.assertIsNotNone(h1.team_red.__roster__)
+
+    def test_series(self):
+        index = SeriesIndex(max_gap=600)
+        index.update([
+            self.half('2', 100, ('Beta', 'Alpha'), group='abc'),
+            self.half('1', 0, ('Alpha', 'Beta'), group='abc'),
+            # Same server and time, but not in the group
+            self.half('3', 50),
+            # Too long after the previous one
+            self.half('4', 2000),
+        ])
+
+        series = index.series()
+        self.assertEqual([[m.match_id for m in s.matches] for s in series],
+                         [['1', '2'], ['3'], ['4']])
+        self.assertEqual(series[0].team_names, ('Alpha', 'Beta'))
+        self.assertEqual(series[0].scores(), (1, 1))
+        self.assertEqual([(a.match_id, b.match_id) for a, b in index.pairs()],
+                         [('1', '2')])
+
+    def test_players(self):
+        other = bulk_sample(60)
+        for i, p in enumerate(other['players']):
+            p['name'] = f'other{i}'
+
+        index = SeriesIndex()
+        index.update([self.half('1', 0), bulk.create_match('2', other),
+                      self.half('3', 120)])
+
+        self.assertEqual([[m.match_id for m in s.matches]
+                          for s in index.series()],
+                         [['1', '3'], ['2']])
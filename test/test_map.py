@@ -0,0 +1,103 @@
+from tagpro_eu import Blob, Map, Tile
+from .blobwriter import BlobWriter, map_data
+from unittest import mock
+import unittest
+
+
+def raw_map(width, runs, name='Test'):
+    w = BlobWriter()
+    for code, n in runs:
+        w.write_fixed(6, code)
+        w.write_footer(n - 1)
+    return Map({'name': name, 'width': width, 'tiles': w.to_b64()})
+
+
+class TestMapFingerprint(unittest.TestCase):
+    def test_equal_content(self):
+        m1 = raw_map(3, [(1, 3), (6, 3)], name='Foo')
+        m2 = raw_map(3, [(1, 3), (6, 3)], name='Bar')
+        self.assertEqual(m1.fingerprint, m2.fingerprint)
+        self.assertEqual(m1, m2)
+        self.assertEqual(hash(m1), hash(m2))
+
+    def test_different_content(self):
+        m1 = raw_map(3, [(1, 3), (6, 3)])
+        m2 = raw_map(3, [(1, 3), (1, 3)])
+        m3 = raw_map(2, [(1, 3), (6, 3)])
+        self.assertNotEqual(m1, m2)
+        self.assertNotEqual(m1, m3)
+        self.assertNotEqual(m1, None)
+
+    def test_no_tile_parse(self):
+        m = raw_map(3, [(1, 3), (6, 3)])
+        m.fingerprint
+        self.assertIsNone(m.__tilemap__)
+
+    def test_dedup(self):
+        maps = [raw_map(3, [(1, 3), (6, 3)], name=str(i)) for i in range(5)]
+        maps.append(raw_map(3, [(6, 6)]))
+        self.assertEqual(len(set(maps)), 2)
+
+
+class TestMapTiles(unittest.TestCase):
+    rows = [
+        [Tile.wall, Tile.wall, Tile.wall, Tile.wall],
+        [Tile.wall, Tile.flag_red, Tile.floor, Tile.wall],
+        [Tile.wall, Tile.floor, Tile.flag_blue, Tile.wall],
+        [Tile.wall, Tile.wall, Tile.wall, Tile.wall],
+        [Tile.spike, Tile.bomb, Tile.empty, Tile.empty],
+    ]
+
+    def get_map(self):
+        return Map(map_data(self.rows))
+
+    def test_tiles(self):
+        m = self.get_map()
+        self.assertEqual(m.tiles, self.rows)
+
+    def test_height(self):
+        m = self.get_map()
+        self.assertEqual(m.height, 5)
+        self.assertIsNone(m.__tilemap__)
+
+    def test_tile_counts(self):
+        m = self.get_map()
+        self.assertEqual(m.tile_counts[Tile.wall], 12)
+        self.assertEqual(m.tile_counts[Tile.floor], 2)
+        self.assertEqual(m.tile_counts[Tile.empty], 2)
+        self.assertEqual(m.tile_counts[Tile.gate_red], 0)
+        self.assertEqual(sum(m.tile_counts.values()), 20)
+        self.assertIsNone(m.__tilemap__)
+
+    def test_single_decode(self):
+        m = self.get_map()
+        self.assertEqual(m.tiles, self.rows)
+        self.assertEqual(m.__height__, 5)
+        self.assertEqual(m.runs[0], (Tile.wall, 5))
+
+        with mock.patch.object(Blob, 'read_fixed', side_effect=AssertionError):
+            self.assertEqual(m.height, 5)
+            self.assertEqual(m.tile_counts[Tile.wall], 12)
+
+    def test_padding(self):
+        m = raw_map(3, [(1, 4)])
+        self.assertEqual(m.height, 2)
+        self.assertEqual(m.tiles[1], [Tile.wall, Tile.empty, Tile.empty])
+        self.assertEqual(m.tile_counts[Tile.empty], 2)
+
+    def test_positions(self):
+        m = self.get_map()
+        self.assertEqual(m.positions(Tile.flag_red), [(1, 1)])
+        self.assertEqual(m.positions(Tile.flag_red, Tile.flag_blue),
+                         [(1, 1), (2, 2)])
+        self.assertEqual(m.positions(Tile.floor), [(2, 1), (1, 2)])
+        self.assertEqual(m.positions(Tile.gate_red), [])
+
+    def test_nearest(self):
+        m = self.get_map()
+        pos, dist = m.nearest(0, 4, Tile.flag_red, Tile.flag_blue)
+        self.assertEqual(pos, (2, 2))
+        self.assertAlmostEqual(dist, 8 ** .5)
+        self.assertEqual(m.nearest(2.5, 2, Tile.flag_red, Tile.flag_blue),
+                         ((2, 2), .5))
+        self.assertIsNone(m.nearest(0, 0, Tile.gate_red))
@@ -0,0 +1,329 @@
+from tagpro_eu import AmbiguousFrame, CooccurrenceBuilder, Flag, \
+    Interaction, Interval, Match, Player, Powerup, RosterEntry, \
+    SplatHeatmap, Team, Tile, util
+from .blobwriter import EventWriter, match_data, player_data
+from unittest import mock
+import unittest
+
+
+MAP_ROWS = [
+    [Tile.wall, Tile.wall, Tile.wall, Tile.wall],
+    [Tile.wall, Tile.flag_red, Tile.floor, Tile.wall],
+    [Tile.wall, Tile.floor, Tile.flag_blue, Tile.wall],
+    [Tile.wall, Tile.wall, Tile.wall, Tile.wall],
+    [Tile.spike, Tile.bomb, Tile.empty, Tile.empty],
+]
+
+
+def sample_data():
+    """
+    A short match with three players: foo (red) captures once, bar (blue)
+    gets returned and popped, and baz joins red late, switches to blue and
+    quits.
+    """
+    foo = EventWriter(Team.red)\
+        .record(100, grab=True)\
+        .record(250, returns=1)\
+        .record(300, captures=1)\
+        .record(500, tags=1)\
+        .record(900, drop_pop=True)
+
+    bar = EventWriter(Team.blue)\
+        .record(150, grab=True, grab_flag=Flag.opponent)\
+        .record(250, drop_pop=True)\
+        .record(500, drop_pop=True)\
+        .record(600, powerups=Powerup.tagpro)\
+        .record(800, prevent=True)\
+        .record(1000, prevent=True)
+
+    baz = EventWriter(Team.none)\
+        .record(400, team=Team.red)\
+        .record(700, drop_pop=True)\
+        .record(1200, team=Team.blue)\
+        .record(1500, team=Team.none)
+
+    players = [
+        player_data('foo', Team.red, foo),
+        player_data('bar', Team.blue, bar),
+        player_data('baz', Team.none, baz),
+    ]
+
+    splats = (
+        [(45, 50), (130, 170)],
+        [(60, -10), (100, 100)],
+    )
+
+    return match_data(players, MAP_ROWS, splats=splats, duration=1800,
+                      scores=(1, 0))
+
+
+def sample_match():
+    return Match(sample_data())
+
+
+class TestSplats(unittest.TestCase):
+    def test_splats(self):
+        match = sample_match()
+        foo, bar, baz = match.players
+
+        red = match.team_red.splats
+        self.assertEqual([(s.time, s.x, s.y, s.player) for s in red],
+                         [(700, 45, 50, baz), (900, 130, 170, foo)])
+
+        blue = match.team_blue.splats
+        self.assertEqual([(s.time, s.x, s.y, s.player) for s in blue],
+                         [(250, 60, -10, bar), (500, 100, 100, bar)])
+
+        self.assertEqual([s.time for s in match.splats],
+                         [250, 500, 700, 900])
+
+    def test_splat_owners_single_pass(self):
+        match = sample_match()
+        with mock.patch.object(Player, 'parse_events', autospec=True,
+                               side_effect=Player.parse_events) as parse:
+            match.team_red.splats
+            match.team_blue.splats
+        self.assertEqual(parse.call_count, len(match.players))
+
+    def test_splats_without_numpy(self):
+        with mock.patch('tagpro_eu.match.numpy', None):
+            expected = sample_match().team_red.splats
+        self.assertEqual(sample_match().team_red.splats, expected)
+
+    def test_splat_arrays(self):
+        try:
+            import numpy  # noqa: F401
+        except ImportError:
+            self.skipTest('numpy is not installed')
+
+        a = sample_match().team_red.splat_arrays
+        self.assertEqual(a.time.tolist(), [700, 900])
+        self.assertEqual(a.x.tolist(), [45, 130])
+        self.assertEqual(a.y.tolist(), [50, 170])
+        self.assertEqual(a.player.tolist(), [2, 0])
+
+
+class TestSplatHeatmap(unittest.TestCase):
+    def setUp(self):
+        try:
+            import numpy  # noqa: F401
+        except ImportError:
+            self.skipTest('numpy is not installed')
+
+    def test_add(self):
+        match = sample_match()
+        heatmap = SplatHeatmap()
+        heatmap.add(match)
+        heatmap.add(sample_match())
+
+        grid = heatmap[match.map.fingerprint]
+        self.assertEqual(grid.shape, (2, 5, 4))
+        self.assertEqual(grid[0, 1, 1], 2)
+        self.assertEqual(grid[0, 4, 3], 2)
+        self.assertEqual(grid[1, 0, 1], 2)
+        self.assertEqual(grid[1, 2, 2], 2)
+        self.assertEqual(grid.sum(), 8)
+        self.assertEqual(heatmap.matches[match.map.fingerprint], 2)
+
+    def test_add_single_pass(self):
+        match = sample_match()
+        with mock.patch.object(Player, 'parse_events', autospec=True,
+                               side_effect=Player.parse_events) as parse:
+            SplatHeatmap().add(match)
+        self.assertEqual(parse.call_count, len(match.players))
+
+    def test_merge(self):
+        h1 = SplatHeatmap(resolution=80)
+        h2 = SplatHeatmap(resolution=80)
+        h1.add(sample_match())
+        h2.add(sample_match())
+        h1.merge(h2)
+
+        key = sample_match().map.fingerprint
+        self.assertEqual(h1[key].shape, (2, 3, 2))
+        self.assertEqual(h1[key].sum(), 8)
+        self.assertEqual(h1.to_arrays()[key].tolist(),
+                         h1[key].tolist())
+
+        with self.assertRaises(ValueError):
+            h1.merge(SplatHeatmap())
+
+
+class TestState(unittest.TestCase):
+    def setUp(self):
+        self.match = sample_match()
+
+    def test_state_at(self):
+        foo, bar, baz = self.match.state_at(0)
+        self.assertEqual(foo.team, Team.red)
+        self.assertEqual(baz.team, Team.none)
+
+        foo, bar, baz = self.match.state_at(150)
+        self.assertEqual(foo.flag, Flag.opponent)
+        self.assertEqual(bar.flag, Flag.opponent)
+
+        # Events in the given frame are included
+        foo, bar, baz = self.match.state_at(250)
+        self.assertEqual(foo.flag, Flag.opponent)
+        self.assertEqual(bar.flag, Flag.none)
+        self.assertEqual(self.match.state_at(299)[0].flag, Flag.opponent)
+        self.assertEqual(self.match.state_at(300)[0].flag, Flag.none)
+
+        foo, bar, baz = self.match.state_at(900)
+        self.assertEqual(bar.powers, Powerup.tagpro)
+        self.assertTrue(bar.prevent)
+        self.assertEqual(baz.team, Team.red)
+
+        foo, bar, baz = self.match.state_at(1300)
+        self.assertFalse(bar.prevent)
+        self.assertEqual(baz.team, Team.blue)
+        self.assertEqual(self.match.state_at(1500)[2].team, Team.none)
+
+    def test_intervals(self):
+        self.assertEqual(self.match.intervals('flag'), [
+            Interval(100, 300, 0, Flag.opponent),
+            Interval(150, 250, 1, Flag.opponent),
+        ])
+        self.assertEqual(self.match.intervals('flag', 260, 1000),
+                         [Interval(100, 300, 0, Flag.opponent)])
+        self.assertEqual(self.match.intervals('flag', 300, 1000), [])
+        self.assertEqual(self.match.intervals('prevent', 0, 800),
+                         [Interval(800, 1000, 1, True)])
+
+        team = self.match.intervals('team', 1000, 1300)
+        self.assertEqual([(i.start, i.end, i.value) for i in team
+                          if i.player == 2],
+                         [(400, 1200, Team.red), (1200, 1500, Team.blue)])
+
+        with self.assertRaises(ValueError):
+            self.match.intervals('score')
+
+
+class TestTeamStats(unittest.TestCase):
+    def setUp(self):
+        self.match = sample_match()
+        self.foo, self.bar, self.baz = self.match.players
+
+    def test_players(self):
+        red = self.match.team_red
+        self.assertEqual(red.players, [self.foo])
+        self.assertIs(red.players, red.players)
+
+    def test_roster(self):
+        self.assertEqual(self.match.team_red.roster, [
+            RosterEntry(self.foo, 0, 1800),
+            RosterEntry(self.baz, 400, 1200),
+        ])
+        self.assertEqual(self.match.team_blue.roster, [
+            RosterEntry(self.bar, 0, 1800),
+            RosterEntry(self.baz, 1200, 1500),
+        ])
+
+    def test_cap_times(self):
+        self.assertEqual(self.match.team_red.cap_times, [300])
+        self.assertEqual(self.match.team_blue.cap_times, [])
+
+    def test_stats(self):
+        red = self.match.team_red.stats
+        blue = self.match.team_blue.stats
+
+        # baz played for red from 400 until 1200 and popped at 700
+        self.assertEqual(red.time, 1800 + 800)
+        self.assertEqual(red.pops, 2)
+        self.assertEqual(red.captures, 1)
+        self.assertEqual(red.hold, 200)
+
+        self.assertEqual(blue.time, 1800 + 300)
+        self.assertEqual(blue.pops, 2)
+        self.assertEqual(blue.drops, 1)
+        self.assertEqual(blue.prevent, 200)
+        self.assertEqual(blue.pups[Powerup.tagpro], 1)
+
+
+class TestInteractions(unittest.TestCase):
+    def test_sample(self):
+        match = sample_match()
+        foo, bar, baz = match.players
+
+        interactions, ambiguous = match.interactions()
+        self.assertEqual(interactions, [
+            Interaction(250, 'return', foo, bar),
+            Interaction(500, 'tag', foo, bar),
+        ])
+        self.assertEqual(ambiguous, [])
+
+    def test_ambiguous(self):
+        red = [EventWriter(Team.red).record(100, tags=1).record(200, tags=1)
+               for _ in range(2)]
+        blue = [EventWriter(Team.blue).record(100, drop_pop=True)
+                for _ in range(2)]
+        blue[0].record(200, drop_pop=True)
+
+        players = [player_data(f'p{i}', e.team, e)
+                   for i, e in enumerate(red + blue)]
+        match = Match(match_data(players, MAP_ROWS, duration=300))
+        p = match.players
+
+        interactions, ambiguous = match.interactions()
+        self.assertEqual(interactions, [])
+        self.assertEqual(ambiguous, [
+            AmbiguousFrame(100, 'tag', [p[0], p[1]], [p[2], p[3]]),
+            AmbiguousFrame(200, 'tag', [p[0], p[1]], [p[2]]),
+        ])
+
+
+@unittest.skipIf(util.numpy is None, 'numpy is not installed')
+class TestCooccurrence(unittest.TestCase):
+    def test_build(self):
+        builder = CooccurrenceBuilder()
+        builder.update([sample_match(), sample_match()])
+        m = builder.build()
+
+        self.assertEqual(sorted(m.names), ['bar', 'baz', 'foo'])
+        self.assertEqual(m.get('foo', 'bar'), {
+            'together': 0, 'opposed': 2, 'diff_together': 0,
+            'diff_opposed': 2,
+        })
+        self.assertEqual(m.get('bar', 'foo')['diff_opposed'], -2)
+
+        # baz played with and against both of them
+        self.assertEqual(set(m.row('baz')), {'foo', 'bar'})
+        self.assertEqual(m.get('baz', 'foo')['together'], 2)
+        self.assertEqual(m.get('baz', 'foo')['opposed'], 2)
+        self.assertEqual(m.get('foo', 'qux')['together'], 0)
+
+        self.assertEqual(list(m.indptr), [0, 2, 4, 6])
+
+    def test_single_pass(self):
+        match = sample_match()
+        with mock.patch.object(Player, 'parse_events', autospec=True,
+                               side_effect=Player.parse_events) as parse:
+            CooccurrenceBuilder().add(match)
+        self.assertEqual(parse.call_count, len(match.players))
+
+    def test_merge(self):
+        a, b, c = CooccurrenceBuilder(), CooccurrenceBuilder(), \
+            CooccurrenceBuilder()
+        a.add(sample_match())
+        b.add(sample_match())
+        c.update([sample_match(), sample_match()])
+
+        merged = a.merge(b).build()
+        expected = c.build()
+        for name in expected.names:
+            self.assertEqual(merged.row(name), expected.row(name))
+
+    def test_scipy(self):
+        builder = CooccurrenceBuilder()
+        builder.add(sample_match())
+        m = builder.build()
+
+        try:
+            import scipy  # noqa: F401
+        except ImportError:
+            with self.assertRaises(ImportError):
+                m.to_scipy('together')
+        else:
+            matrix = m.to_scipy('opposed')
+            self.assertEqual(matrix.shape, (3, 3))
+            self.assertEqual(matrix.sum(), 4)
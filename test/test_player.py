@@ -0,0 +1,120 @@
+from tagpro_eu import BucketedStats, PlayerStats, Powerup, PowerupMap, Time
+from .test_match import sample_match
+from unittest import mock
+import unittest
+
+
+class TestPlayerStats(unittest.TestCase):
+    def setUp(self):
+        self.match = sample_match()
+        self.stats = [p.stats for p in self.match.players]
+
+    def assertStatsEqual(self, a, b):
+        for f in PlayerStats.stat_fields:
+            self.assertEqual(getattr(a, f), getattr(b, f), f)
+        self.assertEqual(a.pups, b.pups)
+        self.assertEqual(a.pup_time, b.pup_time)
+
+    def test_slots(self):
+        with self.assertRaises(AttributeError):
+            self.stats[0].foo = 1
+
+    def test_pups(self):
+        bar = self.stats[1]
+        self.assertEqual(bar.pups[Powerup.tagpro], 1)
+        self.assertEqual(bar.pups[Powerup.juke_juice], 0)
+        self.assertEqual(dict(bar.pups), {Powerup.tagpro: 1})
+        self.assertEqual(bar.pup_time[Powerup.tagpro], 1200)
+        self.assertEqual(bar.pups_total, 1)
+
+        with self.assertRaises(KeyError):
+            bar.pups[Powerup.all]
+
+    def test_add(self):
+        total = self.stats[0] + self.stats[1]
+        self.assertEqual(total.tags, 2)
+        self.assertEqual(total.pups, {Powerup.tagpro: 1})
+        self.assertEqual(self.stats[0].pups, {})
+
+        self.assertStatsEqual(sum(self.stats), total + self.stats[2])
+        self.assertStatsEqual(PlayerStats.sum(self.stats),
+                              total + self.stats[2])
+
+    def test_sum_allocations(self):
+        stats = self.stats * 100
+        expected = sum(stats)
+
+        with mock.patch.object(PlayerStats, '__init__', autospec=True,
+                               side_effect=PlayerStats.__init__) as init, \
+                mock.patch.object(PowerupMap, '__init__', autospec=True,
+                                  side_effect=PowerupMap.__init__) as maps:
+            total = PlayerStats.sum(stats)
+
+        self.assertEqual(init.call_count, 1)
+        self.assertEqual(maps.call_count, 3)
+        self.assertStatsEqual(total, expected)
+
+    def test_iadd(self):
+        stats = PlayerStats()
+        before = stats
+        for s in self.stats:
+            stats += s
+
+        self.assertIs(stats, before)
+        self.assertStatsEqual(stats, PlayerStats.sum(self.stats))
+
+        stats += self.stats[1]
+        self.assertEqual(stats.pups[Powerup.tagpro], 2)
+        self.assertEqual(self.stats[1].pups[Powerup.tagpro], 1)
+
+
+class TestPowerupMap(unittest.TestCase):
+    def test_mapping(self):
+        m = PowerupMap()
+        m[Powerup.top_speed] += 2
+        m[Powerup.none] += 1
+
+        self.assertIn(Powerup.top_speed, m)
+        self.assertNotIn(Powerup.tagpro, m)
+        self.assertEqual(len(m), 2)
+        self.assertEqual(sorted(m.values()), [1, 2])
+        self.assertEqual(m.get(Powerup.tagpro, 5), 5)
+
+        m += {Powerup.tagpro: 3}
+        self.assertEqual(m[Powerup.tagpro], 3)
+
+
+class TestBucketedStats(unittest.TestCase):
+    def setUp(self):
+        self.match = sample_match()
+
+    def test_total(self):
+        for player in self.match.players:
+            handler = BucketedStats(Time.from_seconds(5))
+            player.parse_events(handler)
+
+            total = handler.total()
+            for f in PlayerStats.stat_fields[:-2]:
+                self.assertEqual(getattr(total, f), getattr(player.stats, f),
+                                 f)
+            self.assertEqual(total.pups, player.stats.pups)
+            self.assertEqual(total.pup_time, player.stats.pup_time)
+
+    def test_buckets(self):
+        handler = BucketedStats(Time.from_seconds(5))
+        self.match.players[1].parse_events(handler)
+
+        # The match lasts 1800 frames, in buckets of 300
+        self.assertEqual(len(handler), 6)
+        self.assertEqual([int(t) for t, _ in handler],
+                         [0, 300, 600, 900, 1200, 1500])
+        self.assertEqual([b.pops for b in handler.buckets],
+                         [1, 1, 0, 0, 0, 0])
+        self.assertEqual([b.hold for b in handler.buckets],
+                         [100, 0, 0, 0, 0, 0])
+        self.assertEqual([b.prevent for b in handler.buckets],
+                         [0, 0, 100, 100, 0, 0])
+        self.assertEqual([b.pup_time[Powerup.tagpro]
+                          for b in handler.buckets],
+                         [0, 0, 300, 300, 300, 300])
+        self.assertEqual([b.time for b in handler.buckets], [300] * 6)
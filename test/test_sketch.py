@@ -0,0 +1,74 @@
+from tagpro_eu import CountMinSketch, HyperLogLog, MatchSketches, \
+    QuantileSketch, bulk
+from .test_bulk import bulk_sample
+import pickle
+import unittest
+
+
+class TestHyperLogLog(unittest.TestCase):
+    def test_estimate(self):
+        a, b = HyperLogLog(), HyperLogLog()
+        for i in range(20000):
+            (a if i % 2 else b).add(f'player{i}')
+            a.add(f'player{i // 2}')
+
+        self.assertAlmostEqual(len(a), 15000, delta=15000 * 0.05)
+        self.assertAlmostEqual(len(a.__ior__(b)), 20000, delta=20000 * 0.05)
+
+    def test_small(self):
+        h = HyperLogLog()
+        for name in ['foo', 'bar', 'baz', 'foo']:
+            h.add(name)
+        self.assertEqual(len(h), 3)
+
+        with self.assertRaises(ValueError):
+            h |= HyperLogLog(10)
+
+
+class TestQuantileSketch(unittest.TestCase):
+    def test_quantiles(self):
+        a, b = QuantileSketch(), QuantileSketch(seed=1)
+        for i in range(20000):
+            (a if i % 3 else b).add(i)
+
+        self.assertLess(sum(map(len, a.compactors)), 2000)
+
+        a |= b
+        self.assertEqual(len(a), 20000)
+        for q, x in zip((0.1, 0.5, 0.9), a.quantiles([0.1, 0.5, 0.9])):
+            self.assertAlmostEqual(x, q * 20000, delta=20000 * 0.02)
+        self.assertAlmostEqual(a.rank(5000), 0.25, delta=0.02)
+
+    def test_empty(self):
+        self.assertIsNone(QuantileSketch().quantile(0.5))
+
+
+class TestCountMinSketch(unittest.TestCase):
+    def test_counts(self):
+        a, b = CountMinSketch(64, 4), CountMinSketch(64, 4)
+        for i in range(1000):
+            a.add(str(i % 100))
+        b.add('7', 5)
+
+        a |= b
+        self.assertGreaterEqual(a['7'], 15)
+        self.assertLessEqual(a['7'], 15 + 2 * 1005 // 64)
+
+
+class TestMatchSketches(unittest.TestCase):
+    def test_matches(self):
+        matches = [bulk.create_match(str(i), bulk_sample(i))
+                   for i in range(4)]
+
+        a, b = MatchSketches(), MatchSketches()
+        for i, m in enumerate(matches):
+            (a if i % 2 else b).add(m)
+
+        a = pickle.loads(pickle.dumps(a))
+        a.merge(b)
+
+        self.assertEqual(len(a.map_players[1]), 3)
+        self.assertEqual(a.games_together('foo', 'baz'), 4)
+        self.assertEqual(a.durations[1].quantile(0.5), 1800)
+        self.assertEqual(a.caps[1].quantile(0.5), 1)
+        self.assertEqual(a.stat_quantiles[1]['tags'].quantile(1), 2)
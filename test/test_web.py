@@ -0,0 +1,392 @@
+from tagpro_eu import MatchCache, web
+from http.server import BaseHTTPRequestHandler, HTTPServer
+import asyncio
+import gzip
+import json
+import os
+import requests
+import socketserver
+import tempfile
+import threading
+from unittest import mock
+import unittest
+
+
+def match_json(n, finished=True):
+    return {
+        'server': 'tagpro-test.koalabeast.com',
+        'port': n,
+        'date': 1500000000 + n,
+        'duration': 3600,
+        'finished': finished,
+        'players': [],
+        'teams': [{'name': 'Red'}, {'name': 'Blue'}],
+    }
+
+
+class MatchRequestHandler(BaseHTTPRequestHandler):
+    """
+    Serves matches on /match/<n>. Paths under /flaky/ fail once before
+    succeeding, paths under /live/ serve unfinished matches with an ETag,
+    paths under /plain/ are never compressed, and other paths give a 404.
+    """
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.requests.append(self.path)
+            first = self.path not in server.seen
+            server.seen.add(self.path)
+
+        parts = self.path.strip('/').split('/')
+
+        if parts[0] == 'flaky' and first:
+            self.send_error(503)
+        elif parts[0] == 'live' and \
+                self.headers.get('If-None-Match') == '"v1"':
+            self.send_response(304)
+            self.end_headers()
+        elif parts[0] in ('match', 'flaky', 'live', 'plain') and \
+                len(parts) == 2:
+            finished = parts[0] != 'live'
+            body = json.dumps(match_json(int(parts[1]), finished)).encode()
+            self.send_response(200)
+            if not finished:
+                self.send_header('ETag', '"v1"')
+            if parts[0] != 'plain' and \
+                    'gzip' in self.headers.get('Accept-Encoding', ''):
+                body = gzip.compress(body)
+                server.gzipped[self.path] = body
+                self.send_header('Content-Encoding', 'gzip')
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        else:
+            self.send_error(404)
+
+    def log_message(self, *args):
+        pass
+
+
+class ThreadingServer(socketserver.ThreadingMixIn, HTTPServer):
+    # http.server.ThreadingHTTPServer needs Python 3.7
+    daemon_threads = True
+
+
+class LocalServerTestCase(unittest.TestCase):
+    handler = MatchRequestHandler
+
+    def setUp(self):
+        self.server = ThreadingServer(('127.0.0.1', 0), self.handler)
+        self.server.lock = threading.Lock()
+        self.server.requests = []
+        self.server.seen = set()
+        self.server.gzipped = {}
+        self.thread = threading.Thread(target=self.server.serve_forever,
+                                       args=(0.01,), daemon=True)
+        self.thread.start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def url(self, path):
+        return f'http://127.0.0.1:{self.server.server_port}{path}'
+
+
+class TestMatchUrl(unittest.TestCase):
+    def test_match_url_to_id(self):
+        self.assertEqual(web.match_url_to_id(1743331), 1743331)
+        self.assertEqual(
+            web.match_url_to_id('https://tagpro.eu/?match=1743331'), 1743331)
+        self.assertEqual(
+            web.match_url_to_id('tagpro.eu/?download=1743331'), 1743331)
+        self.assertIsNone(web.match_url_to_id('https://example.com/1'))
+
+    def test_resolve(self):
+        self.assertEqual(web.resolve_match_url(id=5),
+                         (5, 'https://tagpro.eu/data/?match=5'))
+        self.assertEqual(web.resolve_match_url('http://example.com/5'),
+                         (None, 'http://example.com/5'))
+        with self.assertRaises(ValueError):
+            web.resolve_match_url()
+
+
+class TestDownload(LocalServerTestCase):
+    def test_download_match(self):
+        match = web.download_match(self.url('/match/3'))
+        self.assertEqual(match.port, 3)
+
+    def test_gzip(self):
+        match = web.download_match(self.url('/match/3'))
+        self.assertEqual(match.port, 3)
+        self.assertIn('/match/3', self.server.gzipped)
+
+    def test_download_error(self):
+        with self.assertRaises(requests.HTTPError):
+            web.download_match(self.url('/missing'))
+
+    def test_download_matches(self):
+        urls = [self.url(f'/match/{i}') for i in range(20)]
+        matches = list(web.download_matches(urls, max_workers=4))
+        self.assertEqual(sorted(m.port for m in matches), list(range(20)))
+        self.assertEqual(len(self.server.requests), 20)
+
+    def test_retry(self):
+        urls = [self.url(f'/flaky/{i}') for i in range(3)]
+        matches = web.download_matches(urls, max_workers=2,
+                                       backoff_factor=0.01)
+        self.assertEqual(sorted(m.port for m in matches), [0, 1, 2])
+        self.assertEqual(len(self.server.requests), 6)
+
+    def test_failure(self):
+        urls = [self.url('/match/1'), self.url('/missing')]
+        with self.assertRaises(requests.HTTPError):
+            list(web.download_matches(urls, max_workers=2))
+
+    def test_rate(self):
+        class Clock:
+            now = 100.0
+
+            def monotonic(self):
+                return self.now
+
+            def sleep(self, seconds):
+                self.now += seconds
+
+        clock = Clock()
+        limiter = web.RateLimiter(10)
+        times = []
+
+        with mock.patch.object(web, 'time', clock):
+            for _ in range(5):
+                limiter.wait()
+                times.append(clock.now)
+
+            # Calls after a pause don't have to wait
+            clock.now += 1
+            limiter.wait()
+            times.append(clock.now)
+
+        gaps = [b - a for a, b in zip(times, times[1:])]
+        for gap in gaps[:4]:
+            self.assertAlmostEqual(gap, 0.1)
+        self.assertAlmostEqual(gaps[4], 1)
+
+        unlimited = web.RateLimiter(None)
+        with mock.patch.object(web, 'time', clock):
+            start = clock.now
+            unlimited.wait()
+            unlimited.wait()
+            self.assertEqual(clock.now, start)
+
+
+class TestCache(LocalServerTestCase):
+    def setUp(self):
+        super().setUp()
+        self.tmp = tempfile.TemporaryDirectory()
+        self.cache = MatchCache(self.tmp.name)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+        super().tearDown()
+
+    def test_finished(self):
+        for _ in range(3):
+            match = web.download_match(self.url('/match/4'), cache=self.cache)
+            self.assertEqual(match.port, 4)
+        self.assertEqual(len(self.server.requests), 1)
+
+    def test_store_compressed(self):
+        web.download_match(self.url('/match/4'), cache=self.cache)
+
+        key = self.cache.key(raw_url=self.url('/match/4'))
+        with open(os.path.join(self.tmp.name, key + '.json.gz'), 'rb') as f:
+            self.assertEqual(f.read(), self.server.gzipped['/match/4'])
+
+    def test_store_uncompressed(self):
+        web.download_match(self.url('/plain/4'), cache=self.cache)
+
+        key = self.cache.key(raw_url=self.url('/plain/4'))
+        self.assertEqual(json.loads(self.cache.load(key).content),
+                         match_json(4))
+
+    def test_revalidate(self):
+        for _ in range(3):
+            match = web.download_match(self.url('/live/4'), cache=self.cache)
+            self.assertEqual(match.port, 4)
+            self.assertFalse(match.finished)
+        self.assertEqual(len(self.server.requests), 3)
+
+        key = self.cache.key(raw_url=self.url('/live/4'))
+        self.assertEqual(self.cache.load(key).etag, '"v1"')
+
+    def test_download_matches(self):
+        urls = [self.url(f'/match/{i}') for i in range(5)]
+        list(web.download_matches(urls, cache=self.cache))
+        list(web.download_matches(urls, cache=self.cache))
+        self.assertEqual(len(self.server.requests), 5)
+
+    def test_evict(self):
+        for i in range(5):
+            self.cache.store(f'k{i}', b'x' * 1000, True)
+        self.assertEqual(len(self.cache.entries()), 5)
+
+        self.cache.load('k0')
+        size = self.cache.entries()[0][1]
+        self.cache.evict(2 * size)
+
+        keys = [key for _, _, key in self.cache.entries()]
+        self.assertEqual(len(keys), 2)
+        self.assertIn('k0', keys)
+
+    def test_max_size(self):
+        self.cache.store('k', b'x' * 100, True)
+        size = self.cache.size()
+        cache = MatchCache(self.tmp.name, max_size=10 * size)
+        self.assertEqual(cache.size(), size)
+
+        with mock.patch('os.listdir', side_effect=AssertionError):
+            for i in range(500):
+                cache.store(f'k{i}', b'x' * 100, True)
+                self.assertLessEqual(cache.size(), 10 * size)
+
+        entries = cache.entries()
+        self.assertEqual([key for _, _, key in entries],
+                         [f'k{i}' for i in range(490, 500)])
+        self.assertEqual(cache.size(), sum(s for _, s, _ in entries))
+
+    def test_load_consistent(self):
+        self.cache.store('k', b'old', True, etag='"old"')
+        load = json.load
+
+        def store_while_loading(f):
+            # Store a new version between reading the meta and the data, and
+            # give it a moment to complete unless the cache is locked
+            meta = load(f)
+            thread = threading.Thread(target=self.cache.store, args=(
+                'k', b'new', True, '"new"'))
+            thread.start()
+            thread.join(0.2)
+            threads.append(thread)
+            return meta
+
+        threads = []
+        with mock.patch('json.load', side_effect=store_while_loading):
+            entry = self.cache.load('k')
+        threads[0].join()
+
+        self.assertEqual((entry.content, entry.etag), (b'old', '"old"'))
+        entry = self.cache.load('k')
+        self.assertEqual((entry.content, entry.etag), (b'new', '"new"'))
+
+    def test_orphan_meta(self):
+        self.cache.store('k', b'x', True)
+        os.unlink(os.path.join(self.tmp.name, 'k.json.gz'))
+
+        self.assertEqual(self.cache.entries(), [])
+        self.assertEqual(os.listdir(self.tmp.name), [])
+
+
+class AsyncMatchServer:
+    """
+    Minimal asyncio HTTP server, serving matches on /match/<n> and giving a
+    404 otherwise. Keeps track of the maximum number of concurrent requests.
+    """
+    def __init__(self):
+        self.active = 0
+        self.max_active = 0
+        self.requests = 0
+
+    async def start(self):
+        self.server = await asyncio.start_server(self.handle, '127.0.0.1', 0)
+        self.port = self.server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        self.server.close()
+        await self.server.wait_closed()
+
+    def url(self, path):
+        return f'http://127.0.0.1:{self.port}{path}'
+
+    async def handle(self, reader, writer):
+        request = await reader.readline()
+        while (await reader.readline()).strip():
+            pass
+
+        self.requests += 1
+        self.active += 1
+        self.max_active = max(self.max_active, self.active)
+        await asyncio.sleep(0.01)
+        self.active -= 1
+
+        parts = request.split()[1].decode().strip('/').split('/')
+        if parts[0] == 'match':
+            status = b'200 OK'
+            body = json.dumps(match_json(int(parts[1]))).encode()
+        else:
+            status = b'404 Not Found'
+            body = b''
+
+        writer.write(b'HTTP/1.1 ' + status + b'\r\n'
+                     b'Content-Type: application/json\r\n'
+                     b'Content-Length: ' + str(len(body)).encode() + b'\r\n'
+                     b'Connection: close\r\n\r\n' + body)
+        await writer.drain()
+        writer.close()
+
+
+@unittest.skipIf(web.aiohttp is None, 'aiohttp is not installed')
+class TestAsyncDownload(unittest.TestCase):
+    def run_with_server(self, coro):
+        async def main():
+            server = AsyncMatchServer()
+            await server.start()
+            try:
+                return await coro(server)
+            finally:
+                await server.stop()
+
+        # asyncio.run needs Python 3.7
+        loop = asyncio.new_event_loop()
+        try:
+            return loop.run_until_complete(main())
+        finally:
+            loop.run_until_complete(loop.shutdown_asyncgens())
+            loop.close()
+
+    def test_fetch_match(self):
+        async def test(server):
+            return await web.fetch_match(server.url('/match/7'))
+
+        match = self.run_with_server(test)
+        self.assertEqual(match.port, 7)
+
+    def test_fetch_decode(self):
+        async def test(server, **kwargs):
+            await web.fetch_match(server.url('/match/7'), **kwargs)
+
+        # Events are decoded in the executor by default
+        for kwargs, decode in (({}, True), ({'decode': False}, False)):
+            with mock.patch.object(web, 'parse_match',
+                                   wraps=web.parse_match) as parse:
+                self.run_with_server(lambda s: test(s, **kwargs))
+            self.assertIs(parse.call_args[0][2], decode)
+
+    def test_fetch_matches(self):
+        async def test(server):
+            urls = [server.url(f'/match/{i}') for i in range(10)]
+            ports = [m.port async for m in
+                     web.fetch_matches(urls, limit_per_host=3)]
+            return ports, server.max_active
+
+        ports, max_active = self.run_with_server(test)
+        self.assertEqual(sorted(ports), list(range(10)))
+        self.assertLessEqual(max_active, 3)
+
+    def test_fetch_error(self):
+        async def test(server):
+            await web.fetch_match(server.url('/missing'))
+
+        with self.assertRaises(web.aiohttp.ClientResponseError):
+            self.run_with_server(test)